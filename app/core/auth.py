@@ -1,3 +1,5 @@
+import threading
+from dataclasses import dataclass
 from datetime import datetime, timedelta
 from typing import Annotated
 
@@ -5,19 +7,35 @@ from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError, jwt
 from passlib.context import CryptContext
-from sqlalchemy.orm import Session
+from sqlalchemy import event, select
+from sqlalchemy.orm import object_session
 
+from app.models.site import Site
 from app.models.user import User, UserRole
+from app.models.user_site import user_site
 from app.schemas.user import TokenData
-from app.core.db_session import current_session
+from app.core.cache import LRUCache, named_caches
+from app.core.db_session import get_async_db_session, run_after_commit
+from app.core.password_pool import PasswordWorkerPool
+from app.core.tracing import start_span
 
-from settings import AUTH_SECRET_KEY, AUTH_ALGORITHM
+from settings import (
+    AUTH_SECRET_KEY,
+    AUTH_ALGORITHM,
+    BCRYPT_ROUNDS,
+    PASSWORD_HASH_MAX_QUEUE,
+    PASSWORD_HASH_WORKERS,
+    PRINCIPAL_CACHE_MAX_ENTRIES,
+)
 
 # Security configuration
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
 # Password hashing
-pwd_context = CryptContext(schemes=['bcrypt'], deprecated='auto')
+pwd_context = CryptContext(
+    schemes=['bcrypt'], deprecated='auto', bcrypt__rounds=BCRYPT_ROUNDS
+)
+password_pool = PasswordWorkerPool(PASSWORD_HASH_WORKERS, PASSWORD_HASH_MAX_QUEUE)
 
 # OAuth2 scheme
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl='token')
@@ -33,6 +51,16 @@ def get_password_hash(password: str) -> str:
     return pwd_context.hash(password)
 
 
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    """Verify a password on the password worker pool"""
+    return await password_pool.run(verify_password, plain_password, hashed_password)
+
+
+async def get_password_hash_async(password: str) -> str:
+    """Generate password hash on the password worker pool"""
+    return await password_pool.run(get_password_hash, password)
+
+
 def create_access_token(data: dict, expires_delta: timedelta | None = None) -> str:
     """Create JWT access token"""
     to_encode = data.copy()
@@ -45,11 +73,98 @@ def create_access_token(data: dict, expires_delta: timedelta | None = None) -> s
     return encoded_jwt
 
 
+@dataclass(frozen=True)
+class Principal:
+    """Authenticated user as seen by request handlers"""
+
+    id: int
+    username: str
+    email: str
+    role: UserRole
+    is_active: bool
+    authorized_site_ids: frozenset[int]
+
+
+# Principals keyed by access token, each expiring with its token.
+# The cache is per process and invalidated by this process's commits only:
+# a change committed by another worker reaches this one's entries when the
+# token expires, at most ACCESS_TOKEN_EXPIRE_MINUTES later. Checking a shared
+# counter on every hit would put a cache server round trip back on each
+# request, which is what this cache exists to avoid.
+_principal_cache = LRUCache(PRINCIPAL_CACHE_MAX_ENTRIES)
+named_caches['principal'] = _principal_cache
+
+# Number of invalidations so far. A principal is only cached if none ran
+# while it was loaded, as the load may have read the data before the change.
+_invalidations = 0
+_invalidations_lock = threading.Lock()
+
+
+async def _load_principal(username: str) -> Principal | None:
+    """Load a user and its authorized site IDs"""
+    async with get_async_db_session() as db:
+        user = await db.scalar(select(User).where(User.username == username))
+        if user is None:
+            return None
+        site_ids = await db.execute(
+            select(user_site.c.site_id).where(user_site.c.user_id == user.id)
+        )
+        return Principal(
+            id=user.id,
+            username=user.username,
+            email=user.email,
+            role=user.role,
+            is_active=user.is_active,
+            authorized_site_ids=frozenset(site_id for (site_id,) in site_ids),
+        )
+
+
+def invalidate_principal(user_id: int) -> None:
+    """Drop every cached principal of a user, e.g. after it was modified"""
+    global _invalidations
+    with _invalidations_lock:
+        _invalidations += 1
+    _principal_cache.delete_where(lambda token, principal: principal.id == user_id)
+
+
+def _invalidate_principal_on_commit(target, user_id: int) -> None:
+    session = object_session(target)
+    if session is None:
+        invalidate_principal(user_id)
+    else:
+        run_after_commit(lambda: invalidate_principal(user_id), session)
+
+
+# Changes to user_site made through either side of the relationship
+@event.listens_for(User.authorized_sites, 'append')
+@event.listens_for(User.authorized_sites, 'remove')
+def _user_sites_changed(user, site, initiator):
+    _invalidate_principal_on_commit(user, user.id)
+
+
+@event.listens_for(Site.authorized_users, 'append')
+@event.listens_for(Site.authorized_users, 'remove')
+def _site_users_changed(site, user, initiator):
+    _invalidate_principal_on_commit(site, user.id)
+
+
 async def get_current_user(
     token: Annotated[str, Depends(oauth2_scheme)],
-    db: Session = Depends(current_session),
-) -> User:
-    """Get current user from token"""
+) -> Principal:
+    """
+    Get current user from token.
+    Principals are cached per token until the token expires, so repeated
+    requests skip both JWT decoding and the user lookup.
+    """
+    principal = _principal_cache.get(token)
+    if principal is not None:
+        return principal
+    with start_span('auth.authenticate'):
+        return await _authenticate(token)
+
+
+async def _authenticate(token: str) -> Principal:
+    """Decode a token and load its user, caching the principal"""
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail='Could not validate credentials',
@@ -64,22 +179,26 @@ async def get_current_user(
     except JWTError:
         raise credentials_exception
 
-    user = db.query(User).filter(User.username == token_data.username).first()
-    if user is None:
+    invalidations = _invalidations
+    principal = await _load_principal(token_data.username)
+    if principal is None:
         raise credentials_exception
-    return user
+    with _invalidations_lock:
+        if invalidations == _invalidations:
+            _principal_cache.set(token, principal, expires_at=payload.get('exp'))
+    return principal
 
 
 async def get_current_active_user(
-    current_user: Annotated[User, Depends(get_current_user)],
-) -> User:
+    current_user: Annotated[Principal, Depends(get_current_user)],
+) -> Principal:
     """Get current active user"""
     if not current_user.is_active:
         raise HTTPException(status_code=400, detail='Inactive user')
     return current_user
 
 
-def check_technician_permission(user: User) -> None:
+def check_technician_permission(user: Principal) -> None:
     """Check if user has technician permissions"""
     if user.role not in [UserRole.TECHNICIAN, UserRole.ADMIN]:
         raise HTTPException(
@@ -87,7 +206,7 @@ def check_technician_permission(user: User) -> None:
         )
 
 
-def check_admin_permission(user: User) -> None:
+def check_admin_permission(user: Principal) -> None:
     """Check if user has admin permissions"""
     if user.role != UserRole.ADMIN:
         raise HTTPException(
@@ -97,8 +216,8 @@ def check_admin_permission(user: User) -> None:
 
 # Dependency for checking technician permissions
 async def get_technician_user(
-    current_user: Annotated[User, Depends(get_current_active_user)],
-) -> User:
+    current_user: Annotated[Principal, Depends(get_current_active_user)],
+) -> Principal:
     """Get current user with technician permissions"""
     check_technician_permission(current_user)
     return current_user
@@ -106,31 +225,46 @@ async def get_technician_user(
 
 # Dependency for checking admin permissions
 async def get_admin_user(
-    current_user: Annotated[User, Depends(get_current_active_user)],
-) -> User:
+    current_user: Annotated[Principal, Depends(get_current_active_user)],
+) -> Principal:
     """Get current user with admin permissions"""
     check_admin_permission(current_user)
     return current_user
 
 
-def check_site_authorization(user: User, site_id: int) -> None:
+def check_site_authorization(user: Principal, site_id: int) -> None:
     """Check if user is authorized to access a site"""
     # Admin users have access to all sites
     if user.role == UserRole.ADMIN:
         return
 
     # Check if user is authorized for the site
-    if not any(site.id == site_id for site in user.authorized_sites):
+    if site_id not in user.authorized_site_ids:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail='Not authorized to access this site',
         )
 
 
+def authorized_site_ids(user: Principal) -> frozenset[int] | None:
+    """IDs of the sites a user may access, or None if unrestricted (admin)"""
+    if user.role == UserRole.ADMIN:
+        return None
+    return user.authorized_site_ids
+
+
+def authorization_scope(user: Principal) -> str:
+    """Stable key of what a user may see, for caching per-scope responses"""
+    site_ids = authorized_site_ids(user)
+    if site_ids is None:
+        return 'all'
+    return 'sites:' + ','.join(map(str, sorted(site_ids)))
+
+
 # Dependency for checking site authorization
 async def get_authorized_user_for_site(
-    site_id: int, current_user: Annotated[User, Depends(get_current_active_user)]
-) -> User:
+    site_id: int, current_user: Annotated[Principal, Depends(get_current_active_user)]
+) -> Principal:
     """Get current user with site authorization"""
     check_site_authorization(current_user, site_id)
     return current_user
@@ -0,0 +1,447 @@
+import asyncio
+import pickle
+import secrets
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Awaitable, Callable, Hashable
+
+from settings import (
+    CACHE_BACKEND,
+    CACHE_DEFAULT_TTL_SECONDS,
+    CACHE_MAX_ENTRIES,
+    CACHE_URL,
+)
+
+
+class LRUCache:
+    """
+    Thread-safe, size-bounded LRU mapping with optional per-entry expiry.
+    `expires_at` is a UNIX timestamp; expired entries count as misses.
+    """
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._data: OrderedDict[Hashable, tuple[object, float | None]] = OrderedDict()
+
+    def get(self, key: Hashable, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                value, expires_at = entry
+                if expires_at is None or expires_at > time.time():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def set(self, key: Hashable, value, expires_at: float | None = None) -> None:
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def delete(self, key: Hashable) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    def delete_where(self, predicate: Callable[[Hashable, object], bool]) -> int:
+        """Delete every entry for which predicate(key, value) is true"""
+        with self._lock:
+            keys = [
+                key for key, (value, _) in self._data.items() if predicate(key, value)
+            ]
+            for key in keys:
+                del self._data[key]
+            return len(keys)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> dict:
+        return {'hits': self.hits, 'misses': self.misses, 'entries': len(self)}
+
+
+class CacheBackend(ABC):
+    """
+    Key-value cache used by the service layer.
+
+    Besides single and batched get/set, get_or_set() offers stampede
+    protection: concurrent callers missing the same key wait for a single
+    loader call instead of all running it.
+    Values of None are not distinguished from misses. Every lookup a caller
+    makes counts as exactly one hit or miss; internal re-checks do not.
+
+    Methods ending in _async are for code running on the event loop. They
+    default to the sync methods, which is right for in-process backends;
+    backends doing network I/O override them.
+    """
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self._flights_lock = threading.Lock()
+        self._flights: dict[str, threading.Lock] = {}
+        self._async_flights: dict[str, asyncio.Future] = {}
+
+    def get(self, key: str):
+        value = self._get(key)
+        self._count(value is not None)
+        return value
+
+    @abstractmethod
+    def _get(self, key: str):
+        """Cached value of key or None, without counting a lookup"""
+
+    @abstractmethod
+    def set(self, key: str, value, ttl: float | None = None) -> None:
+        """Cache value under key, expiring after ttl seconds if given"""
+
+    @abstractmethod
+    def delete(self, key: str) -> None:
+        """Drop key from the cache"""
+
+    async def get_async(self, key: str):
+        value = await self._get_async(key)
+        self._count(value is not None)
+        return value
+
+    async def _get_async(self, key: str):
+        return self._get(key)
+
+    async def set_async(self, key: str, value, ttl: float | None = None) -> None:
+        self.set(key, value, ttl)
+
+    def get_many(self, keys: list[str]) -> dict[str, object]:
+        """Values of the keys that are cached; missing keys are left out"""
+        values = {key: self.get(key) for key in keys}
+        return {key: value for key, value in values.items() if value is not None}
+
+    def set_many(self, items: dict[str, object], ttl: float | None = None) -> None:
+        for key, value in items.items():
+            self.set(key, value, ttl)
+
+    @abstractmethod
+    def incr(self, key: str) -> int:
+        """Atomically increment an integer counter, starting from 0"""
+
+    @abstractmethod
+    def counter(self, key: str) -> int:
+        """Current value of a counter maintained with incr()"""
+
+    async def counter_async(self, key: str) -> int:
+        return self.counter(key)
+
+    def get_or_set(self, key: str, loader: Callable[[], object], ttl=None):
+        """Return the cached value of key, running loader once on a miss"""
+        value = self.get(key)
+        if value is not None:
+            return value
+        return self.load_missing(key, loader, ttl)
+
+    def load_missing(self, key: str, loader: Callable[[], object], ttl=None):
+        """
+        Load a key the caller already looked up and missed, running loader
+        once across concurrent callers. Blocks while another caller loads,
+        so async code must call it from a worker thread.
+        """
+        with self._flights_lock:
+            flight = self._flights.setdefault(key, threading.Lock())
+        with flight:
+            try:
+                # Another caller may have loaded it while we waited
+                value = self._get(key)
+                if value is None:
+                    value = self._load(key, loader, ttl)
+                return value
+            finally:
+                with self._flights_lock:
+                    self._flights.pop(key, None)
+
+    def _load(self, key: str, loader: Callable[[], object], ttl):
+        value = loader()
+        self.set(key, value, ttl)
+        return value
+
+    async def get_or_set_async(
+        self, key: str, loader: Callable[[], Awaitable[object]], ttl=None
+    ):
+        """
+        get_or_set() for async loaders: concurrent callers in this process
+        await a single loader call, which runs on the event loop.
+        """
+        value = await self.get_async(key)
+        if value is not None:
+            return value
+        flight = self._async_flights.get(key)
+        if flight is None:
+            flight = asyncio.ensure_future(self._load_async(key, loader, ttl))
+            self._async_flights[key] = flight
+            flight.add_done_callback(lambda _: self._async_flights.pop(key, None))
+        # A cancelled caller must not cancel the load the others wait for
+        return await asyncio.shield(flight)
+
+    async def _load_async(self, key: str, loader: Callable[[], Awaitable[object]], ttl):
+        value = await loader()
+        await self.set_async(key, value, ttl)
+        return value
+
+    def stats(self) -> dict:
+        return {'hits': self.hits, 'misses': self.misses}
+
+    def _count(self, hit: bool) -> None:
+        if hit:
+            self.hits += 1
+        else:
+            self.misses += 1
+
+
+class MemoryCacheBackend(CacheBackend):
+    """Bounded in-process LRU cache with per-entry TTL"""
+
+    def __init__(self, max_entries: int, default_ttl: float | None = None):
+        super().__init__()
+        self.default_ttl = default_ttl
+        self._entries = LRUCache(max_entries)
+        # Counters are kept apart so that LRU eviction never resets them
+        self._counter_lock = threading.Lock()
+        self._counters: dict[str, int] = {}
+
+    def _expires_at(self, ttl: float | None) -> float | None:
+        ttl = ttl or self.default_ttl
+        return time.time() + ttl if ttl else None
+
+    def _get(self, key: str):
+        return self._entries.get(key)
+
+    def set(self, key: str, value, ttl: float | None = None) -> None:
+        self._entries.set(key, value, self._expires_at(ttl))
+
+    def delete(self, key: str) -> None:
+        self._entries.delete(key)
+
+    def incr(self, key: str) -> int:
+        with self._counter_lock:
+            value = self._counters.get(key, 0) + 1
+            self._counters[key] = value
+            return value
+
+    def counter(self, key: str) -> int:
+        return self._counters.get(key, 0)
+
+    def stats(self) -> dict:
+        return {
+            **super().stats(),
+            'entries': len(self._entries),
+            'max_entries': self._entries.max_entries,
+        }
+
+
+class RedisCacheBackend(CacheBackend):
+    """
+    Cache shared by all workers, stored in a server speaking the Redis
+    protocol. Values are pickled, so the server must only be reachable by
+    trusted clients.
+
+    Stampede protection also spans workers: the first worker missing a key
+    takes a short-lived lock key holding a random token, and the others poll
+    for its result. Only the holder of the token releases the lock.
+
+    The _async methods talk to the server through a separate asyncio client,
+    so callers on the event loop never block it on network round trips.
+    """
+
+    def __init__(
+        self,
+        url: str | None = None,
+        client=None,
+        async_client=None,
+        prefix: str = 'wattstor:',
+        default_ttl: float | None = None,
+        lock_timeout: float = 10.0,
+        poll_interval: float = 0.05,
+    ):
+        super().__init__()
+        if client is None or async_client is None:
+            # Optional dependency, only needed when this backend is configured
+            import redis
+            import redis.asyncio
+
+            client = client or redis.Redis.from_url(url)
+            async_client = async_client or redis.asyncio.Redis.from_url(url)
+        self._client = client
+        self._async_client = async_client
+        self.prefix = prefix
+        self.default_ttl = default_ttl
+        self.lock_timeout = lock_timeout
+        self.poll_interval = poll_interval
+
+    def _key(self, key: str) -> str:
+        return self.prefix + key
+
+    def _px(self, ttl: float | None) -> int | None:
+        ttl = ttl or self.default_ttl
+        return int(ttl * 1000) if ttl else None
+
+    def _get(self, key: str):
+        raw = self._client.get(self._key(key))
+        return None if raw is None else pickle.loads(raw)
+
+    async def _get_async(self, key: str):
+        raw = await self._async_client.get(self._key(key))
+        return None if raw is None else pickle.loads(raw)
+
+    def set(self, key: str, value, ttl: float | None = None) -> None:
+        self._client.set(self._key(key), pickle.dumps(value), px=self._px(ttl))
+
+    async def set_async(self, key: str, value, ttl: float | None = None) -> None:
+        await self._async_client.set(
+            self._key(key), pickle.dumps(value), px=self._px(ttl)
+        )
+
+    def delete(self, key: str) -> None:
+        self._client.delete(self._key(key))
+
+    def get_many(self, keys: list[str]) -> dict[str, object]:
+        if not keys:
+            return {}
+        raws = self._client.mget([self._key(key) for key in keys])
+        values = {}
+        for key, raw in zip(keys, raws):
+            self._count(raw is not None)
+            if raw is not None:
+                values[key] = pickle.loads(raw)
+        return values
+
+    def set_many(self, items: dict[str, object], ttl: float | None = None) -> None:
+        pipeline = self._client.pipeline(transaction=False)
+        px = self._px(ttl)
+        for key, value in items.items():
+            pipeline.set(self._key(key), pickle.dumps(value), px=px)
+        pipeline.execute()
+
+    def incr(self, key: str) -> int:
+        return self._client.incr(self._key(key))
+
+    def counter(self, key: str) -> int:
+        return int(self._client.get(self._key(key)) or 0)
+
+    async def counter_async(self, key: str) -> int:
+        return int(await self._async_client.get(self._key(key)) or 0)
+
+    def _lock(self, key: str) -> bytes | None:
+        """Take the load lock of key; returns its token, or None if held"""
+        token = secrets.token_bytes(16)
+        locked = self._client.set(
+            self._key(f'lock:{key}'),
+            token,
+            nx=True,
+            px=int(self.lock_timeout * 1000),
+        )
+        return token if locked else None
+
+    async def _lock_async(self, key: str) -> bytes | None:
+        token = secrets.token_bytes(16)
+        locked = await self._async_client.set(
+            self._key(f'lock:{key}'),
+            token,
+            nx=True,
+            px=int(self.lock_timeout * 1000),
+        )
+        return token if locked else None
+
+    def _unlock(self, key: str, token: bytes) -> None:
+        """Release the load lock of key if it still holds our token"""
+        import redis
+
+        lock_key = self._key(f'lock:{key}')
+        with self._client.pipeline() as pipeline:
+            try:
+                # Compare-and-delete: the lock may have expired and been
+                # taken by another worker, whose lock must be left alone
+                pipeline.watch(lock_key)
+                if pipeline.get(lock_key) == token:
+                    pipeline.multi()
+                    pipeline.delete(lock_key)
+                    pipeline.execute()
+            except redis.WatchError:
+                pass
+
+    async def _unlock_async(self, key: str, token: bytes) -> None:
+        import redis
+
+        lock_key = self._key(f'lock:{key}')
+        async with self._async_client.pipeline() as pipeline:
+            try:
+                await pipeline.watch(lock_key)
+                if await pipeline.get(lock_key) == token:
+                    pipeline.multi()
+                    pipeline.delete(lock_key)
+                    await pipeline.execute()
+            except redis.WatchError:
+                pass
+
+    def _load(self, key: str, loader: Callable[[], object], ttl):
+        deadline = time.monotonic() + self.lock_timeout
+        token = self._lock(key)
+        while token is None:
+            # Another worker is loading the key; wait for its result
+            time.sleep(self.poll_interval)
+            value = self._get(key)
+            if value is not None:
+                return value
+            if time.monotonic() > deadline:
+                break
+            token = self._lock(key)
+        try:
+            return super()._load(key, loader, ttl)
+        finally:
+            if token is not None:
+                self._unlock(key, token)
+
+    async def _load_async(self, key: str, loader: Callable[[], Awaitable[object]], ttl):
+        deadline = time.monotonic() + self.lock_timeout
+        token = await self._lock_async(key)
+        while token is None:
+            await asyncio.sleep(self.poll_interval)
+            value = await self._get_async(key)
+            if value is not None:
+                return value
+            if time.monotonic() > deadline:
+                break
+            token = await self._lock_async(key)
+        try:
+            return await super()._load_async(key, loader, ttl)
+        finally:
+            if token is not None:
+                await self._unlock_async(key, token)
+
+
+def create_cache_backend(max_entries: int = CACHE_MAX_ENTRIES) -> CacheBackend:
+    """
+    Build the cache backend selected by CACHE_BACKEND. max_entries bounds
+    the in-process backend; the shared server manages its own memory.
+    """
+    if CACHE_BACKEND == 'redis':
+        return RedisCacheBackend(CACHE_URL, default_ttl=CACHE_DEFAULT_TTL_SECONDS)
+    if CACHE_BACKEND == 'memory':
+        return MemoryCacheBackend(max_entries, default_ttl=CACHE_DEFAULT_TTL_SECONDS)
+    raise ValueError(f'Unknown CACHE_BACKEND {CACHE_BACKEND!r}')
+
+
+cache = create_cache_backend()
+
+# Caches whose hit ratios are exported, by name; each has a stats() method
+# returning at least its 'hits' and 'misses'
+named_caches: dict[str, LRUCache | CacheBackend] = {'shared': cache}
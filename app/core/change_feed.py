@@ -0,0 +1,166 @@
+import asyncio
+import json
+import logging
+import os
+import uuid
+from typing import Awaitable, Callable
+
+import asyncpg
+from sqlalchemy import text
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import Session
+
+from settings import (
+    CHANGE_FEED_PING_SECONDS,
+    CHANGE_FEED_RECONNECT_SECONDS,
+    DATABASE_URL,
+)
+
+logger = logging.getLogger(__name__)
+
+# Channels of the change feed
+METRICS_CHANNEL = 'metric_changes'
+
+# Postgres rejects NOTIFY payloads of 8000 bytes or more
+MAX_PAYLOAD_BYTES = 7900
+
+# Tells this worker's notifications from other workers'
+WORKER_ID = f'{os.getpid()}-{uuid.uuid4().hex[:8]}'
+
+Handler = Callable[[dict], Awaitable[None] | None]
+
+
+def notify(session: Session, channel: str, key: str, entries: list) -> None:
+    """
+    NOTIFY `entries` on `channel` in the session's transaction, so listeners
+    only hear of them once it commits. Each notification carries this
+    worker's ID and as many entries (under `key`) as fit one payload.
+    """
+    chunks, chunk, size = [], [], 0
+    for entry in entries:
+        entry_size = len(json.dumps(entry, separators=(',', ':'))) + 1
+        if chunk and size + entry_size > MAX_PAYLOAD_BYTES - 64:
+            chunks.append(chunk)
+            chunk, size = [], 0
+        chunk.append(entry)
+        size += entry_size
+    if chunk:
+        chunks.append(chunk)
+    for chunk in chunks:
+        payload = json.dumps({'w': WORKER_ID, key: chunk}, separators=(',', ':'))
+        session.execute(
+            text('SELECT pg_notify(:channel, :payload)'),
+            {'channel': channel, 'payload': payload},
+        )
+
+
+class ChangeFeed:
+    """
+    Changes committed by any worker, heard over Postgres LISTEN/NOTIFY.
+
+    Each worker runs one listener on a dedicated connection (outside the
+    pools) and dispatches its notifications, in order, to the handlers of
+    their channel. Handlers skip the worker's own notifications unless they
+    ask for them. Notifications sent while the listener is disconnected are
+    lost, so after reconnecting it runs the reconnect hooks, which must drop
+    whatever state the missed notifications would have updated.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        reconnect_seconds: float = CHANGE_FEED_RECONNECT_SECONDS,
+        ping_seconds: float = CHANGE_FEED_PING_SECONDS,
+    ):
+        self.url = make_url(url)
+        self.reconnect_seconds = reconnect_seconds
+        self.ping_seconds = ping_seconds
+        self._handlers: dict[str, list[tuple[Handler, bool]]] = {}
+        self._reconnect_hooks: list[Callable[[], None]] = []
+        self.connected = asyncio.Event()
+        self.received = 0
+        self.reconnects = 0
+
+    @property
+    def supported(self) -> bool:
+        return self.url.get_backend_name() == 'postgresql'
+
+    def subscribe(self, channel: str, handler: Handler, own: bool = False) -> None:
+        """Call `handler` with each notification on `channel`"""
+        self._handlers.setdefault(channel, []).append((handler, own))
+
+    def on_reconnect(self, hook: Callable[[], None]) -> None:
+        self._reconnect_hooks.append(hook)
+
+    async def run(self) -> None:
+        """Listen and dispatch until cancelled, reconnecting on failures"""
+        queue: asyncio.Queue[tuple[str, str]] = asyncio.Queue()
+        dispatcher = asyncio.create_task(self._dispatch(queue))
+        dsn = self.url.set(drivername='postgresql').render_as_string(
+            hide_password=False
+        )
+        first = True
+        try:
+            while True:
+                try:
+                    await self._listen(dsn, queue, first)
+                except Exception:
+                    logger.warning('Change feed connection lost', exc_info=True)
+                first = False
+                await asyncio.sleep(self.reconnect_seconds)
+        finally:
+            dispatcher.cancel()
+
+    async def _listen(self, dsn: str, queue: asyncio.Queue, first: bool) -> None:
+        def on_notification(_, pid: int, channel: str, payload: str) -> None:
+            queue.put_nowait((channel, payload))
+
+        connection = await asyncpg.connect(dsn)
+        lost = asyncio.Event()
+        connection.add_termination_listener(lambda _: lost.set())
+        try:
+            for channel in self._handlers:
+                await connection.add_listener(channel, on_notification)
+            if not first:
+                self.reconnects += 1
+                for hook in self._reconnect_hooks:
+                    hook()
+            self.connected.set()
+            # Pings find connections that died without the socket noticing
+            while not lost.is_set():
+                try:
+                    await asyncio.wait_for(lost.wait(), self.ping_seconds)
+                except asyncio.TimeoutError:
+                    await connection.execute('SELECT 1', timeout=self.ping_seconds)
+        finally:
+            self.connected.clear()
+            if not connection.is_closed():
+                await connection.close(timeout=self.ping_seconds)
+
+    async def _dispatch(self, queue: asyncio.Queue) -> None:
+        while True:
+            channel, payload = await queue.get()
+            self.received += 1
+            await self.dispatch(channel, json.loads(payload))
+
+    async def dispatch(self, channel: str, payload: dict) -> None:
+        own = payload.get('w') == WORKER_ID
+        for handler, include_own in self._handlers.get(channel, []):
+            if own and not include_own:
+                continue
+            try:
+                result = handler(payload)
+                if result is not None:
+                    await result
+            except Exception:
+                logger.exception('Change feed handler %r failed', handler)
+
+    def stats(self) -> dict:
+        return {
+            'connected': self.connected.is_set(),
+            'received': self.received,
+            'reconnects': self.reconnects,
+        }
+
+
+change_feed = ChangeFeed(DATABASE_URL)
@@ -1,18 +1,125 @@
 from sqlalchemy import create_engine
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.ext.asyncio import (
+    AsyncEngine,
+    async_sessionmaker,
+    create_async_engine,
+)
+from sqlalchemy.pool import AsyncAdaptedQueuePool, NullPool, QueuePool
 from sqlalchemy.orm import sessionmaker, declarative_base
 
-from settings import DATABASE_URL
+from app.core.pool_stats import PoolStats, instrumented_pool_class
 
-engine = create_engine(
+from settings import (
     DATABASE_URL,
-    pool_size=10,
-    max_overflow=20,
-    pool_timeout=30,
-    pool_recycle=1800,
+    DB_JOB_MAX_OVERFLOW,
+    DB_JOB_POOL_SIZE,
+    DB_JOB_STATEMENT_TIMEOUT_MS,
+    DB_MAX_OVERFLOW,
+    DB_POOL_PRE_PING,
+    DB_POOL_RECYCLE,
+    DB_POOL_SIZE,
+    DB_POOL_TIMEOUT,
+    DB_STATEMENT_TIMEOUT_MS,
+    TESTING,
+)
+
+# Async drivers used for the request-serving engine, per sync dialect
+ASYNC_DRIVERS = {'postgresql': 'asyncpg', 'sqlite': 'aiosqlite'}
+
+
+def to_async_url(url: str) -> str:
+    """DATABASE_URL with its driver swapped for the dialect's async driver"""
+    url = make_url(url)
+    driver = ASYNC_DRIVERS.get(url.get_backend_name())
+    if driver is None:
+        raise ValueError(f'No async driver configured for {url.get_backend_name()}')
+    return url.set(drivername=f'{url.get_backend_name()}+{driver}').render_as_string(
+        hide_password=False
+    )
+
+
+REQUEST_POOL_OPTIONS = {
+    'pool_size': DB_POOL_SIZE,
+    'max_overflow': DB_MAX_OVERFLOW,
+    'pool_timeout': DB_POOL_TIMEOUT,
+    'pool_recycle': DB_POOL_RECYCLE,
+}
+JOB_POOL_OPTIONS = dict(
+    REQUEST_POOL_OPTIONS, pool_size=DB_JOB_POOL_SIZE, max_overflow=DB_JOB_MAX_OVERFLOW
 )
 
+
+def statement_timeout_args(url: str, timeout_ms: int) -> dict:
+    """Connect arguments setting a Postgres statement_timeout, per driver"""
+    url = make_url(url)
+    if not timeout_ms or url.get_backend_name() != 'postgresql':
+        return {}
+    if url.get_driver_name() == 'asyncpg':
+        return {'server_settings': {'statement_timeout': str(timeout_ms)}}
+    return {'options': f'-c statement_timeout={timeout_ms}'}
+
+
+def create_job_engine(
+    url: str,
+    role: str = 'jobs',
+    pool_options: dict = JOB_POOL_OPTIONS,
+    statement_timeout_ms: int = DB_JOB_STATEMENT_TIMEOUT_MS,
+) -> Engine:
+    """Sync engine, with its pool statistics registered under `role`"""
+    stats = PoolStats(role)
+    engine = create_engine(
+        url,
+        poolclass=instrumented_pool_class(QueuePool, stats),
+        pool_pre_ping=DB_POOL_PRE_PING,
+        connect_args=statement_timeout_args(url, statement_timeout_ms),
+        **pool_options,
+    )
+    stats.attach(engine)
+    return engine
+
+
+# Sync engine, used by background jobs and scripts
+engine = create_job_engine(DATABASE_URL)
+
 # SessionLocal is used in service layer, not through router DI
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+
+def create_request_engine(
+    url: str,
+    role: str = 'primary',
+    statement_timeout_ms: int = DB_STATEMENT_TIMEOUT_MS,
+) -> AsyncEngine:
+    """
+    Async engine for the request-serving service layer (the primary or a
+    read replica), with its pool statistics registered under `role`. The
+    pool class is explicit because some async dialects (aiosqlite) default
+    to no pooling. Test clients may run each request on its own event loop,
+    and async connections cannot move between loops, so tests do not pool.
+    """
+    url = to_async_url(url)
+    stats = PoolStats(role)
+    options = {} if TESTING else REQUEST_POOL_OPTIONS
+    async_engine = create_async_engine(
+        url,
+        poolclass=instrumented_pool_class(
+            NullPool if TESTING else AsyncAdaptedQueuePool, stats
+        ),
+        pool_pre_ping=DB_POOL_PRE_PING,
+        connect_args=statement_timeout_args(url, statement_timeout_ms),
+        **options,
+    )
+    stats.attach(async_engine.sync_engine)
+    return async_engine
+
+
+async_engine = create_request_engine(DATABASE_URL)
+
+# Objects stay usable after commit, since services return them to routers
+AsyncSessionLocal = async_sessionmaker(
+    async_engine, autoflush=False, expire_on_commit=False
+)
+
 # Base class for models
 Base = declarative_base()
@@ -1,10 +1,60 @@
+import inspect
 from contextvars import ContextVar
-from contextlib import contextmanager
-from sqlalchemy.orm import Session
-from .database import SessionLocal
+from contextlib import asynccontextmanager, contextmanager
+from functools import wraps
+from typing import Callable
 
-# ContextVar to hold the current session
-_session_ctx: ContextVar[Session | None] = ContextVar('_session_ctx', default=None)
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, SessionTransaction
+from .database import AsyncSessionLocal, SessionLocal
+from .replicas import replicas
+from .tracing import start_span
+
+# ContextVar to hold the current session: an AsyncSession inside async
+# service functions, a Session inside sync ones (background jobs, scripts)
+_session_ctx: ContextVar[Session | AsyncSession | None] = ContextVar(
+    '_session_ctx', default=None
+)
+
+
+def _has_writes(session: Session) -> bool:
+    """Whether the session's transaction holds changes, flushed or not"""
+    return bool(
+        session.info.get('flushed') or session.new or session.dirty or session.deleted
+    )
+
+
+@contextmanager
+def _join_session(session: Session):
+    """
+    Run a nested unit of work in an active session. It only gets a savepoint
+    if the session already holds changes that its failure must not discard;
+    otherwise a failure rolls back the whole (so far read-only) transaction.
+    """
+    if _has_writes(session):
+        with session.begin_nested():
+            yield session
+        return
+    try:
+        yield session
+    except Exception:
+        session.rollback()
+        raise
+
+
+@asynccontextmanager
+async def _join_async_session(session: AsyncSession):
+    """Async counterpart of _join_session"""
+    if _has_writes(session.sync_session):
+        async with session.begin_nested():
+            yield session
+        return
+    try:
+        yield session
+    except Exception:
+        await session.rollback()
+        raise
 
 
 @contextmanager
@@ -12,7 +62,14 @@ def get_db_session():
     """
     Context manager that provides a DB session,
     stores it in ContextVar, and ensures it's closed.
+    Inside an active session it joins that one instead, which is then
+    committed by whoever opened it.
     """
+    active = _session_ctx.get()
+    if isinstance(active, Session):
+        with _join_session(active):
+            yield active
+        return
     session = SessionLocal()
     token = _session_ctx.set(session)
     try:
@@ -26,7 +83,55 @@ def get_db_session():
         _session_ctx.reset(token)
 
 
-def current_session() -> Session:
+def _reads_from_replica(active: Session | AsyncSession | None) -> bool:
+    """Whether a read-only unit of work may leave the active session"""
+    if not isinstance(active, AsyncSession):
+        return True
+    if active.info.get('replica'):
+        # Already on a replica: join it
+        return False
+    # Read your writes: after a write, stay on the primary
+    return not (replicas.read_your_writes and _has_writes(active.sync_session))
+
+
+@asynccontextmanager
+async def get_async_db_session(readonly: bool = False, own: bool = False):
+    """
+    Async counterpart of get_db_session, providing an AsyncSession.
+    With readonly=True the session reads from a read replica when one is
+    configured and usable, unless the active session has written already.
+    With own=True it never joins the active session, e.g. for long
+    streaming reads that must not hold the request's transaction open.
+    """
+    active = None if own else _session_ctx.get()
+    if readonly and _reads_from_replica(active):
+        session = await replicas.session()
+        if session is not None:
+            token = _session_ctx.set(session)
+            try:
+                yield session
+            finally:
+                await session.close()
+                _session_ctx.reset(token)
+            return
+    if isinstance(active, AsyncSession):
+        async with _join_async_session(active):
+            yield active
+        return
+    session = AsyncSessionLocal()
+    token = _session_ctx.set(session)
+    try:
+        yield session
+        await session.commit()
+    except Exception:
+        await session.rollback()
+        raise
+    finally:
+        await session.close()
+        _session_ctx.reset(token)
+
+
+def current_session() -> Session | AsyncSession:
     """
     Retrieve the current session from ContextVar.
     Raises if none is set.
@@ -37,16 +142,78 @@ def current_session() -> Session:
     return session
 
 
-def with_db_session(func):
+def run_after_commit(
+    callback: Callable[[], None], session: Session | AsyncSession | None = None
+) -> None:
+    """
+    Run callback once the transaction of `session` (default: the current
+    session) has committed, e.g. to invalidate caches only when the new
+    data is visible. Callbacks are dropped if the transaction rolls back.
+    """
+    if session is None:
+        session = current_session()
+    if isinstance(session, AsyncSession):
+        # Session events fire on the sync session an AsyncSession wraps
+        session = session.sync_session
+    session.info.setdefault('after_commit', []).append(callback)
+
+
+@event.listens_for(Session, 'after_commit')
+def _run_after_commit_callbacks(session: Session) -> None:
+    for callback in session.info.pop('after_commit', []):
+        callback()
+
+
+@event.listens_for(Session, 'after_rollback')
+def _drop_after_commit_callbacks(session: Session) -> None:
+    session.info.pop('after_commit', None)
+
+
+@event.listens_for(Session, 'after_flush')
+def _record_flush(session: Session, flush_context) -> None:
+    session.info['flushed'] = True
+
+
+@event.listens_for(Session, 'after_transaction_end')
+def _forget_flush(session: Session, transaction: SessionTransaction) -> None:
+    if transaction.parent is None:
+        session.info.pop('flushed', None)
+
+
+def with_db_session(func=None, *, readonly: bool = False):
     """
     Decorator to wrap a function so that it runs within
     get_db_session context. The function itself need not
     accept a db parameter.
+    Coroutine functions run within get_async_db_session instead.
+    Calls are reentrant: inside an active session (an outer service call,
+    or the request session of RequestSessionMiddleware) they join it
+    rather than opening a second connection and transaction.
+    @with_db_session(readonly=True) routes coroutine functions to the read
+    replicas; only mark functions that never write and may read data up
+    to REPLICA_MAX_LAG_SECONDS old.
+    In sampled traces each call gets a span, e.g. metric_service.get_metric.
     """
+    if func is None:
+        return lambda func: with_db_session(func, readonly=readonly)
 
+    span_name = f"{func.__module__.rsplit('.', 1)[-1]}.{func.__qualname__}"
+
+    if inspect.iscoroutinefunction(func):
+
+        @wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            with start_span(span_name, **{'db.readonly': readonly}):
+                async with get_async_db_session(readonly=readonly):
+                    return await func(*args, **kwargs)
+
+        return async_wrapper
+
+    @wraps(func)
     def wrapper(*args, **kwargs):
-        with get_db_session():
-            return func(*args, **kwargs)
+        with start_span(span_name, **{'db.readonly': readonly}):
+            with get_db_session():
+                return func(*args, **kwargs)
 
     return wrapper
 
@@ -57,3 +224,44 @@ def get_db():
         yield db
     finally:
         db.close()
+
+
+class RequestSessionMiddleware:
+    """
+    ASGI middleware running each HTTP request in one AsyncSession, which
+    every service call of the request joins: one connection checkout and
+    one commit per request instead of one per call.
+
+    The session is committed when the response starts if its status is
+    below 400, so a client never sees a response before its data is
+    visible, and rolled back otherwise. Sessions connect lazily, so
+    requests that do not touch the database cost no checkout.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        session = AsyncSessionLocal()
+        token = _session_ctx.set(session)
+
+        async def send_after_commit(message):
+            if message['type'] == 'http.response.start':
+                if message['status'] < 400:
+                    await session.commit()
+                else:
+                    await session.rollback()
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_after_commit)
+        except Exception:
+            await session.rollback()
+            raise
+        finally:
+            await session.close()
+            _session_ctx.reset(token)
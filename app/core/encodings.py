@@ -0,0 +1,198 @@
+import struct
+import sys
+from array import array
+from datetime import datetime, timezone
+from typing import Any, Callable
+
+import msgpack
+from fastapi import HTTPException, Request, Response
+from pydantic import BaseModel
+from pydantic_core import to_json
+
+from app.core.tracing import start_span
+
+JSON = 'application/json'
+MSGPACK = 'application/msgpack'
+COLUMNAR = 'application/vnd.timeseries.columnar'
+
+# Media types some clients send for the offered encodings
+ALIASES = {'application/x-msgpack': MSGPACK}
+
+# Start of every columnar body
+COLUMNAR_MAGIC = b'TSC1'
+
+
+def epoch_ms(value: datetime) -> int:
+    """Milliseconds since the epoch; naive values are assumed to be UTC"""
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return round(value.timestamp() * 1000)
+
+
+def _plain(content: Any) -> Any:
+    """Models as dicts, without validating (or copying) their values"""
+    if isinstance(content, BaseModel):
+        return content.model_dump()
+    if isinstance(content, list):
+        return [_plain(item) for item in content]
+    return content
+
+
+def encode_json(content: Any) -> bytes:
+    """
+    JSON straight from the service result, timestamps in ISO 8601. Unlike
+    a response_model, nothing is validated again on the way out.
+    """
+    return to_json(content)
+
+
+def _msgpack_default(value: Any) -> Any:
+    if isinstance(value, datetime):
+        return epoch_ms(value)
+    raise TypeError(f'Cannot encode {type(value).__name__} as MessagePack')
+
+
+def encode_msgpack(content: Any) -> bytes:
+    """The JSON document as MessagePack, timestamps as epoch milliseconds"""
+    return msgpack.packb(_plain(content), default=_msgpack_default)
+
+
+def encode_columnar(content: Any) -> bytes:
+    """
+    The JSON document with its number arrays moved out into a binary
+    section clients can map straight into typed arrays:
+
+        magic      4 bytes, b'TSC1'
+        length     uint32, little-endian: length of the header
+        header     UTF-8 JSON, space-padded to a multiple of 8 bytes
+        data       the arrays, little-endian, each 8-byte aligned
+
+    The header is {"arrays": [{"type", "offset", "length"}, ...],
+    "document": ...}, where the document has each array replaced by
+    {"$array": index} (offsets count from the start of the data). Lists of
+    timestamps become int64 epoch milliseconds, lists of floats float64.
+    Lists of flat records become {"$columns": {field: column}}, so that
+    their timestamp and value fields become arrays too.
+    """
+    arrays: list[array] = []
+
+    def column(values: list) -> dict | None:
+        if not values:
+            return None
+        if all(isinstance(value, datetime) for value in values):
+            arrays.append(array('q', map(epoch_ms, values)))
+        elif all(type(value) is float for value in values):
+            arrays.append(array('d', values))
+        else:
+            return None
+        return {'$array': len(arrays) - 1}
+
+    def is_record_list(values: list) -> bool:
+        return bool(values) and all(
+            isinstance(item, dict)
+            and item.keys() == values[0].keys()
+            and not any(isinstance(field, (dict, list)) for field in item.values())
+            for item in values
+        )
+
+    def convert(value: Any) -> Any:
+        if isinstance(value, dict):
+            return {key: convert(field) for key, field in value.items()}
+        if isinstance(value, list):
+            reference = column(value)
+            if reference is not None:
+                return reference
+            if is_record_list(value):
+                return {
+                    '$columns': {
+                        key: convert([item[key] for item in value]) for key in value[0]
+                    }
+                }
+            return [convert(item) for item in value]
+        return value
+
+    document = convert(_plain(content))
+    specs, offset = [], 0
+    for values in arrays:
+        if sys.byteorder == 'big':
+            values.byteswap()
+        specs.append(
+            {
+                'type': 'int64' if values.typecode == 'q' else 'float64',
+                'offset': offset,
+                'length': len(values),
+            }
+        )
+        offset += len(values) * 8
+    header = to_json({'arrays': specs, 'document': document})
+    header += b' ' * (-(len(COLUMNAR_MAGIC) + 4 + len(header)) % 8)
+    return b''.join(
+        [COLUMNAR_MAGIC, struct.pack('<I', len(header)), header]
+        + [values.tobytes() for values in arrays]
+    )
+
+
+# Encoder of each offered media type, in order of preference
+ENCODERS: dict[str, Callable[[Any], bytes]] = {
+    JSON: encode_json,
+    MSGPACK: encode_msgpack,
+    COLUMNAR: encode_columnar,
+}
+
+
+def _media_ranges(accept: str) -> list[tuple[str, float]]:
+    ranges = []
+    for part in accept.split(','):
+        media_range, *params = (piece.strip() for piece in part.split(';'))
+        if not media_range:
+            continue
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition('=')
+            if name.strip() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        media_range = media_range.lower()
+        ranges.append((ALIASES.get(media_range, media_range), quality))
+    return ranges
+
+
+def negotiate(accept: str | None) -> str:
+    """
+    The offered media type an Accept header prefers: the one with the
+    highest quality, taken from the most specific range matching it, and
+    the earliest in ENCODERS on ties. JSON without an Accept header.
+    Raises HTTPException (406) when none is acceptable.
+    """
+    if not accept:
+        return JSON
+    ranges = _media_ranges(accept)
+    best, best_quality = None, 0.0
+    for media_type in ENCODERS:
+        kind = media_type.split('/')[0]
+        quality = None
+        for candidate in (media_type, f'{kind}/*', '*/*'):
+            matches = [q for media_range, q in ranges if media_range == candidate]
+            if matches:
+                quality = max(matches)
+                break
+        if quality and quality > best_quality:
+            best, best_quality = media_type, quality
+    if best is None:
+        raise HTTPException(
+            status_code=406,
+            detail=f'Acceptable media types: {", ".join(ENCODERS)}',
+        )
+    return best
+
+
+def negotiated_response(request: Request, content: Any) -> Response:
+    """`content` in the encoding the request's Accept header asks for"""
+    media_type = negotiate(request.headers.get('accept'))
+    with start_span('encode', **{'http.response.content_type': media_type}) as span:
+        body = ENCODERS[media_type](content)
+        if span is not None:
+            span.set_attributes(**{'http.response.body.size': len(body)})
+    return Response(body, media_type=media_type, headers={'Vary': 'Accept'})
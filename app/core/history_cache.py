@@ -0,0 +1,98 @@
+import math
+import time
+from datetime import datetime, timezone
+from typing import Callable, Hashable
+
+from app.core.cache import CacheBackend, create_cache_backend, named_caches
+
+from settings import HISTORY_CACHE_CHUNK_MINUTES, HISTORY_CACHE_MAX_CHUNKS
+
+
+class HistoryCache:
+    """
+    Cache of history values stored in fixed, epoch-aligned chunks per
+    series and interval.
+
+    A request is assembled from cached closed chunks (chunks that ended
+    before now) plus freshly generated values for the open trailing chunk,
+    so sliding "last 24h" windows reuse almost everything. Closed chunks are
+    fetched from the backend in one batch, and a missing chunk is generated
+    once even when many requests need it at the same time.
+    """
+
+    def __init__(self, backend: CacheBackend, chunk_minutes: int):
+        self.backend = backend
+        self.chunk_minutes = chunk_minutes
+
+    def values(
+        self,
+        series_key: Hashable,
+        timestamps: list[datetime],
+        interval_minutes: int,
+        generate: Callable[[list[datetime]], list[float]],
+        now: float | None = None,
+    ) -> list[float]:
+        """
+        Values of a series at `timestamps`, a contiguous axis spaced
+        interval_minutes apart. `generate` computes the values at a list of
+        timestamps and is called for missing closed chunks and for the open
+        trailing chunk only.
+        """
+        step = interval_minutes * 60
+        if not timestamps or int(timestamps[0].timestamp()) % step:
+            # Not aligned to the interval, so no chunk can be shared
+            return generate(timestamps)
+
+        # Whole number of points per chunk, at least one
+        chunk = math.ceil(self.chunk_minutes / interval_minutes) * step
+        now = time.time() if now is None else now
+        first = int(timestamps[0].timestamp())
+        prefix = 'history:' + ':'.join(map(str, series_key)) + f':{interval_minutes}'
+
+        # Split the axis into (start index, end index, chunk start) parts
+        parts = []
+        i = 0
+        while i < len(timestamps):
+            epoch = first + i * step
+            chunk_start = epoch - epoch % chunk
+            j = min(len(timestamps), i + (chunk_start + chunk - epoch) // step)
+            parts.append((i, j, chunk_start))
+            i = j
+
+        closed = [
+            f'{prefix}:{chunk_start}'
+            for _, _, chunk_start in parts
+            if chunk_start + chunk <= now
+        ]
+        cached = self.backend.get_many(closed)
+
+        result: list[float] = []
+        for i, j, chunk_start in parts:
+            key = f'{prefix}:{chunk_start}'
+            if chunk_start + chunk > now:
+                result.extend(generate(timestamps[i:j]))
+                continue
+            values = cached.get(key)
+            if values is None:
+                # Already counted as a miss by get_many
+                values = self.backend.load_missing(
+                    key,
+                    lambda start=chunk_start: generate(
+                        [
+                            datetime.fromtimestamp(point, tz=timezone.utc)
+                            for point in range(start, start + chunk, step)
+                        ]
+                    ),
+                )
+            offset = (first + i * step - chunk_start) // step
+            result.extend(values[offset : offset + j - i])
+        return result
+
+    def stats(self) -> dict:
+        return self.backend.stats()
+
+
+history_cache = HistoryCache(
+    create_cache_backend(HISTORY_CACHE_MAX_CHUNKS), HISTORY_CACHE_CHUNK_MINUTES
+)
+named_caches['history'] = history_cache.backend
@@ -1,9 +1,38 @@
-from app.core.database import Base, engine
+"""
+Database setup, run once per deploy before the web workers start:
 
+    python -m app.core.init_db           # create missing tables
+    python -m app.core.init_db --seed    # ... and insert the mock data
+"""
+
+import argparse
+
+import app.models  # noqa: F401  (registers every table on Base.metadata)
+from app.core.database import Base, SessionLocal, engine
+from app.core.locks import SCHEMA_LOCK_KEY, advisory_lock
+from app.mock_data import init_mock_data
+
+
+def init_db(seed: bool = False) -> None:
+    """
+    Create missing tables and, with `seed`, insert the mock data. Holds an
+    advisory lock, so setup steps started at once (one per container, say)
+    run one after the other instead of racing.
+    """
+    with advisory_lock(engine, SCHEMA_LOCK_KEY):
+        Base.metadata.create_all(bind=engine)
+        if seed:
+            with SessionLocal() as db:
+                init_mock_data(db)
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--seed', action='store_true', help='insert the mock data')
+    args = parser.parse_args(argv)
 
-def main():
     print('Creating all tables...')
-    Base.metadata.create_all(bind=engine)
+    init_db(seed=args.seed)
     print('All tables created successfully.')
 
 
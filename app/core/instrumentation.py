@@ -0,0 +1,307 @@
+import math
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterable
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from starlette.routing import Match
+
+from app.core.query_guard import check_queries, endpoint_budget, statement_shape
+
+from settings import QUERY_GUARD
+
+# Upper bounds (seconds) of the request latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Upper bounds of the statements-per-request histogram buckets
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+# Route label of requests matching no route, which must not each get a
+# series of their own
+UNMATCHED_ROUTE = 'unmatched'
+
+
+class Histogram:
+    """Observations in cumulative buckets, per tuple of label values"""
+
+    def __init__(self, buckets: tuple[float, ...]):
+        self.buckets = buckets
+        # Label values -> [count per bucket (the last one unbounded), sum]
+        self._series: dict[tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels: tuple, value: float) -> None:
+        index = next(
+            (i for i, bound in enumerate(self.buckets) if value <= bound),
+            len(self.buckets),
+        )
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def samples(self) -> list[tuple[tuple, list[tuple[float, int]], float]]:
+        """(label values, cumulative (bound, count) buckets, sum) per series"""
+        with self._lock:
+            series = [
+                (labels, list(counts), total)
+                for labels, (counts, total) in self._series.items()
+            ]
+        samples = []
+        for labels, counts, total in series:
+            cumulative, buckets = 0, []
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                buckets.append((bound, cumulative))
+            samples.append((labels, buckets, total))
+        return samples
+
+
+class QueryStats:
+    """
+    Number of statements a unit of work ran, and the time they took. With
+    shapes=True it also counts the statements per statement_shape.
+    """
+
+    __slots__ = ('count', 'seconds', 'shapes')
+
+    def __init__(self, shapes: bool = False):
+        self.count = 0
+        self.seconds = 0.0
+        self.shapes: Counter | None = Counter() if shapes else None
+
+    def add(self, seconds: float, statement: str = '') -> None:
+        self.count += 1
+        self.seconds += seconds
+        if self.shapes is not None:
+            self.shapes[statement_shape(statement)] += 1
+
+
+# Statements of the request being served
+_request_queries: ContextVar[QueryStats | None] = ContextVar(
+    '_request_queries', default=None
+)
+
+
+class RequestMetrics:
+    """Latency, concurrency and statements of the requests served, per route"""
+
+    def __init__(self):
+        self.latency = Histogram(LATENCY_BUCKETS)
+        self.query_counts = Histogram(QUERY_COUNT_BUCKETS)
+        self._in_flight: dict[tuple[str, str], int] = {}
+        self._route_queries: dict[tuple[str, str], QueryStats] = {}
+        self._role_queries: dict[str, QueryStats] = {}
+        self._lock = threading.Lock()
+
+    def started(self, method: str, route: str) -> None:
+        with self._lock:
+            key = (method, route)
+            self._in_flight[key] = self._in_flight.get(key, 0) + 1
+
+    def finished(
+        self,
+        method: str,
+        route: str,
+        status: int,
+        seconds: float,
+        queries: QueryStats,
+    ) -> None:
+        self.latency.observe((method, route, str(status)), seconds)
+        self.query_counts.observe((method, route), queries.count)
+        with self._lock:
+            self._in_flight[(method, route)] -= 1
+            totals = self._route_queries.setdefault((method, route), QueryStats())
+            totals.count += queries.count
+            totals.seconds += queries.seconds
+
+    def observe_query(self, role: str, seconds: float, statement: str) -> None:
+        """Count a statement run on an engine of `role`, for the request too"""
+        with self._lock:
+            self._role_queries.setdefault(role, QueryStats()).add(seconds)
+        queries = _request_queries.get()
+        if queries is not None:
+            queries.add(seconds, statement)
+
+    def in_flight(self) -> dict[tuple[str, str], int]:
+        with self._lock:
+            return dict(self._in_flight)
+
+    def route_queries(self) -> dict[tuple[str, str], tuple[int, float]]:
+        """(statements, seconds) of all requests so far, per method and route"""
+        with self._lock:
+            return {
+                key: (stats.count, stats.seconds)
+                for key, stats in self._route_queries.items()
+            }
+
+    def role_queries(self) -> dict[str, tuple[int, float]]:
+        """(statements, seconds) so far, per engine role"""
+        with self._lock:
+            return {
+                role: (stats.count, stats.seconds)
+                for role, stats in self._role_queries.items()
+            }
+
+
+request_metrics = RequestMetrics()
+
+
+@contextmanager
+def record_queries():
+    """
+    Count the statements run inside the block, and their shapes, e.g. to
+    assert on them in tests; requests inside it count their own instead.
+    """
+    queries = QueryStats(shapes=True)
+    token = _request_queries.set(queries)
+    try:
+        yield queries
+    finally:
+        _request_queries.reset(token)
+
+
+# Every statement of every engine is timed; async engines run theirs on the
+# sync engine they wrap, so these listeners see them too
+@event.listens_for(Engine, 'before_cursor_execute')
+def _start_query(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _end_query(conn, cursor, statement, parameters, context, executemany):
+    seconds = time.perf_counter() - conn.info['query_started'].pop()
+    stats = getattr(conn.engine.pool, 'stats', None)
+    request_metrics.observe_query(stats.role if stats else 'other', seconds, statement)
+
+
+@event.listens_for(Engine, 'handle_error')
+def _failed_query(exception_context):
+    connection = exception_context.connection
+    if connection is not None and connection.info.get('query_started'):
+        connection.info['query_started'].pop()
+
+
+def match_route(scope):
+    """The route a request goes to, or None"""
+    for route in scope['app'].router.routes:
+        match, _ = route.matches(scope)
+        if match != Match.NONE:
+            return route
+    return None
+
+
+class InstrumentationMiddleware:
+    """
+    ASGI middleware timing each HTTP request, until its response is sent,
+    and counting the requests in flight and the statements each runs. Added
+    outside RequestSessionMiddleware, so the commit counts too. Unless
+    QUERY_GUARD is off, requests that completed are then checked against
+    their endpoint's query budget and for repeated statements.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        matched = match_route(scope)
+        method = scope['method']
+        route = matched.path if matched else UNMATCHED_ROUTE
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+            await send(message)
+
+        queries = QueryStats(shapes=QUERY_GUARD != 'off')
+        token = _request_queries.set(queries)
+        request_metrics.started(method, route)
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            request_metrics.finished(
+                method, route, status, time.perf_counter() - started, queries
+            )
+            _request_queries.reset(token)
+        if queries.shapes is not None:
+            check_queries(
+                f'{method} {route}',
+                endpoint_budget(getattr(matched, 'endpoint', None)),
+                queries.count,
+                queries.shapes,
+            )
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return '+Inf'
+    if isinstance(value, bool):
+        return '1' if value else '0'
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Exposition:
+    """Samples in the Prometheus text exposition format (version 0.0.4)"""
+
+    CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+    def __init__(self):
+        self.lines: list[str] = []
+
+    def _sample(self, name: str, labels: dict, value) -> None:
+        if labels:
+            rendered = ','.join(
+                f'{key}="{_escape(val)}"' for key, val in labels.items()
+            )
+            name = f'{name}{{{rendered}}}'
+        self.lines.append(f'{name} {_format_value(value)}')
+
+    def add(
+        self,
+        name: str,
+        kind: str,
+        help_text: str,
+        samples: Iterable[tuple[dict, float | None]],
+    ) -> None:
+        """A counter or gauge; samples without a value are left out"""
+        self.lines.append(f'# HELP {name} {help_text}')
+        self.lines.append(f'# TYPE {name} {kind}')
+        for labels, value in samples:
+            if value is not None:
+                self._sample(name, labels, value)
+
+    def histogram(
+        self,
+        name: str,
+        help_text: str,
+        samples: Iterable[tuple[dict, list[tuple[float, int]], float]],
+    ) -> None:
+        """A histogram, from (labels, cumulative buckets, sum) per series"""
+        self.lines.append(f'# HELP {name} {help_text}')
+        self.lines.append(f'# TYPE {name} histogram')
+        for labels, buckets, total in samples:
+            for bound, count in buckets:
+                le = _format_value(float(bound))
+                self._sample(f'{name}_bucket', {**labels, 'le': le}, count)
+            self._sample(f'{name}_sum', labels, total)
+            self._sample(f'{name}_count', labels, buckets[-1][1])
+
+    def render(self) -> str:
+        return '\n'.join(self.lines) + '\n'
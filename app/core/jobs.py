@@ -0,0 +1,37 @@
+import asyncio
+import logging
+from typing import Callable
+
+from app.core.database import engine
+from app.core.locks import advisory_lock
+
+logger = logging.getLogger(__name__)
+
+
+def _run_locked(func: Callable[[], object], lock_key: int | None) -> None:
+    if lock_key is None:
+        func()
+        return
+    with advisory_lock(engine, lock_key, wait=False) as acquired:
+        if acquired:
+            func()
+        else:
+            logger.debug('Background job %s running elsewhere', func.__name__)
+
+
+async def run_periodically(
+    func: Callable[[], object], interval_seconds: float, lock_key: int | None = None
+):
+    """
+    Run a blocking job in a worker thread every `interval_seconds`, the first
+    time one interval after starting, so worker startup does no job work.
+    With `lock_key`, a run is skipped while another worker holds that
+    advisory lock, so N workers do not repeat each other's work.
+    Failures are logged and the loop keeps going; cancel the task to stop it.
+    """
+    while True:
+        await asyncio.sleep(interval_seconds)
+        try:
+            await asyncio.to_thread(_run_locked, func, lock_key)
+        except Exception:
+            logger.exception('Background job %s failed', func.__name__)
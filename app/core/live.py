@@ -0,0 +1,261 @@
+import asyncio
+import threading
+import weakref
+from datetime import timezone
+from typing import AsyncIterator, Iterable
+
+from pydantic_core import to_json
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session, SessionTransaction
+
+from app.core.change_feed import METRICS_CHANNEL, change_feed, notify
+from app.core.db_session import get_async_db_session, run_after_commit
+from app.models.metric import Metric
+
+from settings import CHANGE_FEED_ENABLED, STREAM_CLIENT_BUFFER
+
+
+class StreamClient:
+    """
+    A connected stream client: the metrics it follows and a bounded buffer
+    of change batches not yet sent, owned by the event loop serving it.
+    """
+
+    def __init__(self, metric_ids: Iterable[int], buffer_size: int):
+        self.metric_ids = frozenset(metric_ids)
+        self.loop = asyncio.get_running_loop()
+        self.queue: asyncio.Queue[list[dict] | None] = asyncio.Queue(buffer_size)
+        self.dropped = False
+
+    async def next_changes(self) -> list[dict] | None:
+        """The next change batch, or None once dropped as too slow"""
+        return await self.queue.get()
+
+
+class FanOutHub:
+    """
+    In-process fan-out of committed metric changes to stream clients.
+
+    Every publish is one batch (one committed transaction); each client gets
+    the part touching its metrics. A client whose buffer is full is dropped
+    rather than slowing down the writers or the other clients: its buffer is
+    replaced by a final None, and it reconnects for a fresh snapshot.
+    Publishing is thread-safe; delivery runs on each client's event loop.
+    Clients are held weakly, so one whose stream never started (the
+    connection dropped first) goes away with its response.
+    """
+
+    def __init__(self, buffer_size: int):
+        self.buffer_size = buffer_size
+        self._clients: dict[int, weakref.WeakSet[StreamClient]] = {}
+        self._connected: weakref.WeakSet[StreamClient] = weakref.WeakSet()
+        self._lock = threading.Lock()
+        self.published = 0
+        self.delivered = 0
+        self.dropped = 0
+
+    def connect(self, metric_ids: Iterable[int]) -> StreamClient:
+        client = StreamClient(metric_ids, self.buffer_size)
+        with self._lock:
+            for metric_id in client.metric_ids:
+                self._clients.setdefault(metric_id, weakref.WeakSet()).add(client)
+            self._connected.add(client)
+        return client
+
+    def disconnect(self, client: StreamClient) -> None:
+        with self._lock:
+            for metric_id in client.metric_ids:
+                followers = self._clients.get(metric_id)
+                if followers is not None:
+                    followers.discard(client)
+                    if not followers:
+                        del self._clients[metric_id]
+            self._connected.discard(client)
+
+    def followed(self, metric_ids: Iterable[int]) -> set[int]:
+        """Those of the metrics some client follows"""
+        with self._lock:
+            return {
+                metric_id for metric_id in metric_ids if self._clients.get(metric_id)
+            }
+
+    def publish(self, changes: list[dict]) -> None:
+        batches: dict[StreamClient, list[dict]] = {}
+        with self._lock:
+            self.published += len(changes)
+            for change in changes:
+                for client in self._clients.get(change['metric_id'], ()):
+                    batches.setdefault(client, []).append(change)
+        for client, batch in batches.items():
+            try:
+                client.loop.call_soon_threadsafe(self._deliver, client, batch)
+            except RuntimeError:
+                # Its event loop has closed: the client is gone
+                self.disconnect(client)
+
+    def drop_all(self) -> None:
+        """Drop every client, e.g. after changes may have been missed"""
+        with self._lock:
+            clients = list(self._connected)
+        for client in clients:
+            try:
+                client.loop.call_soon_threadsafe(self._drop, client)
+            except RuntimeError:
+                self.disconnect(client)
+
+    def _deliver(self, client: StreamClient, batch: list[dict]) -> None:
+        if client.dropped:
+            return
+        try:
+            client.queue.put_nowait(batch)
+        except asyncio.QueueFull:
+            self._drop(client)
+            return
+        with self._lock:
+            self.delivered += 1
+
+    def _drop(self, client: StreamClient) -> None:
+        if client.dropped:
+            return
+        client.dropped = True
+        while not client.queue.empty():
+            client.queue.get_nowait()
+        client.queue.put_nowait(None)
+        with self._lock:
+            self.dropped += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'clients': len(self._connected),
+                'published': self.published,
+                'delivered': self.delivered,
+                'dropped': self.dropped,
+            }
+
+
+metric_hub = FanOutHub(STREAM_CLIENT_BUFFER)
+
+
+def metric_change(metric: Metric, deleted: bool = False) -> dict:
+    if deleted:
+        return {'metric_id': metric.id, 'deleted': True}
+    return {
+        'metric_id': metric.id,
+        'device_id': metric.device_id,
+        'name': metric.name,
+        'unit': metric.unit,
+        'value': metric.value,
+        'timestamp': metric.timestamp,
+    }
+
+
+# Metric writes through the ORM are collected per transaction and published
+# as one batch once it commits, so clients never see rolled back values
+@event.listens_for(Session, 'after_flush')
+def _collect_metric_changes(session: Session, flush_context) -> None:
+    changes = {
+        metric.id: metric_change(metric)
+        for metric in list(session.new) + list(session.dirty)
+        if isinstance(metric, Metric)
+        and session.is_modified(metric, include_collections=False)
+    }
+    changes.update(
+        (metric.id, metric_change(metric, deleted=True))
+        for metric in session.deleted
+        if isinstance(metric, Metric)
+    )
+    if not changes:
+        return
+    if 'metric_changes' not in session.info:
+        pending = session.info['metric_changes'] = {}
+        run_after_commit(lambda: metric_hub.publish(list(pending.values())), session)
+    session.info['metric_changes'].update(changes)
+
+
+@event.listens_for(Session, 'after_transaction_end')
+def _forget_metric_changes(session: Session, transaction: SessionTransaction):
+    if transaction.parent is None:
+        session.info.pop('metric_changes', None)
+
+
+def _notification_entry(change: dict) -> list:
+    """[metric ID] of a deletion, else [metric ID, device ID, epoch seconds]"""
+    if change.get('deleted'):
+        return [change['metric_id']]
+    timestamp = change['timestamp']
+    if timestamp is not None:
+        timestamp = round(timestamp.replace(tzinfo=timezone.utc).timestamp(), 3)
+    return [change['metric_id'], change['device_id'], timestamp]
+
+
+# Other workers hear of the transaction's metric writes through the change
+# feed: one notification (per ~200 metrics) sent as the transaction commits
+@event.listens_for(Session, 'before_commit')
+def _notify_metric_changes(session: Session) -> None:
+    if not CHANGE_FEED_ENABLED or session.get_bind().dialect.name != 'postgresql':
+        return
+    # Changes the commit would flush must be included
+    session.flush()
+    changes = session.info.get('metric_changes')
+    if changes:
+        entries = [_notification_entry(change) for change in changes.values()]
+        notify(session, METRICS_CHANNEL, 'm', entries)
+
+
+async def _publish_remote_metric_changes(payload: dict) -> None:
+    """Publish metric changes committed by another worker to local clients"""
+    entries = payload['m']
+    followed = metric_hub.followed(entry[0] for entry in entries)
+    if not followed:
+        return
+    deleted = {entry[0] for entry in entries if len(entry) == 1} & followed
+    changes = [{'metric_id': metric_id, 'deleted': True} for metric_id in deleted]
+    if followed - deleted:
+        # From the primary, which the notification comes from; a replica
+        # may not have the change yet
+        async with get_async_db_session() as db:
+            metrics = await db.scalars(
+                select(Metric).where(Metric.id.in_(followed - deleted))
+            )
+            changes += [metric_change(metric) for metric in metrics]
+    metric_hub.publish(changes)
+
+
+change_feed.subscribe(METRICS_CHANNEL, _publish_remote_metric_changes)
+# Clients may have missed changes while the feed was down
+change_feed.on_reconnect(metric_hub.drop_all)
+
+
+def sse_event(event_name: str, data) -> bytes:
+    """One server-sent event carrying `data` as JSON"""
+    return b'event: %s\ndata: %s\n\n' % (event_name.encode(), to_json(data))
+
+
+async def stream_changes(
+    client: StreamClient,
+    snapshot: dict,
+    heartbeat_seconds: float,
+    max_seconds: float,
+) -> AsyncIterator[bytes]:
+    """
+    Server-sent events of a stream client: the snapshot, then each change
+    batch as it commits, with comment lines keeping idle connections open.
+    Ends after `max_seconds` (clients reconnect, spreading them over the
+    workers) or once the client is dropped as too slow.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + max_seconds
+    yield sse_event('snapshot', snapshot)
+    while (remaining := deadline - loop.time()) > 0:
+        try:
+            changes = await asyncio.wait_for(
+                client.next_changes(), min(heartbeat_seconds, remaining)
+            )
+        except asyncio.TimeoutError:
+            yield b': keepalive\n\n'
+            continue
+        if changes is None:
+            yield sse_event('dropped', {'reason': 'slow consumer'})
+            return
+        yield sse_event('changes', changes)
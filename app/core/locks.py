@@ -0,0 +1,37 @@
+from contextlib import contextmanager
+from typing import Iterator
+
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+
+# Postgres advisory lock keys, one per purpose
+SCHEMA_LOCK_KEY = 7_340_001
+SUMMARY_REFRESH_LOCK_KEY = 7_340_002
+
+
+@contextmanager
+def advisory_lock(engine: Engine, key: int, wait: bool = True) -> Iterator[bool]:
+    """
+    Hold a Postgres advisory lock, on a connection of its own, for the
+    duration of the block. With `wait`, blocks until the lock is acquired;
+    otherwise yields whether it was. Other databases have no advisory locks,
+    and there the lock always counts as acquired.
+    """
+    if engine.dialect.name != 'postgresql':
+        yield True
+        return
+    with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+        if wait:
+            conn.execute(text('SELECT pg_advisory_lock(:key)'), {'key': key})
+            acquired = True
+        else:
+            acquired = conn.scalar(
+                text('SELECT pg_try_advisory_lock(:key)'), {'key': key}
+            )
+        try:
+            yield acquired
+        finally:
+            # The lock belongs to the database session, which outlives the
+            # connection's return to the pool
+            if acquired:
+                conn.execute(text('SELECT pg_advisory_unlock(:key)'), {'key': key})
@@ -0,0 +1,90 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable
+
+
+class PasswordPoolBusy(Exception):
+    """Raised when the password hashing queue is full"""
+
+
+class PasswordWorkerPool:
+    """
+    Bounded thread pool for CPU-heavy password hashing, so bcrypt never runs
+    on the event loop. At most `workers` hashes run at once and at most
+    `max_queue` more wait; further calls fail fast with PasswordPoolBusy.
+    bcrypt releases the GIL, so the workers run in parallel.
+    """
+
+    def __init__(self, workers: int, max_queue: int):
+        self.workers = workers
+        self.max_queue = max_queue
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix='password-hash'
+        )
+        self._lock = threading.Lock()
+        self.pending = 0
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+        self.cancelled = 0
+        self.rejected = 0
+        self.wait_seconds_total = 0.0
+        self.run_seconds_total = 0.0
+
+    async def run(self, func: Callable, *args):
+        """
+        Run func(*args) on the pool and await its result.
+        A job counts against the limit until it has finished on its thread,
+        even if the awaiting caller is cancelled first; a job cancelled
+        before it started is dropped.
+        """
+        with self._lock:
+            if self.pending >= self.workers + self.max_queue:
+                self.rejected += 1
+                raise PasswordPoolBusy('Too many concurrent password operations')
+            self.pending += 1
+        submitted = time.perf_counter()
+
+        def task():
+            started = time.perf_counter()
+            with self._lock:
+                self.running += 1
+                self.wait_seconds_total += started - submitted
+            try:
+                return func(*args)
+            finally:
+                with self._lock:
+                    self.running -= 1
+                    self.run_seconds_total += time.perf_counter() - started
+
+        future = self._executor.submit(task)
+        future.add_done_callback(self._finished)
+        # Cancelling the caller cancels the job only if it has not started
+        return await asyncio.wrap_future(future)
+
+    def _finished(self, future: Future) -> None:
+        with self._lock:
+            self.pending -= 1
+            if future.cancelled():
+                self.cancelled += 1
+            elif future.exception() is not None:
+                self.failed += 1
+            else:
+                self.completed += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'max_queue': self.max_queue,
+                'running': self.running,
+                'queued': self.pending - self.running,
+                'completed': self.completed,
+                'failed': self.failed,
+                'cancelled': self.cancelled,
+                'rejected': self.rejected,
+                'wait_seconds_total': self.wait_seconds_total,
+                'run_seconds_total': self.run_seconds_total,
+            }
@@ -0,0 +1,113 @@
+import threading
+import time
+
+from sqlalchemy import event, exc
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import Pool, QueuePool
+
+# Upper bounds (seconds) of the checkout wait time histogram buckets
+WAIT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 30.0)
+
+# Live pool statistics, per engine role ('primary', 'replica-0', 'jobs', ...)
+pool_stats: dict[str, 'PoolStats'] = {}
+
+
+class PoolStats:
+    """
+    Connection pool statistics of one engine, fed from its pool events
+    (checkouts, checkins, new connections) and from the time each checkout
+    waits for a connection, including checkouts that time out.
+    """
+
+    def __init__(self, role: str):
+        self.role = role
+        self.engine: Engine | None = None
+        self.checked_out = 0
+        self.connections_opened = 0
+        self.timeouts = 0
+        self.wait_buckets = [0] * (len(WAIT_BUCKETS) + 1)
+        self.wait_seconds_sum = 0.0
+        self._lock = threading.Lock()
+
+    def attach(self, engine: Engine) -> None:
+        """Count the pool events of a (sync) engine, and register the role"""
+        self.engine = engine
+        event.listen(engine, 'checkout', self._on_checkout)
+        event.listen(engine, 'checkin', self._on_checkin)
+        event.listen(engine, 'connect', self._on_connect)
+        pool_stats[self.role] = self
+
+    def _on_checkout(self, dbapi_connection, connection_record, connection_proxy):
+        with self._lock:
+            self.checked_out += 1
+
+    def _on_checkin(self, dbapi_connection, connection_record):
+        with self._lock:
+            self.checked_out -= 1
+
+    def _on_connect(self, dbapi_connection, connection_record):
+        with self._lock:
+            self.connections_opened += 1
+
+    def observe_wait(self, seconds: float, timed_out: bool = False) -> None:
+        index = next(
+            (i for i, bound in enumerate(WAIT_BUCKETS) if seconds <= bound),
+            len(WAIT_BUCKETS),
+        )
+        with self._lock:
+            self.wait_buckets[index] += 1
+            self.wait_seconds_sum += seconds
+            if timed_out:
+                self.timeouts += 1
+
+    def snapshot(self) -> dict:
+        pool = self.engine.pool if self.engine is not None else None
+        queue_pool = isinstance(pool, QueuePool)
+        with self._lock:
+            cumulative, buckets = 0, []
+            for bound, count in zip(WAIT_BUCKETS + (float('inf'),), self.wait_buckets):
+                cumulative += count
+                buckets.append((bound, cumulative))
+            return {
+                'role': self.role,
+                'size': pool.size() if queue_pool else None,
+                'checked_out': self.checked_out,
+                # Connections open beyond the pool size
+                'overflow': max(pool.overflow(), 0) if queue_pool else 0,
+                'connections_opened': self.connections_opened,
+                'timeouts': self.timeouts,
+                'wait_seconds': {
+                    'count': cumulative,
+                    'sum': self.wait_seconds_sum,
+                    'buckets': buckets,
+                },
+            }
+
+
+class _TimedCheckouts:
+    """Pool mixin timing how long each checkout waits for a connection"""
+
+    stats: PoolStats
+
+    def connect(self):
+        started = time.perf_counter()
+        try:
+            connection = super().connect()
+        except exc.TimeoutError:
+            self.stats.observe_wait(time.perf_counter() - started, timed_out=True)
+            raise
+        self.stats.observe_wait(time.perf_counter() - started)
+        return connection
+
+
+def instrumented_pool_class(pool_class: type[Pool], stats: PoolStats) -> type[Pool]:
+    """
+    A subclass of `pool_class` timing its checkouts into `stats`. The stats
+    are a class attribute so that the pool an engine recreates on dispose
+    keeps them.
+    """
+    return type(
+        f'Instrumented{pool_class.__name__}',
+        (_TimedCheckouts, pool_class),
+        {'stats': stats},
+    )
@@ -0,0 +1,67 @@
+import logging
+import re
+from collections import Counter
+from typing import Callable
+
+from settings import QUERY_BUDGET_DEFAULT, QUERY_GUARD, QUERY_REPEAT_LIMIT
+
+logger = logging.getLogger(__name__)
+
+_PLACEHOLDER = re.compile(r'\$\d+|%\(\w+\)s|%s')
+# A parenthesised list of placeholders, each possibly cast (?::INTEGER)
+_PLACEHOLDER_LIST = re.compile(r'\(\?(?:::[\w ]+)?(?:, \?(?:::[\w ]+)?)*\)')
+
+
+class QueryGuardError(AssertionError):
+    """A request ran more statements than its budget, or an N+1 pattern"""
+
+
+def statement_shape(statement: str) -> str:
+    """
+    A statement with its placeholders, whatever the driver's paramstyle,
+    written as ? and IN lists of any length as (?): statements differing
+    only in their parameters have the same shape.
+    """
+    shape = _PLACEHOLDER.sub('?', ' '.join(statement.split()))
+    return _PLACEHOLDER_LIST.sub('(?)', shape)
+
+
+def query_budget(limit: int) -> Callable:
+    """
+    Decorator setting the most SQL statements a request to an endpoint may
+    run, instead of QUERY_BUDGET_DEFAULT. Goes below the route decorator.
+    """
+
+    def decorate(endpoint: Callable) -> Callable:
+        endpoint.query_budget = limit
+        return endpoint
+
+    return decorate
+
+
+def endpoint_budget(endpoint: Callable | None) -> int:
+    return getattr(endpoint, 'query_budget', QUERY_BUDGET_DEFAULT)
+
+
+def repeated_shapes(shapes: Counter, limit: int = QUERY_REPEAT_LIMIT) -> dict:
+    """Statement shapes run at least `limit` times: likely N+1 queries"""
+    return {shape: count for shape, count in shapes.items() if count >= limit}
+
+
+def check_queries(route: str, budget: int, count: int, shapes: Counter) -> None:
+    """
+    Flag a request that ran more than `budget` statements or repeated a
+    statement shape QUERY_REPEAT_LIMIT times, as set by QUERY_GUARD:
+    'raise' (tests) raises QueryGuardError, 'warn' logs a warning.
+    """
+    problems = []
+    if count > budget:
+        problems.append(f'{count} SQL statements, over its budget of {budget}')
+    for shape, times in repeated_shapes(shapes).items():
+        problems.append(f'{times} statements shaped like: {shape}')
+    if not problems:
+        return
+    message = f'{route} ran ' + '; '.join(problems)
+    if QUERY_GUARD == 'raise':
+        raise QueryGuardError(message)
+    logger.warning(message)
@@ -0,0 +1,126 @@
+import logging
+import math
+import time
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker
+
+from app.core.database import create_request_engine
+
+from settings import (
+    DATABASE_REPLICA_URLS,
+    DB_REPLICA_STATEMENT_TIMEOUT_MS,
+    REPLICA_LAG_CHECK_SECONDS,
+    REPLICA_MAX_LAG_SECONDS,
+    REPLICA_READ_YOUR_WRITES,
+)
+
+logger = logging.getLogger(__name__)
+
+# Seconds a replica is behind the primary, per dialect. A Postgres standby
+# that has replayed everything it received is not behind, however old its
+# last replayed transaction; a server that is no standby reports NULL (0).
+LAG_QUERIES = {
+    'postgresql': text(
+        'SELECT COALESCE(CASE WHEN pg_last_wal_receive_lsn() = '
+        'pg_last_wal_replay_lsn() THEN 0 ELSE EXTRACT(EPOCH FROM now() - '
+        'pg_last_xact_replay_timestamp()) END, 0)'
+    ),
+}
+
+
+class ReplicaSet:
+    """
+    Read replicas of the primary database, balanced round-robin.
+
+    Each replica's lag is measured at most every `lag_check_seconds`. A
+    replica lagging more than `max_lag_seconds`, or failing its check, is
+    skipped until its next check, and reads fall back to the primary when
+    no replica qualifies.
+    """
+
+    def __init__(
+        self,
+        engines: list[AsyncEngine],
+        max_lag_seconds: float,
+        lag_check_seconds: float,
+        read_your_writes: bool = True,
+    ):
+        self.engines = engines
+        self.max_lag_seconds = max_lag_seconds
+        self.lag_check_seconds = lag_check_seconds
+        self.read_your_writes = read_your_writes
+        self._sessionmakers = [
+            async_sessionmaker(
+                engine, autoflush=False, expire_on_commit=False, info={'replica': True}
+            )
+            for engine in engines
+        ]
+        self._next = 0
+        # Per replica: (monotonic time of the check, lag in seconds)
+        self._lags: dict[int, tuple[float, float]] = {}
+        self.reads = [0] * len(engines)
+        self.fallbacks = 0
+
+    async def _measure_lag(self, engine: AsyncEngine) -> float:
+        query = LAG_QUERIES.get(engine.dialect.name)
+        if query is None:
+            return 0.0
+        async with engine.connect() as connection:
+            return float(await connection.scalar(query))
+
+    async def lag(self, index: int) -> float:
+        """Lag of a replica in seconds, infinite if it cannot be checked"""
+        now = time.monotonic()
+        checked = self._lags.get(index)
+        if checked is not None and now - checked[0] < self.lag_check_seconds:
+            return checked[1]
+        try:
+            lag = await self._measure_lag(self.engines[index])
+        except Exception:
+            logger.warning('Replica %d lag check failed', index, exc_info=True)
+            lag = math.inf
+        self._lags[index] = (now, lag)
+        return lag
+
+    async def session(self) -> AsyncSession | None:
+        """A session on the next usable replica, or None to use the primary"""
+        for _ in range(len(self.engines)):
+            index = self._next
+            self._next = (index + 1) % len(self.engines)
+            if await self.lag(index) <= self.max_lag_seconds:
+                self.reads[index] += 1
+                return self._sessionmakers[index]()
+        if self.engines:
+            self.fallbacks += 1
+        return None
+
+    async def dispose(self) -> None:
+        for engine in self.engines:
+            await engine.dispose()
+
+    def stats(self) -> dict:
+        return {
+            'replicas': len(self.engines),
+            'reads': list(self.reads),
+            'fallbacks': self.fallbacks,
+            'lag_seconds': [
+                self._lags.get(index, (0, None))[1]
+                for index in range(len(self.engines))
+            ],
+        }
+
+
+replicas = ReplicaSet(
+    [
+        create_request_engine(
+            url,
+            role=f'replica-{index}',
+            statement_timeout_ms=DB_REPLICA_STATEMENT_TIMEOUT_MS,
+        )
+        for index, url in enumerate(DATABASE_REPLICA_URLS)
+    ],
+    max_lag_seconds=REPLICA_MAX_LAG_SECONDS,
+    lag_check_seconds=REPLICA_LAG_CHECK_SECONDS,
+    read_your_writes=REPLICA_READ_YOUR_WRITES,
+)
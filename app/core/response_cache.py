@@ -0,0 +1,100 @@
+import hashlib
+from typing import Awaitable, Callable
+
+from fastapi import Request, Response
+
+from app.core.cache import CacheBackend, MemoryCacheBackend, cache
+from app.core.change_feed import METRICS_CHANNEL, change_feed
+from app.core.db_session import run_after_commit
+
+# Namespaces of cached routes; writes invalidate a whole namespace
+SITES = 'sites'
+DEVICES = 'devices'
+
+
+class ResponseCache:
+    """
+    Cache of serialized JSON responses with strong ETags, stored in a
+    cache backend so that all workers share entries and invalidations.
+
+    Each namespace has a generation counter that is part of every key.
+    Invalidating a namespace bumps it, which orphans all of its entries
+    (they age out of the backend) without having to enumerate them.
+    """
+
+    def __init__(self, backend: CacheBackend):
+        self.backend = backend
+
+    async def _generation(self, namespace: str) -> int:
+        return await self.backend.counter_async(f'response-generation:{namespace}')
+
+    async def get_or_build(
+        self, namespace: str, key: str, build: Callable[[], Awaitable[bytes]]
+    ) -> tuple[str, bytes]:
+        """(etag, body) of a cached response, building it once on a miss"""
+
+        async def load() -> tuple[str, bytes]:
+            body = await build()
+            return make_etag(body), body
+
+        generation = await self._generation(namespace)
+        return await self.backend.get_or_set_async(
+            f'response:{namespace}:{generation}:{key}', load
+        )
+
+    def invalidate(self, *namespaces: str) -> None:
+        for namespace in namespaces:
+            self.backend.incr(f'response-generation:{namespace}')
+
+
+response_cache = ResponseCache(cache)
+
+# A per-process backend only sees this worker's invalidations, so metric
+# writes of other workers (which devices and sites embed) arrive through the
+# change feed; after a feed outage any of them may have been missed
+if isinstance(cache, MemoryCacheBackend):
+    change_feed.subscribe(
+        METRICS_CHANNEL, lambda payload: response_cache.invalidate(SITES, DEVICES)
+    )
+    change_feed.on_reconnect(lambda: response_cache.invalidate(SITES, DEVICES))
+
+
+def invalidate_after_commit(*namespaces: str) -> None:
+    """Invalidate namespaces once the current DB transaction commits"""
+    run_after_commit(lambda: response_cache.invalidate(*namespaces))
+
+
+def make_etag(body: bytes) -> str:
+    """Strong ETag derived from the response body"""
+    return '"%s"' % hashlib.sha256(body).hexdigest()[:32]
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """Whether the request's If-None-Match header matches the given ETag"""
+    header = request.headers.get('if-none-match')
+    if not header:
+        return False
+    candidates = [candidate.strip() for candidate in header.split(',')]
+    # If-None-Match uses weak comparison, so W/ prefixes are ignored
+    return '*' in candidates or etag in (
+        candidate.removeprefix('W/') for candidate in candidates
+    )
+
+
+async def cached_json_response(
+    request: Request,
+    namespace: str,
+    scope: str,
+    build: Callable[[], Awaitable[bytes]],
+) -> Response:
+    """
+    Serve a JSON response from the cache, keyed by route (path and query)
+    and authorization scope. `build` is only awaited on a miss and must
+    return the serialized body. Returns 304 when If-None-Match matches.
+    """
+    key = f'{request.url.path}?{request.url.query}|{scope}'
+    etag, body = await response_cache.get_or_build(namespace, key, build)
+    headers = {'ETag': etag, 'Cache-Control': 'no-cache'}
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type='application/json', headers=headers)
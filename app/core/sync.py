@@ -0,0 +1,48 @@
+import base64
+import hashlib
+
+from pydantic_core import to_json
+
+from app.core.cache import CacheBackend, cache
+
+from settings import SYNC_CURSOR_TTL_SECONDS
+
+
+def digest(value) -> str:
+    """Short digest of a JSON-serializable value, telling changed ones apart"""
+    return hashlib.blake2b(to_json(value), digest_size=8).hexdigest()
+
+
+class SyncCursors:
+    """
+    Sync states of delta sync clients, stored in a cache backend under the
+    cursor handed to the client. A state records digests of what the client
+    was sent, so the next sync can send only what differs.
+
+    Cursors are derived from the state itself, so clients in the same state
+    share one entry. A cursor that expired, or that another worker issued
+    with a per-process backend, is unknown: the client gets a full sync.
+    """
+
+    def __init__(self, backend: CacheBackend, ttl: float):
+        self.backend = backend
+        self.ttl = ttl
+
+    async def save(self, state: dict) -> str:
+        cursor = (
+            base64.urlsafe_b64encode(
+                hashlib.blake2b(to_json(state), digest_size=15).digest()
+            )
+            .decode()
+            .rstrip('=')
+        )
+        await self.backend.set_async(f'sync:{cursor}', state, self.ttl)
+        return cursor
+
+    async def load(self, cursor: str | None) -> dict | None:
+        if not cursor:
+            return None
+        return await self.backend.get_async(f'sync:{cursor}')
+
+
+sync_cursors = SyncCursors(cache, SYNC_CURSOR_TTL_SECONDS)
@@ -0,0 +1,104 @@
+import math
+from datetime import datetime, timedelta, timezone
+
+from settings import HISTORY_MAX_POINTS
+
+# Offsets of the "previous" window for period-over-period comparisons.
+# A year is 52 weeks so that weekdays line up.
+COMPARE_OFFSETS = {
+    'day': timedelta(days=1),
+    'week': timedelta(weeks=1),
+    'year': timedelta(weeks=52),
+}
+
+_MASK64 = (1 << 64) - 1
+
+# Intervals (minutes) a request may be coarsened to, smallest first.
+# Beyond the last entry, whole days are used.
+NICE_INTERVALS = [1, 2, 5, 10, 15, 30, 60, 120, 180, 360, 720, 1440]
+
+
+class PointBudgetExceeded(ValueError):
+    """Raised in strict mode when a history request exceeds the point budget"""
+
+
+def to_utc(value: datetime) -> datetime:
+    """Return an aware UTC datetime; naive values are assumed to be UTC."""
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc)
+
+
+def count_points(
+    start_time: datetime, end_time: datetime, interval_minutes: int
+) -> int:
+    """Number of points a [start_time, end_time] axis has at the given interval"""
+    span_minutes = (end_time - start_time).total_seconds() / 60
+    return int(span_minutes // interval_minutes) + 1
+
+
+def resolve_interval(
+    start_time: datetime,
+    end_time: datetime,
+    interval_minutes: int,
+    series: int = 1,
+    max_points: int = HISTORY_MAX_POINTS,
+    strict: bool = False,
+) -> int:
+    """
+    Return the interval to use so that `series` series over the time range
+    stay within `max_points` points in total.
+
+    The requested interval is kept when it fits. Otherwise it is coarsened to
+    the smallest fitting entry of NICE_INTERVALS (or whole days), or
+    PointBudgetExceeded is raised when `strict` is set.
+    """
+    if interval_minutes < 1:
+        raise ValueError('interval_minutes must be at least 1')
+    series = max(series, 1)
+    requested = count_points(start_time, end_time, interval_minutes) * series
+    if requested <= max_points:
+        return interval_minutes
+    if strict:
+        raise PointBudgetExceeded(
+            f'Request needs {requested} points, budget is {max_points}; '
+            'use a larger interval_minutes or a shorter time range'
+        )
+
+    points_per_series = max(max_points // series, 2)
+    span_minutes = (end_time - start_time).total_seconds() / 60
+    minimum = math.ceil(span_minutes / (points_per_series - 1))
+    for candidate in NICE_INTERVALS:
+        if candidate >= max(minimum, interval_minutes):
+            return candidate
+    return math.ceil(minimum / 1440) * 1440
+
+
+def time_axis(
+    start_time: datetime, end_time: datetime, interval_minutes: int
+) -> list[datetime]:
+    """
+    Timestamps between start_time and end_time (inclusive) every
+    interval_minutes, aligned to multiples of the interval since the epoch
+    so that the same points (and cached chunks) recur across requests.
+    """
+    step = interval_minutes * 60
+    first = math.ceil(to_utc(start_time).timestamp() / step) * step
+    last = math.floor(to_utc(end_time).timestamp() / step) * step
+    return [
+        datetime.fromtimestamp(epoch, tz=timezone.utc)
+        for epoch in range(first, last + 1, step)
+    ]
+
+
+def sample_value(seed: int, timestamp: datetime) -> float:
+    """
+    Deterministic pseudo-random value in [0, 1) for a series at a timestamp
+    (minute resolution), so any window of a series can be regenerated
+    independently of where a request's time axis starts.
+    """
+    # splitmix64 over (seed, epoch minute)
+    x = (seed * 0x9E3779B97F4A7C15 ^ int(timestamp.timestamp()) // 60) & _MASK64
+    x = ((x ^ (x >> 30)) * 0xBF58476D1CE4E5B9) & _MASK64
+    x = ((x ^ (x >> 27)) * 0x94D049BB133111EB) & _MASK64
+    return (x ^ (x >> 31)) / 2**64
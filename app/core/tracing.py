@@ -0,0 +1,365 @@
+import json
+import logging
+import os
+import queue
+import random
+import re
+import threading
+import time
+import urllib.request
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from app.core.instrumentation import UNMATCHED_ROUTE, match_route
+
+from settings import (
+    TRACE_EXPORT,
+    TRACE_EXPORT_MAX_QUEUE,
+    TRACE_FILE,
+    TRACE_OTLP_ENDPOINT,
+    TRACE_SAMPLE_RATIO,
+    TRACE_SERVICE_NAME,
+)
+
+logger = logging.getLogger(__name__)
+
+# OTLP span kinds
+INTERNAL, SERVER, CLIENT = 1, 2, 3
+
+# Statement text kept on SQL spans
+MAX_STATEMENT_LENGTH = 2000
+
+# W3C trace context: version-trace_id-parent_id-flags
+_TRACEPARENT = re.compile(r'^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$')
+
+
+class Span:
+    """A timed operation of a sampled trace, with attributes"""
+
+    __slots__ = (
+        'trace',
+        'name',
+        'kind',
+        'span_id',
+        'parent_id',
+        'start_ns',
+        'end_ns',
+        'attributes',
+        'error',
+    )
+
+    def __init__(self, trace, name: str, kind: int, parent_id: str, attributes):
+        self.trace = trace
+        self.name = name
+        self.kind = kind
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.attributes = attributes
+        self.error = None
+
+    def set_attributes(self, **attributes) -> None:
+        self.attributes.update(attributes)
+
+    def end(self) -> None:
+        self.end_ns = time.time_ns()
+        self.trace.spans.append(self)
+
+
+class Trace:
+    """The spans of one sampled request, exported once its root span ends"""
+
+    __slots__ = ('trace_id', 'spans')
+
+    def __init__(self, trace_id: str):
+        self.trace_id = trace_id
+        self.spans: list[Span] = []
+
+
+# Innermost open span of the sampled trace being run, if any
+_current_span: ContextVar[Span | None] = ContextVar('_current_span', default=None)
+
+
+def set_attributes(**attributes) -> None:
+    """Set attributes on the current span; a no-op outside sampled traces"""
+    span = _current_span.get()
+    if span is not None:
+        span.attributes.update(attributes)
+
+
+def _run_span(span: Span):
+    token = _current_span.set(span)
+    try:
+        yield span
+    except BaseException as exc:
+        span.error = exc
+        raise
+    finally:
+        _current_span.reset(token)
+        span.end()
+
+
+@contextmanager
+def start_span(name: str, kind: int = INTERNAL, **attributes):
+    """
+    A child span of the current span, current inside the block. Yields
+    None, and costs next to nothing, outside sampled traces.
+    """
+    parent = _current_span.get()
+    if parent is None:
+        yield None
+        return
+    yield from _run_span(Span(parent.trace, name, kind, parent.span_id, attributes))
+
+
+def _otlp_value(value) -> dict:
+    if isinstance(value, bool):
+        return {'boolValue': value}
+    if isinstance(value, int):
+        return {'intValue': str(value)}
+    if isinstance(value, float):
+        return {'doubleValue': value}
+    return {'stringValue': str(value)}
+
+
+def _otlp_attributes(attributes: dict) -> list[dict]:
+    return [
+        {'key': key, 'value': _otlp_value(value)}
+        for key, value in attributes.items()
+        if value is not None
+    ]
+
+
+def otlp_json(trace: Trace, service_name: str = TRACE_SERVICE_NAME) -> dict:
+    """A trace as an OTLP/JSON ExportTraceServiceRequest"""
+    spans = []
+    for span in trace.spans:
+        otlp_span = {
+            'traceId': trace.trace_id,
+            'spanId': span.span_id,
+            'name': span.name,
+            'kind': span.kind,
+            'startTimeUnixNano': str(span.start_ns),
+            'endTimeUnixNano': str(span.end_ns),
+            'attributes': _otlp_attributes(span.attributes),
+            'status': {'code': 1},
+        }
+        if span.parent_id:
+            otlp_span['parentSpanId'] = span.parent_id
+        if span.error is not None:
+            otlp_span['status'] = {'code': 2, 'message': repr(span.error)}
+        spans.append(otlp_span)
+    return {
+        'resourceSpans': [
+            {
+                'resource': {
+                    'attributes': _otlp_attributes({'service.name': service_name})
+                },
+                'scopeSpans': [{'scope': {'name': __name__}, 'spans': spans}],
+            }
+        ]
+    }
+
+
+class SpanExporter:
+    """
+    Exports finished traces as OTLP/JSON from a background thread, so
+    requests never wait on it: 'otlp' POSTs each trace to an OpenTelemetry
+    collector's OTLP/HTTP endpoint, 'file' appends it as a line to a file
+    (the collector's otlpjsonfile format). Traces beyond max_queue waiting
+    for export are dropped.
+    """
+
+    def __init__(self, target: str, destination: str, max_queue: int):
+        if target not in ('otlp', 'file'):
+            raise ValueError(f'Unknown trace export target: {target}')
+        self.target = target
+        self.destination = destination
+        self.exported = 0
+        self.dropped = 0
+        self._queue: queue.Queue[Trace] = queue.Queue(max_queue)
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def export(self, trace: Trace) -> None:
+        try:
+            self._queue.put_nowait(trace)
+        except queue.Full:
+            self.dropped += 1
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name='span-exporter', daemon=True
+                )
+                self._thread.start()
+
+    def flush(self, timeout: float | None = None) -> bool:
+        """
+        Wait up to `timeout` seconds until every trace queued so far is
+        exported (or failed); whether they were
+        """
+        with self._queue.all_tasks_done:
+            return self._queue.all_tasks_done.wait_for(
+                lambda: not self._queue.unfinished_tasks, timeout
+            )
+
+    def _run(self) -> None:
+        while True:
+            trace = self._queue.get()
+            try:
+                self._write(json.dumps(otlp_json(trace)).encode())
+                self.exported += 1
+            except Exception:
+                self.dropped += 1
+                logger.exception('Trace export to %s failed', self.destination)
+            finally:
+                self._queue.task_done()
+
+    def _write(self, body: bytes) -> None:
+        if self.target == 'file':
+            with open(self.destination, 'ab') as file:
+                file.write(body + b'\n')
+            return
+        request = urllib.request.Request(
+            self.destination,
+            data=body,
+            headers={'Content-Type': 'application/json'},
+        )
+        with urllib.request.urlopen(request, timeout=5):
+            pass
+
+
+class Tracer:
+    """Samples requests, and hands the traces of sampled ones to the exporter"""
+
+    def __init__(self, exporter: SpanExporter | None, sample_ratio: float):
+        self.exporter = exporter
+        self.sample_ratio = sample_ratio
+
+    @contextmanager
+    def start_trace(self, name: str, traceparent: str | None = None, **attributes):
+        """
+        The root span of a request, or None when it is not sampled. A valid
+        W3C traceparent header continues the caller's trace and follows its
+        sampling decision; otherwise sample_ratio of requests are sampled.
+        """
+        if self.exporter is None:
+            yield None
+            return
+        parent = _TRACEPARENT.match(traceparent or '')
+        if parent:
+            trace_id, parent_id, flags = parent.groups()
+            sampled = int(flags, 16) & 1
+        else:
+            trace_id, parent_id = os.urandom(16).hex(), ''
+            sampled = random.random() < self.sample_ratio
+        if not sampled:
+            yield None
+            return
+        trace = Trace(trace_id)
+        try:
+            yield from _run_span(Span(trace, name, SERVER, parent_id, attributes))
+        finally:
+            self.exporter.export(trace)
+
+
+def create_exporter() -> SpanExporter | None:
+    if not TRACE_EXPORT:
+        return None
+    destination = TRACE_OTLP_ENDPOINT if TRACE_EXPORT == 'otlp' else TRACE_FILE
+    return SpanExporter(TRACE_EXPORT, destination, TRACE_EXPORT_MAX_QUEUE)
+
+
+tracer = Tracer(create_exporter(), TRACE_SAMPLE_RATIO)
+
+
+# A CLIENT span per statement of a sampled trace; async engines run their
+# statements on the sync engine they wrap, where the request's context is
+# current too
+@event.listens_for(Engine, 'before_cursor_execute')
+def _start_statement(conn, cursor, statement, parameters, context, executemany):
+    parent = _current_span.get()
+    if parent is None:
+        return
+    span = Span(
+        parent.trace,
+        statement.split(None, 1)[0].upper() if statement else 'SQL',
+        CLIENT,
+        parent.span_id,
+        {
+            'db.system': conn.dialect.name,
+            'db.statement': statement[:MAX_STATEMENT_LENGTH],
+            'db.executemany': executemany,
+        },
+    )
+    conn.info.setdefault('trace_spans', []).append(span)
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _end_statement(conn, cursor, statement, parameters, context, executemany):
+    if _current_span.get() is None or not conn.info.get('trace_spans'):
+        return
+    span = conn.info['trace_spans'].pop()
+    if cursor.rowcount >= 0:
+        span.attributes['db.rowcount'] = cursor.rowcount
+    span.end()
+
+
+@event.listens_for(Engine, 'handle_error')
+def _failed_statement(exception_context):
+    connection = exception_context.connection
+    if connection is not None and connection.info.get('trace_spans'):
+        span = connection.info['trace_spans'].pop()
+        span.error = exception_context.original_exception
+        span.end()
+
+
+class TracingMiddleware:
+    """
+    ASGI middleware starting the trace of each sampled HTTP request, named
+    after its route, until its response is sent. Added outermost, so the
+    trace covers authentication, service calls and response encoding.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or tracer.exporter is None:
+            await self.app(scope, receive, send)
+            return
+
+        matched = match_route(scope)
+        route = matched.path if matched else UNMATCHED_ROUTE
+        traceparent = next(
+            (
+                value.decode()
+                for key, value in scope['headers']
+                if key == b'traceparent'
+            ),
+            None,
+        )
+        with tracer.start_trace(
+            f"{scope['method']} {route}",
+            traceparent,
+            **{
+                'http.request.method': scope['method'],
+                'http.route': route,
+                'url.path': scope['path'],
+            },
+        ) as span:
+            if span is None:
+                await self.app(scope, receive, send)
+                return
+
+            async def send_with_status(message):
+                if message['type'] == 'http.response.start':
+                    span.attributes['http.response.status_code'] = message['status']
+                await send(message)
+
+            await self.app(scope, receive, send_with_status)
@@ -1,21 +1,59 @@
+import asyncio
+
 from fastapi import FastAPI
 from contextlib import asynccontextmanager
-from app.core.db_session import get_db
-from app.core.database import Base, engine
-from app.mock_data import init_mock_data
+from app.core.change_feed import change_feed
+from app.core.db_session import RequestSessionMiddleware
+from app.core.database import async_engine
+from app.core.instrumentation import InstrumentationMiddleware
+from app.core.jobs import run_periodically
+from app.core.locks import SUMMARY_REFRESH_LOCK_KEY
+from app.core.replicas import replicas
+from app.core.tracing import TracingMiddleware, tracer
 from app.routers import all_routers
+from app.services.summary_service import refresh_site_daily_summary
+
+from settings import (
+    CHANGE_FEED_ENABLED,
+    SUMMARY_REFRESH_ENABLED,
+    SUMMARY_REFRESH_INTERVAL_SECONDS,
+)
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    Base.metadata.create_all(bind=engine)
-
-    db = next(get_db())
-    init_mock_data(db)
+    # Schema and seed data are set up by `python -m app.core.init_db`, once
+    # per deploy, so a worker starts without waiting on the database (the
+    # change feed connects in the background)
+    background = []
+    if CHANGE_FEED_ENABLED and change_feed.supported:
+        background.append(asyncio.create_task(change_feed.run()))
+    if SUMMARY_REFRESH_ENABLED:
+        background.append(
+            asyncio.create_task(
+                run_periodically(
+                    refresh_site_daily_summary,
+                    SUMMARY_REFRESH_INTERVAL_SECONDS,
+                    lock_key=SUMMARY_REFRESH_LOCK_KEY,
+                )
+            )
+        )
     yield
+    for task in background:
+        task.cancel()
+    await asyncio.gather(*background, return_exceptions=True)
+    await async_engine.dispose()
+    await replicas.dispose()
+    if tracer.exporter is not None:
+        await asyncio.to_thread(tracer.exporter.flush, 5)
 
 
 app = FastAPI(title='Energy Management API', lifespan=lifespan)
+app.add_middleware(RequestSessionMiddleware)
+# Outermost, so that it also times the request session's commit
+app.add_middleware(InstrumentationMiddleware)
+# Outermost of all, so that a request's trace spans all of the above
+app.add_middleware(TracingMiddleware)
 
 # Include routers
 for router in all_routers:
@@ -4,3 +4,4 @@ from app.models.device import Device
 from app.models.metric import Metric
 from app.models.subscription import Subscription
 from app.models.user_site import user_site
+from app.models.site_daily_summary import SiteDailySummary, SummaryDirtyDay
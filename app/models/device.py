@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, ForeignKey
+from sqlalchemy import Column, Integer, String, ForeignKey, Index
 from sqlalchemy.orm import relationship
 
 from app.core.database import Base
@@ -14,6 +14,11 @@ class Device(Base):
     site_id = Column(Integer, ForeignKey('sites.id'))
     type = Column(String)  # e.g., "sensor", "controller", etc.
 
+    __table_args__ = (
+        # Fleet statistics group devices by type and site
+        Index('ix_devices_type_site_id', 'type', 'site_id'),
+    )
+
     # Relationships
     site = relationship('Site', back_populates='devices')
     metrics = relationship(
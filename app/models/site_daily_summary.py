@@ -0,0 +1,37 @@
+from datetime import datetime
+
+from sqlalchemy import Column, Integer, ForeignKey, Date, DateTime, Float
+from sqlalchemy.orm import relationship
+
+from app.core.database import Base
+
+
+class SiteDailySummary(Base):
+    """Materialized per-site, per-day rollup of metric readings"""
+
+    __tablename__ = 'site_daily_summary'
+
+    site_id = Column(Integer, ForeignKey('sites.id'), primary_key=True)
+    day = Column(Date, primary_key=True)
+    energy_kwh = Column(Float, default=0.0)
+    peak_kw = Column(Float, nullable=True)
+    min_soc = Column(Float, nullable=True)
+    max_soc = Column(Float, nullable=True)
+    uptime_ratio = Column(Float, default=0.0)
+    reading_count = Column(Integer, default=0)
+    refreshed_at = Column(DateTime, default=datetime.utcnow)
+
+    # Relationships
+    site = relationship('Site')
+
+
+class SummaryDirtyDay(Base):
+    """
+    A (site, day) whose readings changed since the last summary refresh.
+    Rows are written in the same transaction as the readings themselves.
+    """
+
+    __tablename__ = 'summary_dirty_days'
+
+    site_id = Column(Integer, primary_key=True)
+    day = Column(Date, primary_key=True)
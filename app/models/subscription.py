@@ -26,3 +26,7 @@ class Subscription(Base):
     metrics = relationship(
         'Metric', secondary=subscription_metric, back_populates='subscriptions'
     )
+
+    @property
+    def metric_ids(self) -> list[int]:
+        return [metric.id for metric in self.metrics]
@@ -3,6 +3,8 @@ from .site_router import router as site_router
 from .device_router import router as device_router
 from .metric_router import router as metric_router
 from .subscription_router import router as subscription_router
+from .export_router import router as export_router
+from .internal_router import router as internal_router
 
 all_routers = [
     auth_router,
@@ -10,4 +12,6 @@ all_routers = [
     device_router,
     metric_router,
     subscription_router,
+    export_router,
+    internal_router,
 ]
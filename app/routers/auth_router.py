@@ -9,6 +9,7 @@ from app.core.auth import (
     get_current_active_user,
     get_admin_user,
 )
+from app.core.password_pool import PasswordPoolBusy
 from app.schemas.user import Token, User, UserCreate
 from app.services import user_service
 
@@ -18,7 +19,16 @@ router = APIRouter(prefix='/auth', tags=['Authentication'])
 @router.post('/token', response_model=Token)
 async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends()):
     """Login endpoint to get access token"""
-    user = user_service.authenticate_user(form_data.username, form_data.password)
+    try:
+        user = await user_service.authenticate_user(
+            form_data.username, form_data.password
+        )
+    except PasswordPoolBusy:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail='Too many concurrent logins, retry shortly',
+            headers={'Retry-After': '1'},
+        )
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -38,7 +48,13 @@ async def register_user(
 ):
     """Register new user (admin only)"""
     try:
-        return user_service.create_user(user_in)
+        return await user_service.create_user(user_in)
+    except PasswordPoolBusy:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail='Too many concurrent password operations, retry shortly',
+            headers={'Retry-After': '1'},
+        )
     except ValueError as e:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
 
@@ -1,43 +1,76 @@
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, Request
+from pydantic import TypeAdapter
 
 from app.schemas.device import Device, DeviceCreate
+from app.schemas.fleet import FleetStatistics
 from app.services import device_service
-from app.models.user import User
 from app.core.auth import (
+    Principal,
+    authorization_scope,
+    authorized_site_ids,
     get_current_active_user,
     get_technician_user,
     get_authorized_user_for_site,
 )
+from app.core.response_cache import DEVICES, cached_json_response
 
 router = APIRouter(prefix='/devices', tags=['Devices'])
 
+_device_list = TypeAdapter(list[Device])
+
 
 @router.get('/', response_model=list[Device])
 async def read_devices(
-    site_id: int | None = None, current_user: User = Depends(get_current_active_user)
+    request: Request,
+    site_id: int | None = None,
+    current_user: Principal = Depends(get_current_active_user),
 ):
     """
     R2: List all devices, optionally filtered by site_id.
     Standard users can only see devices at sites they are authorized to access.
+    Served from the response cache with an ETag; If-None-Match gets a 304.
     """
     try:
         # If site_id is provided, check authorization
         if site_id is not None:
             await get_authorized_user_for_site(site_id, current_user)
-        return device_service.list_devices(site_id)
+
+        async def build() -> bytes:
+            devices = await device_service.list_devices(
+                site_id, site_ids=authorized_site_ids(current_user)
+            )
+            return _device_list.dump_json(devices)
+
+        return await cached_json_response(
+            request, DEVICES, authorization_scope(current_user), build
+        )
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
 
 
+@router.get('/stats', response_model=FleetStatistics)
+async def read_fleet_statistics(
+    metric_name: str, current_user: Principal = Depends(get_current_active_user)
+):
+    """
+    Fleet statistics: avg/min/max of the latest value of a metric, grouped
+    by device type, by site and by site + type.
+    Standard users only see sites they are authorized to access.
+    """
+    return await device_service.get_fleet_statistics(
+        metric_name, site_ids=authorized_site_ids(current_user)
+    )
+
+
 @router.get('/{device_id}', response_model=Device)
 async def read_device(
-    device_id: int, current_user: User = Depends(get_current_active_user)
+    device_id: int, current_user: Principal = Depends(get_current_active_user)
 ):
     """
     R2: Get a specific device by ID.
     Standard users can only see devices at sites they are authorized to access.
     """
-    device = device_service.get_device(device_id)
+    device = await device_service.get_device(device_id)
     if not device:
         raise HTTPException(status_code=404, detail='Device not found')
 
@@ -48,7 +81,7 @@ async def read_device(
 
 @router.post('/', response_model=Device, status_code=201)
 async def create_device(
-    device_in: DeviceCreate, current_user: User = Depends(get_technician_user)
+    device_in: DeviceCreate, current_user: Principal = Depends(get_technician_user)
 ):
     """
     R2: Create a new device.
@@ -57,7 +90,7 @@ async def create_device(
     try:
         # Check site authorization
         await get_authorized_user_for_site(device_in.site_id, current_user)
-        return device_service.create_device(device_in)
+        return await device_service.create_device(device_in)
     except ValueError as e:
         raise HTTPException(status_code=404, detail=str(e))
 
@@ -66,7 +99,7 @@ async def create_device(
 async def update_device(
     device_id: int,
     device_in: DeviceCreate,
-    current_user: User = Depends(get_technician_user),
+    current_user: Principal = Depends(get_technician_user),
 ):
     """
     R2: Update an existing device.
@@ -74,7 +107,7 @@ async def update_device(
     """
     try:
         # Get existing device to check site
-        device = device_service.get_device(device_id)
+        device = await device_service.get_device(device_id)
         if not device:
             raise HTTPException(status_code=404, detail='Device not found')
 
@@ -83,14 +116,14 @@ async def update_device(
         if device_in.site_id != device.site_id:
             await get_authorized_user_for_site(device_in.site_id, current_user)
 
-        return device_service.update_device(device_id, device_in)
+        return await device_service.update_device(device_id, device_in)
     except ValueError as e:
         raise HTTPException(status_code=404, detail=str(e))
 
 
 @router.delete('/{device_id}', status_code=204)
 async def delete_device(
-    device_id: int, current_user: User = Depends(get_technician_user)
+    device_id: int, current_user: Principal = Depends(get_technician_user)
 ):
     """
     R2: Delete a device by ID.
@@ -98,13 +131,13 @@ async def delete_device(
     """
     try:
         # Get device to check site
-        device = device_service.get_device(device_id)
+        device = await device_service.get_device(device_id)
         if not device:
             raise HTTPException(status_code=404, detail='Device not found')
 
         # Check site authorization
         await get_authorized_user_for_site(device.site_id, current_user)
-        device_service.delete_device(device_id)
+        await device_service.delete_device(device_id)
     except ValueError as e:
         raise HTTPException(status_code=404, detail=str(e))
     return None
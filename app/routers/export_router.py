@@ -0,0 +1,161 @@
+from datetime import datetime, timedelta, timezone
+from typing import Literal
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import StreamingResponse
+
+from app.core.auth import (
+    Principal,
+    check_site_authorization,
+    get_current_active_user,
+)
+from app.services import export_service, subscription_service
+
+router = APIRouter(prefix='/export', tags=['Export'])
+
+ExportFormat = Literal['ndjson', 'csv', 'arrow', 'parquet']
+
+# File name extension of each export format
+EXTENSIONS = {'ndjson': 'ndjson', 'csv': 'csv', 'arrow': 'arrows', 'parquet': 'parquet'}
+
+
+async def _check_scope(
+    current_user: Principal,
+    metric_id: int | None,
+    subscription_id: int | None,
+    site_id: int | None,
+) -> str:
+    """
+    Check the one requested scope exists and the user may read it (metric
+    and site exports need site authorization, subscription exports
+    ownership). Returns a file name stem for it.
+    """
+    if sum(scope is not None for scope in (metric_id, subscription_id, site_id)) != 1:
+        raise HTTPException(
+            status_code=400,
+            detail='Give exactly one of metric_id, subscription_id or site_id',
+        )
+    if site_id is not None:
+        check_site_authorization(current_user, site_id)
+        return f'site-{site_id}'
+    if subscription_id is not None:
+        sub = await subscription_service.get_subscription(subscription_id)
+        if not sub:
+            raise HTTPException(status_code=404, detail='Subscription not found')
+        if sub.user_id != current_user.id:
+            raise HTTPException(
+                status_code=403, detail='Not authorized to access this subscription'
+            )
+        return f'subscription-{subscription_id}'
+    return f'metric-{metric_id}'
+
+
+def _export_response(format: str, columns, batches, name: str) -> StreamingResponse:
+    media_type, encode = export_service.EXPORT_FORMATS[format]
+    return StreamingResponse(
+        encode(columns, batches),
+        media_type=media_type,
+        headers={
+            'Content-Disposition': f'attachment; filename="{name}.{EXTENSIONS[format]}"'
+        },
+    )
+
+
+@router.get('/readings')
+async def export_readings(
+    format: ExportFormat = 'ndjson',
+    metric_id: int | None = None,
+    subscription_id: int | None = None,
+    site_id: int | None = None,
+    start_time: datetime | None = None,
+    end_time: datetime | None = None,
+    current_user: Principal = Depends(get_current_active_user),
+):
+    """
+    Export stored readings, oldest first, as a streamed download.
+
+    Args:
+        format: `ndjson` (one JSON object per line), `csv`, `arrow` (Arrow
+            IPC stream) or `parquet`
+        metric_id: Readings of the metric's series (its name on its device)
+        subscription_id: Readings of every metric of a subscription you own
+        site_id: Readings of every device at a site
+        start_time: Earliest reading time (inclusive; default: unbounded)
+        end_time: Latest reading time (exclusive; default: unbounded)
+
+    Exactly one of metric_id, subscription_id and site_id is required.
+    Rows are read in batches through a server-side cursor and sent as they
+    arrive, so any range streams in constant memory.
+    """
+    name = await _check_scope(current_user, metric_id, subscription_id, site_id)
+    series = None
+    if site_id is None:
+        found = await export_service.reading_series(
+            metric_id=metric_id, subscription_id=subscription_id
+        )
+        if metric_id is not None:
+            if not found:
+                raise HTTPException(status_code=404, detail='Metric not found')
+            for _, _, series_site_id in found:
+                check_site_authorization(current_user, series_site_id)
+        series = [(device_id, metric_name) for device_id, metric_name, _ in found]
+
+    query = export_service.readings_query(
+        series=series, site_id=site_id, start_time=start_time, end_time=end_time
+    )
+    return _export_response(
+        format,
+        export_service.READING_COLUMNS,
+        export_service.stream_rows(query),
+        f'{name}-readings',
+    )
+
+
+@router.get('/history')
+async def export_history(
+    format: ExportFormat = 'arrow',
+    metric_id: int | None = None,
+    subscription_id: int | None = None,
+    site_id: int | None = None,
+    start_time: datetime | None = None,
+    end_time: datetime | None = None,
+    interval_minutes: int = Query(5, ge=1),
+    current_user: Principal = Depends(get_current_active_user),
+):
+    """
+    Export metric history, one row per metric and time point, as a streamed
+    download. Values are those of the metric history endpoints, with no
+    point budget: rows are generated and sent in batches.
+
+    Args:
+        format: `arrow` (Arrow IPC stream), `parquet`, `ndjson` or `csv`
+        metric_id: History of one metric
+        subscription_id: History of every metric of a subscription you own
+        site_id: History of the latest metric of every series at a site
+        start_time: Start of the time axis (defaults to 24 hours ago)
+        end_time: End of the time axis (defaults to current time)
+        interval_minutes: Time interval between data points in minutes
+
+    Exactly one of metric_id, subscription_id and site_id is required.
+    """
+    name = await _check_scope(current_user, metric_id, subscription_id, site_id)
+    metrics = await export_service.history_metrics(
+        metric_id=metric_id, subscription_id=subscription_id, site_id=site_id
+    )
+    if metric_id is not None:
+        if not metrics:
+            raise HTTPException(status_code=404, detail='Metric not found')
+        check_site_authorization(current_user, metrics[0][-1])
+
+    end_time = end_time or datetime.now(timezone.utc)
+    start_time = start_time or end_time - timedelta(hours=24)
+    if start_time >= end_time:
+        raise HTTPException(
+            status_code=400, detail='start_time must be before end_time'
+        )
+    return _export_response(
+        format,
+        export_service.HISTORY_COLUMNS,
+        export_service.stream_history(metrics, start_time, end_time, interval_minutes),
+        f'{name}-history',
+    )
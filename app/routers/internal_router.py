@@ -0,0 +1,25 @@
+from fastapi import APIRouter, Depends
+from fastapi.responses import PlainTextResponse, Response
+
+from app.core.auth import Principal, get_admin_user
+from app.core.instrumentation import Exposition
+from app.services import instrumentation_service
+
+router = APIRouter(prefix='/internal', tags=['Internal'])
+
+
+@router.get('/metrics', response_class=PlainTextResponse)
+async def read_instrumentation(current_user: Principal = Depends(get_admin_user)):
+    """
+    Instrumentation of the worker serving the request, in the Prometheus
+    text exposition format: request latency, requests in flight, SQL
+    statements per request and per engine, connection pools, replicas,
+    cache hit ratios, the password worker pool, stream clients and the
+    change feed. Admin only; scrape with an admin's bearer token. (/metrics
+    is the metric readings API.)
+    """
+    # As a header, since Starlette appends a second charset to text/ media types
+    return Response(
+        instrumentation_service.render_metrics(),
+        headers={'Content-Type': Exposition.CONTENT_TYPE},
+    )
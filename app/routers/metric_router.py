@@ -1,75 +1,130 @@
 from datetime import datetime, timedelta, timezone
-
-from fastapi import APIRouter, HTTPException
-
-from app.schemas.metric import Metric, MetricCreate, MetricTimeSeries
+from typing import Literal
+
+from fastapi import APIRouter, HTTPException, Query, Request
+
+from app.core.encodings import negotiated_response
+from app.core.query_guard import query_budget
+from app.schemas.metric import (
+    Metric,
+    MetricCreate,
+    MetricHistoryBatch,
+    MetricTimeSeries,
+)
 from app.services import metric_service
 
 router = APIRouter(prefix='/metrics', tags=['Metrics'])
 
 
 @router.get('/', response_model=list[Metric])
-def read_metrics(device_id: int | None = None):
+async def read_metrics(request: Request, device_id: int | None = None):
     """
-    R3: List all metrics, optionally filtered by device_id.
+    R3: List all metrics, optionally filtered by device_id, encoded as the
+    Accept header asks (JSON, MessagePack or columnar).
     """
     try:
-        return metric_service.list_metrics(device_id)
+        metrics = await metric_service.list_metrics(device_id)
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
+    return negotiated_response(request, metrics)
+
+
+@router.get('/history', response_model=MetricHistoryBatch)
+async def get_metrics_history(
+    request: Request,
+    metric_ids: str = Query(..., description='Comma-separated metric IDs'),
+    start_time: datetime | None = None,
+    end_time: datetime | None = None,
+    interval_minutes: int = Query(5, ge=1),
+    strict: bool = False,
+    compare: Literal['day', 'week', 'year'] | None = None,
+):
+    """
+    R5: Get historical time series data for several metrics at once.
+    All series share one time axis (the `timestamps` of the response).
+
+    Args:
+        metric_ids: Comma-separated IDs of the metrics, e.g. `1,2,3`
+        start_time: Start time for the time series (defaults to 24 hours ago)
+        end_time: End time for the time series (defaults to current time)
+        interval_minutes: Time interval between data points in minutes (default: 5)
+        strict: Reject requests over the point budget instead of coarsening
+            the interval (the effective interval is returned as interval_minutes)
+        compare: Also return the window one day, week or year (52 weeks)
+            earlier as previous_values, plus deltas, aligned to the same axis
+
+    Encoded as the Accept header asks: JSON, MessagePack or the columnar
+    binary layout (see app.core.encodings).
+    """
+    try:
+        ids = [int(metric_id) for metric_id in metric_ids.split(',') if metric_id]
+        history = await metric_service.get_metrics_history(
+            metric_ids=ids,
+            start_time=start_time,
+            end_time=end_time,
+            interval_minutes=interval_minutes,
+            strict=strict,
+            compare=compare,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return negotiated_response(request, history)
 
 
 @router.get('/{metric_id}', response_model=Metric)
-def read_metric(metric_id: int):
+async def read_metric(metric_id: int):
     """
     R3: Get a specific metric by ID.
     """
-    metric = metric_service.get_metric(metric_id)
+    metric = await metric_service.get_metric(metric_id)
     if not metric:
         raise HTTPException(status_code=404, detail='Metric not found')
     return metric
 
 
 @router.post('/', response_model=Metric, status_code=201)
-def create_metric(metric_in: MetricCreate):
+async def create_metric(metric_in: MetricCreate):
     """
     R3: Create a new metric.
     """
     try:
-        return metric_service.create_metric(metric_in)
+        return await metric_service.create_metric(metric_in)
     except ValueError as e:
         raise HTTPException(status_code=404, detail=str(e))
 
 
 @router.put('/{metric_id}', response_model=Metric)
-def update_metric(metric_id: int, metric_in: MetricCreate):
+async def update_metric(metric_id: int, metric_in: MetricCreate):
     """
     R3: Update an existing metric.
     """
     try:
-        return metric_service.update_metric(metric_id, metric_in)
+        return await metric_service.update_metric(metric_id, metric_in)
     except ValueError as e:
         raise HTTPException(status_code=404, detail=str(e))
 
 
 @router.delete('/{metric_id}', status_code=204)
-def delete_metric(metric_id: int):
+async def delete_metric(metric_id: int):
     """
     R3: Delete a metric by ID.
     """
     try:
-        metric_service.delete_metric(metric_id)
+        await metric_service.delete_metric(metric_id)
     except ValueError as e:
         raise HTTPException(status_code=404, detail=str(e))
     return None
 
 
 @router.get('/{metric_id}/history', response_model=MetricTimeSeries)
-def get_metric_history(
+async def get_metric_history(
+    request: Request,
     metric_id: int,
     start_time: datetime | None = None,
     end_time: datetime | None = None,
-    interval_minutes: int = 5,
+    interval_minutes: int = Query(5, ge=1),
+    strict: bool = False,
+    compare: Literal['day', 'week', 'year'] | None = None,
 ):
     """
     R5: Get historical time series data for a metric.
@@ -79,6 +134,13 @@ def get_metric_history(
         start_time: Start time for the time series (defaults to 24 hours ago)
         end_time: End time for the time series (defaults to current time)
         interval_minutes: Time interval between data points in minutes (default: 5)
+        strict: Reject requests over the point budget instead of coarsening
+            the interval (the effective interval is returned as interval_minutes)
+        compare: Also return the window one day, week or year (52 weeks)
+            earlier as previous_values, plus deltas, aligned to the same axis
+
+    Encoded as the Accept header asks: JSON, MessagePack or the columnar
+    binary layout (see app.core.encodings).
     """
     try:
         if not end_time:
@@ -86,25 +148,31 @@ def get_metric_history(
         if not start_time:
             start_time = end_time - timedelta(hours=24)
 
-        return metric_service.get_metric_history(
+        history = await metric_service.get_metric_history(
             metric_id=metric_id,
             start_time=start_time,
             end_time=end_time,
             interval_minutes=interval_minutes,
+            strict=strict,
+            compare=compare,
         )
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    return negotiated_response(request, history)
 
 
 @router.get('/device/{device_id}/latest', response_model=list[Metric])
-def get_device_latest_metrics(device_id: int):
+@query_budget(1)
+async def get_device_latest_metrics(request: Request, device_id: int):
     """
     R3: Get the latest values for all metrics of a device.
-    Returns a list of metrics with their latest values and metadata (timestamp, unit).
+    Returns a list of metrics with their latest values and metadata (timestamp, unit),
+    encoded as the Accept header asks (JSON, MessagePack or columnar).
     """
     try:
-        return metric_service.get_latest_metric_value(device_id)
+        latest = await metric_service.get_latest_metric_value(device_id)
     except ValueError as e:
         raise HTTPException(status_code=404, detail=str(e))
+    return negotiated_response(request, latest)
@@ -1,21 +1,48 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Query, Request
+from pydantic import TypeAdapter
+
+from app.core.query_guard import query_budget
+from app.core.response_cache import SITES, cached_json_response
 from app.schemas.site import Site
-from app.services import site_service
+from app.schemas.site_daily_summary import SiteDailySummary
+from app.services import site_service, summary_service
+
+from settings import SUMMARY_DEFAULT_DAYS
 
 router = APIRouter(prefix='/sites', tags=['Sites'])
 
+_site_list = TypeAdapter(list[Site])
+
 
 @router.get('/', response_model=list[Site])
-def read_sites():
-    """R1: List all sites."""
-    sites = site_service.list_sites()
-    return sites
+@query_budget(3)
+async def read_sites(request: Request):
+    """
+    R1: List all sites.
+    Served from the response cache with an ETag; If-None-Match gets a 304.
+    """
+
+    async def build() -> bytes:
+        return _site_list.dump_json(await site_service.list_sites())
+
+    return await cached_json_response(request, SITES, 'public', build)
 
 
 @router.get('/{site_id}', response_model=Site)
-def read_site(site_id: int):
+async def read_site(site_id: int):
     """R1: Get site by ID."""
-    site = site_service.get_site(site_id)
+    site = await site_service.get_site(site_id)
     if not site:
         raise HTTPException(status_code=404, detail='Site not found')
     return site
+
+
+@router.get('/{site_id}/daily', response_model=list[SiteDailySummary])
+async def read_site_daily_summary(
+    site_id: int, days: int = Query(SUMMARY_DEFAULT_DAYS, ge=1, le=366)
+):
+    """
+    Get the materialized daily summary (kWh, peak kW, SoC range, uptime)
+    of a site for the last `days` days, oldest first.
+    """
+    return await summary_service.get_site_daily_summary(site_id, days=days)
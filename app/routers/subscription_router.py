@@ -1,32 +1,44 @@
 from datetime import datetime, timezone, timedelta
+from typing import Literal
 
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, Query, Request
+from fastapi.responses import StreamingResponse
 
 from app.schemas.subscription import Subscription, SubscriptionCreate
 from app.services import subscription_service
-from app.models.user import User
-from app.core.auth import get_current_active_user
+from app.core.auth import Principal, get_current_active_user
+from app.core.encodings import negotiated_response
+from app.core.live import metric_hub, stream_changes
+from app.core.query_guard import query_budget
+
+from settings import STREAM_HEARTBEAT_SECONDS, STREAM_MAX_SECONDS
 
 router = APIRouter(prefix='/subscriptions', tags=['Subscriptions'])
 
+SINCE_DESCRIPTION = (
+    'Cursor returned by the last sync, for a delta sync; empty for the first'
+)
+
 
 @router.get('/', response_model=list[Subscription])
-async def read_subscriptions(current_user: User = Depends(get_current_active_user)):
+async def read_subscriptions(
+    current_user: Principal = Depends(get_current_active_user),
+):
     """
     R4: List all subscriptions for the current user.
     """
-    return subscription_service.list_subscriptions(current_user.id)
+    return await subscription_service.list_subscriptions(current_user.id)
 
 
 @router.get('/{subscription_id}', response_model=Subscription)
 async def read_subscription(
-    subscription_id: int, current_user: User = Depends(get_current_active_user)
+    subscription_id: int, current_user: Principal = Depends(get_current_active_user)
 ):
     """
     R4: Get a specific subscription by ID.
     Only accessible by the subscription owner.
     """
-    sub = subscription_service.get_subscription(subscription_id)
+    sub = await subscription_service.get_subscription(subscription_id)
     if not sub:
         raise HTTPException(status_code=404, detail='Subscription not found')
     if sub.user_id != current_user.id:
@@ -38,14 +50,15 @@ async def read_subscription(
 
 @router.post('/', response_model=Subscription, status_code=201)
 async def create_subscription(
-    sub_in: SubscriptionCreate, current_user: User = Depends(get_current_active_user)
+    sub_in: SubscriptionCreate,
+    current_user: Principal = Depends(get_current_active_user),
 ):
     """
     R4: Create a new subscription.
     Users can subscribe to any metrics they have access to.
     """
     try:
-        return subscription_service.create_subscription(sub_in, current_user.id)
+        return await subscription_service.create_subscription(sub_in, current_user.id)
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
 
@@ -54,75 +67,148 @@ async def create_subscription(
 async def update_subscription(
     subscription_id: int,
     sub_in: SubscriptionCreate,
-    current_user: User = Depends(get_current_active_user),
+    current_user: Principal = Depends(get_current_active_user),
 ):
     """
     R4: Update an existing subscription.
     Only accessible by the subscription owner.
     """
     try:
-        sub = subscription_service.get_subscription(subscription_id)
+        sub = await subscription_service.get_subscription(subscription_id)
         if not sub:
             raise HTTPException(status_code=404, detail='Subscription not found')
         if sub.user_id != current_user.id:
             raise HTTPException(
                 status_code=403, detail='Not authorized to modify this subscription'
             )
-        return subscription_service.update_subscription(subscription_id, sub_in)
+        return await subscription_service.update_subscription(subscription_id, sub_in)
     except ValueError as e:
         raise HTTPException(status_code=404, detail=str(e))
 
 
 @router.delete('/{subscription_id}', status_code=204)
 async def delete_subscription(
-    subscription_id: int, current_user: User = Depends(get_current_active_user)
+    subscription_id: int, current_user: Principal = Depends(get_current_active_user)
 ):
     """
     R4: Delete a subscription by ID.
     Only accessible by the subscription owner.
     """
     try:
-        sub = subscription_service.get_subscription(subscription_id)
+        sub = await subscription_service.get_subscription(subscription_id)
         if not sub:
             raise HTTPException(status_code=404, detail='Subscription not found')
         if sub.user_id != current_user.id:
             raise HTTPException(
                 status_code=403, detail='Not authorized to delete this subscription'
             )
-        subscription_service.delete_subscription(subscription_id)
+        await subscription_service.delete_subscription(subscription_id)
     except ValueError as e:
         raise HTTPException(status_code=404, detail=str(e))
     return None
 
 
 @router.get('/{subscription_id}/latest')
+@query_budget(8)
 async def get_subscription_latest_values(
-    subscription_id: int, current_user: User = Depends(get_current_active_user)
+    request: Request,
+    subscription_id: int,
+    since: str | None = Query(None, description=SINCE_DESCRIPTION),
+    current_user: Principal = Depends(get_current_active_user),
 ):
     """
-    R4: Get the latest values for all metrics in a subscription.
+    R4: Get the latest values for all metrics in a subscription, encoded as
+    the Accept header asks (JSON, MessagePack or columnar).
     Only accessible by the subscription owner.
+
+    With `since`, a delta sync: only the readings changed since that sync,
+    plus sites, devices and metrics (referenced by ID) not sent yet, the
+    IDs of `removed` metrics and the `cursor` of this sync.
     """
     try:
-        sub = subscription_service.get_subscription(subscription_id)
+        sub = await subscription_service.get_subscription(subscription_id)
         if not sub:
             raise HTTPException(status_code=404, detail='Subscription not found')
         if sub.user_id != current_user.id:
             raise HTTPException(
                 status_code=403, detail='Not authorized to access this subscription'
             )
-        return subscription_service.get_subscription_latest_values(subscription_id)
+        if since is not None:
+            latest = await subscription_service.get_subscription_latest_delta(
+                subscription_id, since
+            )
+        else:
+            latest = await subscription_service.get_subscription_latest_values(
+                subscription_id
+            )
     except ValueError as e:
         raise HTTPException(status_code=404, detail=str(e))
+    return negotiated_response(request, latest)
+
+
+@router.get('/{subscription_id}/stream')
+async def stream_subscription(
+    subscription_id: int, current_user: Principal = Depends(get_current_active_user)
+):
+    """
+    Live values of a subscription's metrics as server-sent events: a
+    `snapshot` event shaped like /latest, then a `changes` event with the
+    changed (or deleted) metrics of each committed write. A client too slow
+    to keep up gets a `dropped` event and should reconnect. Streams end
+    after STREAM_MAX_SECONDS; metrics added to the subscription are picked
+    up on reconnect.
+    Only accessible by the subscription owner.
+    """
+    sub = await subscription_service.get_subscription(subscription_id)
+    if not sub:
+        raise HTTPException(status_code=404, detail='Subscription not found')
+    if sub.user_id != current_user.id:
+        raise HTTPException(
+            status_code=403, detail='Not authorized to access this subscription'
+        )
+
+    # Following the metrics before taking the snapshot loses no change
+    # committed in between (it may arrive twice)
+    client = metric_hub.connect(sub.metric_ids)
+    try:
+        snapshot = await subscription_service.get_subscription_latest_values(
+            subscription_id
+        )
+    except BaseException:
+        metric_hub.disconnect(client)
+        raise
+
+    async def events():
+        try:
+            async for chunk in stream_changes(
+                client,
+                snapshot,
+                STREAM_HEARTBEAT_SECONDS,
+                STREAM_MAX_SECONDS,
+            ):
+                yield chunk
+        finally:
+            metric_hub.disconnect(client)
+
+    return StreamingResponse(
+        events(),
+        media_type='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
 
 
 @router.get('/{subscription_id}/history')
+@query_budget(8)
 async def get_subscription_history(
+    request: Request,
     subscription_id: int,
     start_time: datetime | None = None,
     end_time: datetime | None = None,
-    interval_minutes: int = 5,
-    current_user: User = Depends(get_current_active_user),
+    interval_minutes: int = Query(5, ge=1),
+    strict: bool = False,
+    compare: Literal['day', 'week', 'year'] | None = None,
+    since: str | None = Query(None, description=SINCE_DESCRIPTION),
+    current_user: Principal = Depends(get_current_active_user),
 ):
     """
     R5: Get historical time series data for all metrics in a subscription.
@@ -132,10 +218,21 @@ async def get_subscription_history(
         start_time: Start time for the time series (defaults to 24 hours ago)
         end_time: End time for the time series (defaults to current time)
         interval_minutes: Time interval between data points in minutes (default: 5)
+        strict: Reject requests over the point budget instead of coarsening
+            the interval (the effective interval is returned as interval_minutes)
+        compare: Also return the window one day, week or year (52 weeks)
+            earlier as previous_values, plus deltas, aligned to the same axis
+        since: Cursor of the last sync, for a delta sync: the points after
+            those already sent, to append to each series, plus metadata not
+            sent yet and the `cursor` of this sync. When the series cannot
+            be continued, the whole window comes with `full` set.
+
+    Encoded as the Accept header asks: JSON, MessagePack or the columnar
+    binary layout (see app.core.encodings).
     """
     try:
         # Check subscription ownership
-        sub = subscription_service.get_subscription(subscription_id)
+        sub = await subscription_service.get_subscription(subscription_id)
         if not sub:
             raise HTTPException(status_code=404, detail='Subscription not found')
         if sub.user_id != current_user.id:
@@ -149,13 +246,27 @@ async def get_subscription_history(
         if not start_time:
             start_time = end_time - timedelta(hours=24)
 
-        return subscription_service.get_subscription_history(
-            subscription_id=subscription_id,
-            start_time=start_time,
-            end_time=end_time,
-            interval_minutes=interval_minutes,
-        )
+        if since is not None:
+            history = await subscription_service.get_subscription_history_delta(
+                subscription_id=subscription_id,
+                since=since,
+                start_time=start_time,
+                end_time=end_time,
+                interval_minutes=interval_minutes,
+                strict=strict,
+                compare=compare,
+            )
+        else:
+            history = await subscription_service.get_subscription_history(
+                subscription_id=subscription_id,
+                start_time=start_time,
+                end_time=end_time,
+                interval_minutes=interval_minutes,
+                strict=strict,
+                compare=compare,
+            )
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    return negotiated_response(request, history)
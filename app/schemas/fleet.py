@@ -0,0 +1,21 @@
+from pydantic import BaseModel
+
+
+class FleetGroupStatistics(BaseModel):
+    """Latest-value statistics of one device group"""
+
+    site_id: int | None = None
+    type: str | None = None
+    device_count: int
+    avg: float
+    min: float
+    max: float
+
+
+class FleetStatistics(BaseModel):
+    """Latest-value statistics of a metric grouped by type, site and both"""
+
+    metric_name: str
+    by_type: list[FleetGroupStatistics]
+    by_site: list[FleetGroupStatistics]
+    by_site_and_type: list[FleetGroupStatistics]
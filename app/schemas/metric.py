@@ -29,6 +29,35 @@ class MetricTimeSeries(BaseModel):
     timestamps: list[datetime]
     values: list[float]
     unit: str
+    # Effective spacing of the points; larger than the requested one when the
+    # request was coarsened to stay within the point budget
+    interval_minutes: int
+    requested_interval_minutes: int
+    # Set when a comparison window was requested: previous_values are the
+    # values `compare` ('day', 'week' or 'year') earlier, aligned to timestamps
+    compare: str | None = None
+    previous_values: list[float] | None = None
+    deltas: list[float] | None = None
 
     class Config:
         from_attributes = True
+
+
+class MetricSeries(BaseModel):
+    """Values of one metric within a MetricHistoryBatch"""
+
+    metric_id: int
+    unit: str
+    values: list[float]
+    previous_values: list[float] | None = None
+    deltas: list[float] | None = None
+
+
+class MetricHistoryBatch(BaseModel):
+    """Schema for several metrics' time series sharing one time axis"""
+
+    timestamps: list[datetime]
+    interval_minutes: int
+    requested_interval_minutes: int
+    compare: str | None = None
+    series: list[MetricSeries]
@@ -0,0 +1,19 @@
+from datetime import date
+
+from pydantic import BaseModel
+
+
+class SiteDailySummary(BaseModel):
+    """Schema for one day of a site's materialized summary"""
+
+    site_id: int
+    day: date
+    energy_kwh: float
+    peak_kw: float | None = None
+    min_soc: float | None = None
+    max_soc: float | None = None
+    uptime_ratio: float
+    reading_count: int
+
+    class Config:
+        from_attributes = True
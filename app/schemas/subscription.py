@@ -14,6 +14,7 @@ class SubscriptionCreate(SubscriptionBase):
 
 class Subscription(SubscriptionBase):
     id: int
+    user_id: int | None = None
 
     class Config:
         from_attributes = True
@@ -1,79 +1,161 @@
-from sqlalchemy.orm import Session
+from sqlalchemy import func, select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
 
 from app.models.site import Site
 from app.models.device import Device
-from app.schemas.device import DeviceCreate
+from app.models.metric import Metric
+from app.schemas.device import Device as DeviceSchema, DeviceCreate
+from app.schemas.fleet import FleetGroupStatistics, FleetStatistics
 from app.core.db_session import with_db_session, current_session
+from app.core.response_cache import DEVICES, SITES, invalidate_after_commit
 
 
-@with_db_session
-def list_devices(site_id: int | None = None) -> list[Device]:
+@with_db_session(readonly=True)
+async def list_devices(
+    site_id: int | None = None, site_ids: frozenset[int] | None = None
+) -> list[DeviceSchema]:
     """
     Retrieve all devices. If site_id is provided, filter devices by that site.
+    If site_ids is given, only devices at those sites are included.
     """
-    db: Session = current_session()
-    query = db.query(Device)
+    db: AsyncSession = current_session()
+    query = select(Device).options(selectinload(Device.metrics))
     if site_id is not None:
-        query = query.filter(Device.site_id == site_id)
-    return query.all()
+        query = query.where(Device.site_id == site_id)
+    if site_ids is not None:
+        query = query.where(Device.site_id.in_(site_ids))
+    return [DeviceSchema.model_validate(device) for device in await db.scalars(query)]
 
 
-@with_db_session
-def get_device(device_id: int) -> Device | None:
+@with_db_session(readonly=True)
+async def get_device(device_id: int) -> DeviceSchema | None:
     """
     Retrieve a single device by its ID.
     """
-    db: Session = current_session()
-    return db.query(Device).filter(Device.id == device_id).first()
+    db: AsyncSession = current_session()
+    device = await db.scalar(
+        select(Device)
+        .options(selectinload(Device.metrics))
+        .where(Device.id == device_id)
+    )
+    return DeviceSchema.model_validate(device) if device else None
 
 
 @with_db_session
-def create_device(device_in: DeviceCreate) -> Device:
+async def create_device(device_in: DeviceCreate) -> DeviceSchema:
     """
     Create a new device under a specific site.
     """
-    db: Session = current_session()
+    db: AsyncSession = current_session()
     # Ensure the site exists before creating device
-    site = db.query(Site).filter(Site.id == device_in.site_id).first()
+    site = await db.get(Site, device_in.site_id)
     if not site:
         raise ValueError(f'Site with id {device_in.site_id} does not exist')
     device = Device(**device_in.model_dump())
     db.add(device)
-    db.flush()  # assign ID
-    db.refresh(device)
-    return device
+    await db.flush()  # assign ID
+    await db.refresh(device, ['metrics'])
+    invalidate_after_commit(SITES, DEVICES)
+    return DeviceSchema.model_validate(device)
 
 
 @with_db_session
-def update_device(device_id: int, device_in: DeviceCreate) -> Device:
+async def update_device(device_id: int, device_in: DeviceCreate) -> DeviceSchema:
     """
     Update an existing device's attributes.
     """
-    db: Session = current_session()
-    device = db.query(Device).filter(Device.id == device_id).first()
+    db: AsyncSession = current_session()
+    device = await db.get(Device, device_id)
     if not device:
         raise ValueError(f'Device with id {device_id} not found')
     # Optionally validate new site
-    site = db.query(Site).filter(Site.id == device_in.site_id).first()
+    site = await db.get(Site, device_in.site_id)
     if not site:
         raise ValueError(f'Site with id {device_in.site_id} does not exist')
     # Update fields
     device.name = device_in.name
     device.site_id = device_in.site_id
-    db.flush()
-    db.refresh(device)
-    return device
+    await db.flush()
+    await db.refresh(device, ['metrics'])
+    invalidate_after_commit(SITES, DEVICES)
+    return DeviceSchema.model_validate(device)
 
 
 @with_db_session
-def delete_device(device_id: int) -> None:
+async def delete_device(device_id: int) -> None:
     """
     Delete a device by its ID. Also cascades to metrics.
     """
-    db: Session = current_session()
-    device = db.query(Device).filter(Device.id == device_id).first()
+    db: AsyncSession = current_session()
+    # Metrics are loaded up front so that the cascade needs no lazy load
+    device = await db.get(Device, device_id, options=[selectinload(Device.metrics)])
     if not device:
         raise ValueError(f'Device with id {device_id} not found')
-    db.delete(device)
+    await db.delete(device)
+    invalidate_after_commit(SITES, DEVICES)
     # commit happens automatically
     return None
+
+
+@with_db_session(readonly=True)
+async def get_fleet_statistics(
+    metric_name: str, site_ids: frozenset[int] | None = None
+) -> FleetStatistics:
+    """
+    Aggregate the latest value of a metric over all devices reporting it,
+    grouped by device type, by site and by site + type in a single
+    GROUPING SETS query. If site_ids is given, only those sites are included.
+    """
+    db: AsyncSession = current_session()
+    # Latest reading of the metric per device
+    latest = (
+        select(Metric.device_id, Metric.value)
+        .where(Metric.name == metric_name, Metric.value.isnot(None))
+        .distinct(Metric.device_id)
+        .order_by(Metric.device_id, Metric.timestamp.desc().nullslast())
+        .subquery()
+    )
+    query = (
+        select(
+            Device.site_id,
+            Device.type,
+            # Bit 1 set: site_id rolled up, bit 0 set: type rolled up
+            func.grouping(Device.site_id, Device.type),
+            func.count(),
+            func.avg(latest.c.value),
+            func.min(latest.c.value),
+            func.max(latest.c.value),
+        )
+        .join(latest, latest.c.device_id == Device.id)
+        .group_by(
+            func.grouping_sets(
+                tuple_(Device.type),
+                tuple_(Device.site_id),
+                tuple_(Device.site_id, Device.type),
+            )
+        )
+        .order_by(Device.site_id, Device.type)
+    )
+    if site_ids is not None:
+        query = query.where(Device.site_id.in_(site_ids))
+
+    groups = {0b10: [], 0b01: [], 0b00: []}
+    rows = await db.execute(query)
+    for site_id, device_type, grouping, count, avg, min_, max_ in rows:
+        groups[grouping].append(
+            FleetGroupStatistics(
+                site_id=site_id,
+                type=device_type,
+                device_count=count,
+                avg=avg,
+                min=min_,
+                max=max_,
+            )
+        )
+    return FleetStatistics(
+        metric_name=metric_name,
+        by_type=groups[0b10],
+        by_site=groups[0b01],
+        by_site_and_type=groups[0b00],
+    )
@@ -0,0 +1,327 @@
+import csv
+import io
+import math
+from datetime import datetime, timezone
+from typing import AsyncIterator, Sequence
+
+from fastapi.concurrency import run_in_threadpool
+from pydantic_core import to_json
+from sqlalchemy import Row, Select, func, select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.db_session import current_session, get_async_db_session, with_db_session
+from app.core.timeseries import time_axis, to_utc
+from app.models.device import Device
+from app.models.metric import Metric
+from app.models.site import Site
+from app.models.subscription import Subscription
+from app.services.metric_service import sample_metric_values
+
+from settings import EXPORT_BATCH_ROWS
+
+# Columns of each export, in order, with their type: 'timestamp' (UTC),
+# 'int', 'float' or 'name' (a string with few distinct values, which the
+# columnar formats dictionary-encode)
+READING_COLUMNS = (
+    ('timestamp', 'timestamp'),
+    ('site_id', 'int'),
+    ('site_name', 'name'),
+    ('device_id', 'int'),
+    ('device_name', 'name'),
+    ('metric_name', 'name'),
+    ('unit', 'name'),
+    ('value', 'float'),
+)
+HISTORY_COLUMNS = (
+    ('timestamp', 'timestamp'),
+    ('metric_id', 'int'),
+    ('device_id', 'int'),
+    ('device_name', 'name'),
+    ('metric_name', 'name'),
+    ('unit', 'name'),
+    ('value', 'float'),
+)
+
+Columns = Sequence[tuple[str, str]]
+
+
+@with_db_session(readonly=True)
+async def reading_series(
+    metric_id: int | None = None, subscription_id: int | None = None
+) -> list[tuple[int, str, int]]:
+    """
+    (device_id, metric name, site_id) of the series of a metric, or of every
+    metric of a subscription. Each metric row is one reading, and a series
+    is all readings of one name on one device.
+    """
+    db: AsyncSession = current_session()
+    query = select(Metric.device_id, Metric.name, Device.site_id).join(
+        Device, Device.id == Metric.device_id
+    )
+    if metric_id is not None:
+        query = query.where(Metric.id == metric_id)
+    else:
+        query = query.join(Metric.subscriptions).where(
+            Subscription.id == subscription_id
+        )
+    return list((await db.execute(query.distinct())).tuples())
+
+
+@with_db_session(readonly=True)
+async def history_metrics(
+    metric_id: int | None = None,
+    subscription_id: int | None = None,
+    site_id: int | None = None,
+) -> list[tuple[int, int, str, str, str, int]]:
+    """
+    (metric_id, device_id, device name, metric name, unit, site_id) of the
+    metrics whose history an export covers: a metric, the metrics of a
+    subscription, or the latest metric of every series at a site.
+    """
+    db: AsyncSession = current_session()
+    query = (
+        select(
+            Metric.id,
+            Metric.device_id,
+            Device.name,
+            Metric.name,
+            Metric.unit,
+            Device.site_id,
+        )
+        .join(Device, Device.id == Metric.device_id)
+        .order_by(Metric.id)
+    )
+    if metric_id is not None:
+        query = query.where(Metric.id == metric_id)
+    elif subscription_id is not None:
+        query = query.join(Metric.subscriptions).where(
+            Subscription.id == subscription_id
+        )
+    else:
+        latest = (
+            select(func.max(Metric.id))
+            .join(Device, Device.id == Metric.device_id)
+            .where(Device.site_id == site_id)
+            .group_by(Metric.device_id, Metric.name)
+        )
+        query = query.where(Metric.id.in_(latest))
+    return list((await db.execute(query)).tuples())
+
+
+def readings_query(
+    series: list[tuple[int, str]] | None = None,
+    site_id: int | None = None,
+    start_time: datetime | None = None,
+    end_time: datetime | None = None,
+) -> Select:
+    """Readings of the given series, or of a whole site, oldest first"""
+    query = (
+        select(
+            Metric.timestamp,
+            Device.site_id,
+            Site.name,
+            Metric.device_id,
+            Device.name,
+            Metric.name,
+            Metric.unit,
+            Metric.value,
+        )
+        .join(Device, Device.id == Metric.device_id)
+        .join(Site, Site.id == Device.site_id)
+        .where(Metric.timestamp.isnot(None))
+        .order_by(Metric.timestamp, Metric.id)
+    )
+    if series is not None:
+        query = query.where(tuple_(Metric.device_id, Metric.name).in_(series))
+    if site_id is not None:
+        query = query.where(Device.site_id == site_id)
+    # Timestamps are stored as naive UTC
+    if start_time is not None:
+        query = query.where(Metric.timestamp >= to_utc(start_time).replace(tzinfo=None))
+    if end_time is not None:
+        query = query.where(Metric.timestamp < to_utc(end_time).replace(tzinfo=None))
+    return query
+
+
+async def stream_rows(
+    query: Select, batch_rows: int = EXPORT_BATCH_ROWS
+) -> AsyncIterator[Sequence[Row]]:
+    """
+    Rows of `query` in batches of `batch_rows`, fetched through a
+    server-side cursor in a session of its own (a replica if configured),
+    so memory stays bounded and the first batch is ready at once, however
+    many rows follow.
+    """
+    async with get_async_db_session(readonly=True, own=True) as db:
+        result = await db.stream(query.execution_options(yield_per=batch_rows))
+        async for batch in result.partitions():
+            yield batch
+
+
+def _axis_chunks(
+    start_time: datetime, end_time: datetime, interval_minutes: int, size: int
+) -> list[tuple[datetime, datetime]]:
+    """Bounds of consecutive chunks of `size` points of the time axis"""
+    step = interval_minutes * 60
+    first = math.ceil(to_utc(start_time).timestamp() / step) * step
+    last = math.floor(to_utc(end_time).timestamp() / step) * step
+    return [
+        (
+            datetime.fromtimestamp(chunk_first, tz=timezone.utc),
+            datetime.fromtimestamp(
+                min(last, chunk_first + step * (size - 1)), tz=timezone.utc
+            ),
+        )
+        for chunk_first in range(first, last + 1, step * size)
+    ]
+
+
+async def stream_history(
+    metrics: list[tuple],
+    start_time: datetime,
+    end_time: datetime,
+    interval_minutes: int,
+    batch_rows: int = EXPORT_BATCH_ROWS,
+) -> AsyncIterator[list[tuple]]:
+    """
+    History rows (HISTORY_COLUMNS) of the metrics from history_metrics,
+    metric by metric, generated `batch_rows` points at a time in a worker
+    thread. The values are those of the metric history endpoints; they
+    bypass the history cache, which a long export would only flush.
+    """
+    chunks = _axis_chunks(start_time, end_time, interval_minutes, batch_rows)
+    for metric_id, device_id, device_name, metric_name, unit, _ in metrics:
+        for chunk_start, chunk_end in chunks:
+
+            def generate() -> list[tuple]:
+                timestamps = time_axis(chunk_start, chunk_end, interval_minutes)
+                values = sample_metric_values(metric_id, timestamps)
+                return [
+                    (ts, metric_id, device_id, device_name, metric_name, unit, value)
+                    for ts, value in zip(timestamps, values)
+                ]
+
+            yield await run_in_threadpool(generate)
+
+
+async def encode_ndjson(
+    columns: Columns, batches: AsyncIterator[Sequence[tuple]]
+) -> AsyncIterator[bytes]:
+    """One JSON object per row and line"""
+    names = [name for name, _ in columns]
+    async for batch in batches:
+        yield b''.join(to_json(dict(zip(names, row))) + b'\n' for row in batch)
+
+
+async def encode_csv(
+    columns: Columns, batches: AsyncIterator[Sequence[tuple]]
+) -> AsyncIterator[bytes]:
+    """CSV with a header row, timestamps in ISO 8601"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(name for name, _ in columns)
+    yield buffer.getvalue().encode()
+    async for batch in batches:
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows((row[0].isoformat(), *row[1:]) for row in batch)
+        yield buffer.getvalue().encode()
+
+
+def _arrow_schema(columns: Columns):
+    # pyarrow is imported on first use, keeping it out of worker startup
+    import pyarrow as pa
+
+    types = {
+        'timestamp': pa.timestamp('ms', tz='UTC'),
+        'int': pa.int64(),
+        'float': pa.float64(),
+        'name': pa.dictionary(pa.int32(), pa.string()),
+    }
+    return pa.schema([(name, types[kind]) for name, kind in columns])
+
+
+def _record_batch(schema, batch: Sequence[tuple]):
+    import pyarrow as pa
+
+    return pa.RecordBatch.from_arrays(
+        [
+            pa.array(values, type=field.type)
+            for field, values in zip(schema, zip(*batch))
+        ],
+        schema=schema,
+    )
+
+
+class _Chunks:
+    """Write-only file collecting what a writer wrote since the last take"""
+
+    def __init__(self):
+        self._chunks: list[bytes] = []
+        self.closed = False
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        self.closed = True
+
+    def take(self) -> bytes:
+        data, self._chunks = b''.join(self._chunks), []
+        return data
+
+
+async def encode_arrow(
+    columns: Columns, batches: AsyncIterator[Sequence[tuple]]
+) -> AsyncIterator[bytes]:
+    """
+    Arrow IPC stream, one record batch per fetched batch. Name columns are
+    dictionary-encoded per batch; the stream format allows a new dictionary
+    with each batch.
+    """
+    import pyarrow as pa
+
+    schema = _arrow_schema(columns)
+    sink = _Chunks()
+    with pa.ipc.new_stream(sink, schema) as writer:
+        yield sink.take()
+        async for batch in batches:
+            if batch:
+                writer.write_batch(_record_batch(schema, batch))
+                yield sink.take()
+    yield sink.take()
+
+
+async def encode_parquet(
+    columns: Columns, batches: AsyncIterator[Sequence[tuple]]
+) -> AsyncIterator[bytes]:
+    """
+    Parquet file, one row group per fetched batch, sent as each row group is
+    written (the footer comes last). Name columns are dictionary-encoded.
+    """
+    import pyarrow.parquet as pq
+
+    schema = _arrow_schema(columns)
+    sink = _Chunks()
+    writer = pq.ParquetWriter(sink, schema, compression='zstd')
+    try:
+        async for batch in batches:
+            if batch:
+                writer.write_batch(_record_batch(schema, batch))
+                yield sink.take()
+    finally:
+        writer.close()
+    yield sink.take()
+
+
+# Media type and encoder of each export format
+EXPORT_FORMATS = {
+    'ndjson': ('application/x-ndjson', encode_ndjson),
+    'csv': ('text/csv', encode_csv),
+    'arrow': ('application/vnd.apache.arrow.stream', encode_arrow),
+    'parquet': ('application/vnd.apache.parquet', encode_parquet),
+}
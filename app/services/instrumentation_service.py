@@ -0,0 +1,246 @@
+from app.core.auth import password_pool
+from app.core.cache import named_caches
+from app.core.change_feed import change_feed
+from app.core.instrumentation import Exposition, request_metrics
+from app.core.live import metric_hub
+from app.core.pool_stats import pool_stats
+from app.core.replicas import replicas
+from app.core.tracing import tracer
+
+
+def _add_requests(out: Exposition) -> None:
+    out.histogram(
+        'http_request_duration_seconds',
+        'Time from receiving a request to sending the end of its response.',
+        (
+            ({'method': method, 'route': route, 'status': status}, buckets, total)
+            for (method, route, status), buckets, total in (
+                request_metrics.latency.samples()
+            )
+        ),
+    )
+    out.add(
+        'http_requests_in_flight',
+        'gauge',
+        'Requests being served.',
+        (
+            ({'method': method, 'route': route}, count)
+            for (method, route), count in request_metrics.in_flight().items()
+        ),
+    )
+    out.histogram(
+        'http_request_db_queries',
+        'SQL statements run per request.',
+        (
+            ({'method': method, 'route': route}, buckets, total)
+            for (method, route), buckets, total in (
+                request_metrics.query_counts.samples()
+            )
+        ),
+    )
+    route_queries = request_metrics.route_queries()
+    out.add(
+        'http_request_db_query_seconds_total',
+        'counter',
+        'Time spent in SQL statements by requests.',
+        (
+            ({'method': method, 'route': route}, seconds)
+            for (method, route), (_, seconds) in route_queries.items()
+        ),
+    )
+
+
+def _add_database(out: Exposition) -> None:
+    role_queries = request_metrics.role_queries()
+    out.add(
+        'db_queries_total',
+        'counter',
+        'SQL statements run, per engine role.',
+        (({'role': role}, count) for role, (count, _) in role_queries.items()),
+    )
+    out.add(
+        'db_query_seconds_total',
+        'counter',
+        'Time spent in SQL statements, per engine role.',
+        (({'role': role}, seconds) for role, (_, seconds) in role_queries.items()),
+    )
+
+    pools = [stats.snapshot() for stats in pool_stats.values()]
+    for name, kind, key, help_text in (
+        ('db_pool_size', 'gauge', 'size', 'Connections a pool keeps open.'),
+        ('db_pool_checked_out', 'gauge', 'checked_out', 'Connections in use.'),
+        ('db_pool_overflow', 'gauge', 'overflow', 'Connections open beyond the size.'),
+        (
+            'db_pool_connections_opened_total',
+            'counter',
+            'connections_opened',
+            'Connections opened.',
+        ),
+        (
+            'db_pool_timeouts_total',
+            'counter',
+            'timeouts',
+            'Checkouts that timed out waiting for a connection.',
+        ),
+    ):
+        out.add(name, kind, help_text, (({'role': p['role']}, p[key]) for p in pools))
+    out.histogram(
+        'db_pool_wait_seconds',
+        'Time checkouts waited for a connection.',
+        (
+            (
+                {'role': p['role']},
+                p['wait_seconds']['buckets'],
+                p['wait_seconds']['sum'],
+            )
+            for p in pools
+        ),
+    )
+
+    stats = replicas.stats()
+    out.add(
+        'db_replica_reads_total',
+        'counter',
+        'Read-only units of work served by each replica.',
+        (({'replica': str(i)}, reads) for i, reads in enumerate(stats['reads'])),
+    )
+    out.add(
+        'db_replica_lag_seconds',
+        'gauge',
+        'Last measured replication lag of each replica.',
+        (({'replica': str(i)}, lag) for i, lag in enumerate(stats['lag_seconds'])),
+    )
+    out.add(
+        'db_replica_fallbacks_total',
+        'counter',
+        'Read-only units of work sent to the primary as no replica was usable.',
+        [({}, stats['fallbacks'])],
+    )
+
+
+def _add_caches(out: Exposition) -> None:
+    caches = {name: cache.stats() for name, cache in named_caches.items()}
+    out.add(
+        'cache_hits_total',
+        'counter',
+        'Cache lookups that found a value.',
+        (({'cache': name}, stats['hits']) for name, stats in caches.items()),
+    )
+    out.add(
+        'cache_misses_total',
+        'counter',
+        'Cache lookups that found no value.',
+        (({'cache': name}, stats['misses']) for name, stats in caches.items()),
+    )
+    out.add(
+        'cache_hit_ratio',
+        'gauge',
+        'Share of cache lookups so far that found a value.',
+        (
+            ({'cache': name}, stats['hits'] / lookups)
+            for name, stats in caches.items()
+            if (lookups := stats['hits'] + stats['misses'])
+        ),
+    )
+
+
+def _add_workers(out: Exposition) -> None:
+    stats = password_pool.stats()
+    out.add(
+        'password_pool_jobs',
+        'gauge',
+        'Password hashing jobs running or queued.',
+        [
+            ({'state': 'running'}, stats['running']),
+            ({'state': 'queued'}, stats['queued']),
+        ],
+    )
+    out.add(
+        'password_pool_jobs_total',
+        'counter',
+        'Password hashing jobs finished or turned away, by outcome.',
+        (
+            ({'outcome': outcome}, stats[outcome])
+            for outcome in ('completed', 'failed', 'cancelled', 'rejected')
+        ),
+    )
+    out.add(
+        'password_pool_wait_seconds_total',
+        'counter',
+        'Time password hashing jobs waited for a worker.',
+        [({}, stats['wait_seconds_total'])],
+    )
+    out.add(
+        'password_pool_run_seconds_total',
+        'counter',
+        'Time password hashing jobs ran.',
+        [({}, stats['run_seconds_total'])],
+    )
+
+    stats = metric_hub.stats()
+    out.add(
+        'stream_clients', 'gauge', 'Connected stream clients.', [({}, stats['clients'])]
+    )
+    out.add(
+        'stream_changes_total',
+        'counter',
+        'Metric changes published to stream clients, and change batches '
+        'delivered to them.',
+        [
+            ({'stage': 'published'}, stats['published']),
+            ({'stage': 'delivered'}, stats['delivered']),
+        ],
+    )
+    out.add(
+        'stream_clients_dropped_total',
+        'counter',
+        'Stream clients dropped as too slow.',
+        [({}, stats['dropped'])],
+    )
+
+    stats = change_feed.stats()
+    out.add(
+        'change_feed_connected',
+        'gauge',
+        'Whether the change feed listener is connected.',
+        [({}, stats['connected'])],
+    )
+    out.add(
+        'change_feed_notifications_total',
+        'counter',
+        'Change feed notifications received.',
+        [({}, stats['received'])],
+    )
+    out.add(
+        'change_feed_reconnects_total',
+        'counter',
+        'Times the change feed listener reconnected.',
+        [({}, stats['reconnects'])],
+    )
+
+
+def _add_tracing(out: Exposition) -> None:
+    exporter = tracer.exporter
+    out.add(
+        'traces_exported_total',
+        'counter',
+        'Sampled request traces exported.',
+        [({}, exporter.exported if exporter else None)],
+    )
+    out.add(
+        'traces_dropped_total',
+        'counter',
+        'Sampled request traces dropped, their export queue full or failing.',
+        [({}, exporter.dropped if exporter else None)],
+    )
+
+
+def render_metrics() -> str:
+    """This worker's instrumentation, in the Prometheus text format"""
+    out = Exposition()
+    _add_requests(out)
+    _add_database(out)
+    _add_caches(out)
+    _add_workers(out)
+    _add_tracing(out)
+    return out.render()
@@ -1,160 +1,348 @@
-import random
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from typing import Optional
 
-from fastapi import HTTPException
-from sqlalchemy.orm import Session
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.core.db_session import with_db_session, current_session
+from app.core.history_cache import history_cache
+from app.core.response_cache import DEVICES, SITES, invalidate_after_commit
+from app.core.timeseries import (
+    COMPARE_OFFSETS,
+    resolve_interval,
+    sample_value,
+    time_axis,
+    to_utc,
+)
+from app.core.tracing import set_attributes, start_span
 from app.models.device import Device
 from app.models.metric import Metric
-from app.schemas.metric import Metric as MetricSchema, MetricCreate, MetricTimeSeries
+from app.schemas.metric import (
+    Metric as MetricSchema,
+    MetricCreate,
+    MetricHistoryBatch,
+    MetricSeries,
+    MetricTimeSeries,
+)
 
+from settings import HISTORY_BATCH_MAX_SERIES
 
-@with_db_session
-def list_metrics(device_id: int | None = None) -> list[MetricSchema]:
+# Fields of the Metric schema, selected as plain columns by the list and
+# latest reads: no ORM objects to hydrate and track, no schema to validate
+_METRIC_FIELDS = ('name', 'unit', 'id', 'timestamp', 'value')
+_METRIC_COLUMNS = tuple(getattr(Metric, field) for field in _METRIC_FIELDS)
+
+
+def _metric_payloads(rows) -> list[dict]:
+    """Metric schema payloads of _METRIC_COLUMNS rows"""
+    return [dict(zip(_METRIC_FIELDS, row)) for row in rows]
+
+
+@with_db_session(readonly=True)
+async def list_metrics(device_id: int | None = None) -> list[dict]:
     """
     Retrieve all metrics. If device_id is provided, filter metrics by that device.
     Sorted by timestamp descending.
     """
-    db: Session = current_session()
-    query = db.query(Metric)
+    db: AsyncSession = current_session()
+    query = select(*_METRIC_COLUMNS)
     if device_id is not None:
-        query = query.filter(Metric.device_id == device_id)
-    metrics = query.order_by(Metric.timestamp.desc()).all()
-    return [MetricSchema.model_validate(metric) for metric in metrics]
+        query = query.where(Metric.device_id == device_id)
+    rows = await db.execute(query.order_by(Metric.timestamp.desc()))
+    payloads = _metric_payloads(rows.tuples())
+    set_attributes(device_id=device_id, rows=len(payloads))
+    return payloads
 
 
-@with_db_session
-def get_metric(metric_id: int) -> MetricSchema | None:
+@with_db_session(readonly=True)
+async def get_metric(metric_id: int) -> MetricSchema | None:
     """
     Retrieve a single metric by its ID.
     """
-    db: Session = current_session()
-    metric = db.query(Metric).filter(Metric.id == metric_id).first()
-    return MetricSchema.model_validate(metric)
+    db: AsyncSession = current_session()
+    metric = await db.get(Metric, metric_id)
+    return MetricSchema.model_validate(metric) if metric else None
 
 
 @with_db_session
-def create_metric(metric_in: MetricCreate) -> MetricSchema:
+async def create_metric(metric_in: MetricCreate) -> MetricSchema:
     """
     Create a new metric for a specific device.
     Validate the device exists before creation.
     """
-    db: Session = current_session()
-    device = db.query(Device).filter(Device.id == metric_in.device_id).first()
+    db: AsyncSession = current_session()
+    device = await db.get(Device, metric_in.device_id)
     if not device:
         raise ValueError(f'Device with id {metric_in.device_id} does not exist')
     metric = Metric(**metric_in.model_dump())
     db.add(metric)
-    db.flush()
-    db.refresh(metric)
+    await db.flush()
+    await db.refresh(metric)
+    # Devices (and sites) embed their metrics
+    invalidate_after_commit(SITES, DEVICES)
     return MetricSchema.model_validate(metric)
 
 
 @with_db_session
-def update_metric(metric_id: int, metric_in: MetricCreate) -> MetricSchema:
+async def update_metric(metric_id: int, metric_in: MetricCreate) -> MetricSchema:
     """
     Update an existing metric's data.
     If device_id changes, validate new device exists.
     """
-    db: Session = current_session()
-    metric = db.query(Metric).filter(Metric.id == metric_id).first()
+    db: AsyncSession = current_session()
+    metric = await db.get(Metric, metric_id)
     if not metric:
         raise ValueError(f'Metric with id {metric_id} not found')
     if metric_in.device_id != metric.device_id:
-        new_device = db.query(Device).filter(Device.id == metric_in.device_id).first()
+        new_device = await db.get(Device, metric_in.device_id)
         if not new_device:
             raise ValueError(f'Device with id {metric_in.device_id} does not exist')
         metric.device_id = metric_in.device_id
     metric.name = metric_in.name
     metric.unit = metric_in.unit
     metric.value = metric_in.value
-    db.flush()
-    db.refresh(metric)
+    await db.flush()
+    await db.refresh(metric)
+    # Devices (and sites) embed their metrics
+    invalidate_after_commit(SITES, DEVICES)
     return MetricSchema.model_validate(metric)
 
 
 @with_db_session
-def delete_metric(metric_id: int) -> None:
+async def delete_metric(metric_id: int) -> None:
     """
     Delete a metric by its ID.
     """
-    db: Session = current_session()
-    metric = db.query(Metric).filter(Metric.id == metric_id).first()
+    db: AsyncSession = current_session()
+    metric = await db.get(Metric, metric_id)
     if not metric:
         raise ValueError(f'Metric with id {metric_id} not found')
-    db.delete(metric)
+    await db.delete(metric)
+    # Devices (and sites) embed their metrics
+    invalidate_after_commit(SITES, DEVICES)
     return None
 
 
-@with_db_session
-def get_metric_history(
-    db: Session,
+def sample_metric_values(metric_id: int, timestamps: list[datetime]) -> list[float]:
+    """Values of a metric's history at the given timestamps, uncached"""
+    return [100 * sample_value(metric_id, ts) for ts in timestamps]
+
+
+def _generate_values(
+    metric_id: int,
+    timestamps: list[datetime],
+    interval_minutes: int,
+    offset: timedelta = timedelta(0),
+) -> list[float]:
+    """
+    Reproducible sample values for a metric at the given timestamps, shifted
+    back by `offset` (used for the previous comparison window).
+    Served through the chunked history cache.
+    """
+    if offset:
+        timestamps = [ts - offset for ts in timestamps]
+    return history_cache.values(
+        ('metric', metric_id),
+        timestamps,
+        interval_minutes,
+        lambda chunk: sample_metric_values(metric_id, chunk),
+    )
+
+
+def _series_values(
+    metric_id: int,
+    timestamps: list[datetime],
+    interval_minutes: int,
+    compare: str | None,
+) -> dict:
+    """
+    Values of a metric on the time axis, plus the previous window's values
+    and the deltas, aligned to the same axis, when `compare` is set.
+    """
+    values = _generate_values(metric_id, timestamps, interval_minutes)
+    if not compare:
+        return {'values': values}
+    previous = _generate_values(
+        metric_id, timestamps, interval_minutes, COMPARE_OFFSETS[compare]
+    )
+    return {
+        'values': values,
+        'previous_values': previous,
+        'deltas': [current - prev for current, prev in zip(values, previous)],
+    }
+
+
+@with_db_session(readonly=True)
+async def get_metric_history(
     metric_id: int,
     start_time: Optional[datetime] = None,
     end_time: Optional[datetime] = None,
     interval_minutes: int = 5,
+    strict: bool = False,
+    compare: str | None = None,
 ) -> MetricTimeSeries:
-    """Get the historical time series data for a metric"""
+    """
+    Get the historical time series data for a metric.
+    The interval is coarsened when the request exceeds the point budget,
+    or PointBudgetExceeded is raised in strict mode.
+    With `compare` ('day', 'week' or 'year') the previous window is
+    generated in the same pass and returned aligned to the current one.
+    Values are generated in a worker thread to keep the event loop free.
+    """
+    db: AsyncSession = current_session()
     # Validate if the metric exists
-    metric = db.query(Metric).filter(Metric.id == metric_id).first()
+    metric = await db.get(Metric, metric_id)
     if not metric:
-        raise HTTPException(status_code=404, detail='Metric not found')
+        raise ValueError(f'Metric with id {metric_id} not found')
 
     # Set default time range
-    if not end_time:
-        end_time = datetime.utcnow()
-    if not start_time:
-        start_time = end_time - timedelta(hours=24)
+    end_time = to_utc(end_time) if end_time else datetime.now(timezone.utc)
+    start_time = to_utc(start_time) if start_time else end_time - timedelta(hours=24)
 
     # Validate time range
     if start_time >= end_time:
-        raise HTTPException(
-            status_code=400, detail='Start time must be before end time'
+        raise ValueError('start_time must be before end_time')
+
+    effective_interval = resolve_interval(
+        start_time,
+        end_time,
+        interval_minutes,
+        series=2 if compare else 1,
+        strict=strict,
+    )
+    timestamps = time_axis(start_time, end_time, effective_interval)
+    set_attributes(metric_id=metric_id, interval_minutes=effective_interval)
+    with start_span(
+        'timeseries.generate',
+        series=1,
+        points=len(timestamps) * (2 if compare else 1),
+    ):
+        series_values = await run_in_threadpool(
+            _series_values, metric_id, timestamps, effective_interval, compare
         )
 
-    # Generate timestamps
-    timestamps = []
-    current_time = start_time
-    while current_time <= end_time:
-        timestamps.append(current_time.isoformat() + 'Z')
-        current_time += timedelta(minutes=interval_minutes)
+    # The values are known to be well-typed: skip validating each point
+    return MetricTimeSeries.model_construct(
+        metric_id=metric_id,
+        timestamps=timestamps,
+        unit=metric.unit,
+        interval_minutes=effective_interval,
+        requested_interval_minutes=interval_minutes,
+        compare=compare,
+        **series_values,
+    )
 
-    # Use a fixed seed to generate reproducible random data
-    random.seed(metric_id)
-    values = [random.uniform(0, 100) for _ in range(len(timestamps))]
 
-    return MetricTimeSeries(
-        metric_id=metric_id, timestamps=timestamps, values=values, unit=metric.unit
+@with_db_session(readonly=True)
+async def get_metrics_history(
+    metric_ids: list[int],
+    start_time: Optional[datetime] = None,
+    end_time: Optional[datetime] = None,
+    interval_minutes: int = 5,
+    strict: bool = False,
+    compare: str | None = None,
+) -> MetricHistoryBatch:
+    """
+    Get the historical time series data of several metrics on one shared
+    time axis. Metric metadata is loaded with a single query, and the point
+    budget covers all requested series together.
+    """
+    db: AsyncSession = current_session()
+    metric_ids = list(dict.fromkeys(metric_ids))
+    if not metric_ids:
+        raise ValueError('At least one metric ID is required')
+    if len(metric_ids) > HISTORY_BATCH_MAX_SERIES:
+        raise ValueError(
+            f'At most {HISTORY_BATCH_MAX_SERIES} metrics can be requested at once'
+        )
+
+    units = dict(
+        (
+            await db.execute(
+                select(Metric.id, Metric.unit).where(Metric.id.in_(metric_ids))
+            )
+        )
+        .tuples()
+        .all()
     )
+    missing = [metric_id for metric_id in metric_ids if metric_id not in units]
+    if missing:
+        raise ValueError(f'Metrics not found: {", ".join(map(str, missing))}')
 
+    end_time = to_utc(end_time) if end_time else datetime.now(timezone.utc)
+    start_time = to_utc(start_time) if start_time else end_time - timedelta(hours=24)
+    if start_time >= end_time:
+        raise ValueError('start_time must be before end_time')
 
-@with_db_session
-def get_latest_metric_value(device_id: int) -> list[MetricSchema]:
+    effective_interval = resolve_interval(
+        start_time,
+        end_time,
+        interval_minutes,
+        series=len(metric_ids) * (2 if compare else 1),
+        strict=strict,
+    )
+    timestamps = time_axis(start_time, end_time, effective_interval)
+
+    def generate() -> list[MetricSeries]:
+        return [
+            MetricSeries.model_construct(
+                metric_id=metric_id,
+                unit=units[metric_id],
+                **_series_values(metric_id, timestamps, effective_interval, compare),
+            )
+            for metric_id in metric_ids
+        ]
+
+    set_attributes(metrics=len(metric_ids), interval_minutes=effective_interval)
+    with start_span(
+        'timeseries.generate',
+        series=len(metric_ids),
+        points=len(timestamps) * len(metric_ids) * (2 if compare else 1),
+    ):
+        series = await run_in_threadpool(generate)
+
+    return MetricHistoryBatch.model_construct(
+        timestamps=timestamps,
+        interval_minutes=effective_interval,
+        requested_interval_minutes=interval_minutes,
+        compare=compare,
+        series=series,
+    )
+
+
+@with_db_session(readonly=True)
+async def get_latest_metric_value(device_id: int) -> list[dict]:
     """
     Get the latest value for each metric of a device.
     Returns a list of metrics with their latest values and metadata.
     """
-    db: Session = current_session()
-    # Get all metrics for the device
-    metrics = db.query(Metric).filter(Metric.device_id == device_id).all()
+    db: AsyncSession = current_session()
+    # One statement: each reading ranked within its metric name, newest
+    # first, names in order of first appearance
+    ranked = (
+        select(
+            *_METRIC_COLUMNS,
+            func.row_number()
+            .over(
+                partition_by=Metric.name,
+                order_by=(Metric.timestamp.desc(), Metric.id.desc()),
+            )
+            .label('rank'),
+            func.min(Metric.id).over(partition_by=Metric.name).label('first_id'),
+        )
+        .where(Metric.device_id == device_id)
+        .subquery()
+    )
+    rows = await db.execute(
+        select(*(ranked.c[field] for field in _METRIC_FIELDS))
+        .where(ranked.c.rank == 1)
+        .order_by(ranked.c.first_id)
+    )
+    latest_rows = rows.all()
 
-    if not metrics:
+    if not latest_rows:
         raise ValueError(f'No metrics found for device {device_id}')
+    set_attributes(device_id=device_id, rows=len(latest_rows))
 
-    # Get the latest value for each metric
-    latest_metrics = []
-    for metric in metrics:
-        latest = (
-            db.query(Metric)
-            .filter(Metric.device_id == device_id, Metric.name == metric.name)
-            .order_by(Metric.timestamp.desc())
-            .first()
-        )
-        if latest:
-            latest_metrics.append(latest)
-
-    return [
-        MetricSchema.model_validate(latest_metric) for latest_metric in latest_metrics
-    ]
+    return _metric_payloads(latest_rows)
@@ -1,39 +1,48 @@
-from sqlalchemy.orm import Session, selectinload
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
 
 from app.core.db_session import with_db_session, current_session
+from app.core.response_cache import SITES, invalidate_after_commit
+from app.models.device import Device
 from app.models.site import Site
 from app.schemas.site import Site as SiteSchema, SiteCreate
 
+# Sites embed their devices, which embed their metrics
+_SITE_LOAD = selectinload(Site.devices).selectinload(Device.metrics)
 
-@with_db_session
-def list_sites() -> list[SiteSchema]:
+
+@with_db_session(readonly=True)
+async def list_sites() -> list[SiteSchema]:
     """
     Return all sites.
     Automatically uses session from ContextVar.
     """
-    db: Session = current_session()
-    sites = db.query(Site).options(selectinload(Site.devices)).all()
+    db: AsyncSession = current_session()
+    sites = await db.scalars(select(Site).options(_SITE_LOAD))
     return [SiteSchema.model_validate(site) for site in sites]
 
 
-@with_db_session
-def get_site(site_id: int) -> SiteSchema | None:
+@with_db_session(readonly=True)
+async def get_site(site_id: int) -> SiteSchema | None:
     """
     Get a single site by ID.
     """
-    db: Session = current_session()
-    site = db.query(Site).filter(Site.id == site_id).first()
-    return SiteSchema.model_validate(site)
+    db: AsyncSession = current_session()
+    site = await db.scalar(select(Site).options(_SITE_LOAD).where(Site.id == site_id))
+    return SiteSchema.model_validate(site) if site else None
 
 
 @with_db_session
-def create_site(site_in: SiteCreate) -> SiteSchema:
+async def create_site(site_in: SiteCreate) -> SiteSchema:
     """
     Create a new site from Pydantic schema.
     """
-    db: Session = current_session()
+    db: AsyncSession = current_session()
     site = Site(**site_in.model_dump())
     db.add(site)
+    await db.flush()  # assign ID
     # commit happens after function returns
-    db.refresh(site)
+    await db.refresh(site, ['devices'])
+    invalidate_after_commit(SITES)
     return SiteSchema.model_validate(site)
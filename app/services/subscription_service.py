@@ -1,9 +1,22 @@
-import random
 from datetime import datetime, timedelta
 
-from sqlalchemy.orm import Session
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
 
 from app.core.db_session import with_db_session, current_session
+from app.core.history_cache import history_cache
+from app.core.sync import digest, sync_cursors
+from app.core.timeseries import (
+    COMPARE_OFFSETS,
+    resolve_interval,
+    sample_value,
+    time_axis,
+    to_utc,
+)
+from app.core.tracing import set_attributes, start_span
+from app.models.device import Device
 from app.models.subscription import Subscription
 from app.models.metric import Metric
 from app.schemas.subscription import (
@@ -11,120 +24,138 @@ from app.schemas.subscription import (
     SubscriptionCreate,
 )
 
+# Subscription payloads embed metric, device and site fields
+_METRICS_LOAD = (
+    selectinload(Subscription.metrics)
+    .selectinload(Metric.device)
+    .selectinload(Device.site)
+)
+
 
-@with_db_session
-def list_subscriptions() -> list[SubscriptionSchema]:
+async def _get_subscription(subscription_id: int) -> Subscription | None:
+    db: AsyncSession = current_session()
+    return await db.get(
+        Subscription, subscription_id, options=[selectinload(Subscription.metrics)]
+    )
+
+
+async def _get_subscription_with_metrics(subscription_id: int) -> Subscription | None:
+    db: AsyncSession = current_session()
+    # The subscription may already be in the request session without its
+    # devices and sites, so the eager loads must also run on a cache hit
+    return await db.get(
+        Subscription, subscription_id, options=[_METRICS_LOAD], populate_existing=True
+    )
+
+
+async def _get_metrics(metric_ids: list[int]) -> list[Metric]:
+    """Metrics with the given IDs; raises if any of them does not exist"""
+    db: AsyncSession = current_session()
+    metrics = (await db.scalars(select(Metric).where(Metric.id.in_(metric_ids)))).all()
+    if len(metrics) != len(set(metric_ids)):
+        raise ValueError('One or more metric IDs are invalid')
+    return metrics
+
+
+@with_db_session(readonly=True)
+async def list_subscriptions(user_id: int) -> list[SubscriptionSchema]:
     """
-    Retrieve all subscriptions.
+    Retrieve all subscriptions of a user.
     """
-    db: Session = current_session()
-    subscriptions = db.query(Subscription).all()
+    db: AsyncSession = current_session()
+    subscriptions = await db.scalars(
+        select(Subscription)
+        .options(selectinload(Subscription.metrics))
+        .where(Subscription.user_id == user_id)
+    )
     return [SubscriptionSchema.model_validate(sub) for sub in subscriptions]
 
 
-@with_db_session
-def get_subscription(subscription_id: int) -> SubscriptionSchema | None:
+@with_db_session(readonly=True)
+async def get_subscription(subscription_id: int) -> SubscriptionSchema | None:
     """
     Retrieve a single subscription by its ID.
     """
-    db: Session = current_session()
-    subscription = (
-        db.query(Subscription).filter(Subscription.id == subscription_id).first()
-    )
-    return SubscriptionSchema.model_validate(subscription)
+    subscription = await _get_subscription(subscription_id)
+    return SubscriptionSchema.model_validate(subscription) if subscription else None
 
 
 @with_db_session
-def create_subscription(sub_in: SubscriptionCreate) -> SubscriptionSchema:
+async def create_subscription(
+    sub_in: SubscriptionCreate, user_id: int
+) -> SubscriptionSchema:
     """
-    Create a new subscription and link to metrics.
+    Create a new subscription owned by a user and link to metrics.
     Validate each metric exists before linking.
     """
-    db: Session = current_session()
-    # Validate metrics
-    metrics = db.query(Metric).filter(Metric.id.in_(sub_in.metric_ids)).all()
-    if len(metrics) != len(sub_in.metric_ids):
-        raise ValueError('One or more metric IDs are invalid')
-    sub = Subscription(name=sub_in.name)
+    db: AsyncSession = current_session()
+    metrics = await _get_metrics(sub_in.metric_ids)
+    sub = Subscription(name=sub_in.name, user_id=user_id)
     sub.metrics = metrics
     db.add(sub)
-    db.flush()
-    db.refresh(sub)
+    await db.flush()
     return SubscriptionSchema.model_validate(sub)
 
 
 @with_db_session
-def update_subscription(
+async def update_subscription(
     subscription_id: int, sub_in: SubscriptionCreate
 ) -> SubscriptionSchema:
     """
     Update an existing subscription's name and metrics.
     Validate metrics before updating links.
     """
-    db: Session = current_session()
-    sub = db.query(Subscription).filter(Subscription.id == subscription_id).first()
+    db: AsyncSession = current_session()
+    sub = await _get_subscription(subscription_id)
     if not sub:
         raise ValueError(f'Subscription with id {subscription_id} not found')
-    # Validate metrics
-    metrics = db.query(Metric).filter(Metric.id.in_(sub_in.metric_ids)).all()
-    if len(metrics) != len(sub_in.metric_ids):
-        raise ValueError('One or more metric IDs are invalid')
+    metrics = await _get_metrics(sub_in.metric_ids)
     # Update fields
     sub.name = sub_in.name
     sub.metrics = metrics
-    db.flush()
-    db.refresh(sub)
+    await db.flush()
     return SubscriptionSchema.model_validate(sub)
 
 
 @with_db_session
-def delete_subscription(subscription_id: int) -> None:
+async def delete_subscription(subscription_id: int) -> None:
     """
     Delete a subscription and its metric links.
     """
-    db: Session = current_session()
-    sub = db.query(Subscription).filter(Subscription.id == subscription_id).first()
+    db: AsyncSession = current_session()
+    sub = await _get_subscription(subscription_id)
     if not sub:
         raise ValueError(f'Subscription with id {subscription_id} not found')
     # Clear associations if needed (handled by cascade)
-    db.delete(sub)
+    await db.delete(sub)
     return None
 
 
-@with_db_session
-def get_subscription_latest_values(subscription_id: int) -> dict:
+@with_db_session(readonly=True)
+async def get_subscription_latest_values(subscription_id: int) -> dict:
     """
     Get the latest values for all metrics in a subscription.
     Returns a dictionary with metric information and latest values.
     """
-    db: Session = current_session()
-    sub = db.query(Subscription).filter(Subscription.id == subscription_id).first()
+    sub = await _get_subscription_with_metrics(subscription_id)
     if not sub:
         raise ValueError(f'Subscription with id {subscription_id} not found')
 
-    # Get latest values for each metric
-    latest_values = []
-    for metric in sub.metrics:
-        latest = (
-            db.query(Metric)
-            .filter(Metric.id == metric.id)
-            .order_by(Metric.timestamp.desc())
-            .first()
-        )
-        if latest:
-            latest_values.append(
-                {
-                    'metric_id': latest.id,
-                    'name': latest.name,
-                    'unit': latest.unit,
-                    'value': latest.value,
-                    'timestamp': latest.timestamp,
-                    'device_id': latest.device_id,
-                    'device_name': latest.device.name,
-                    'site_id': latest.device.site_id,
-                    'site_name': latest.device.site.name,
-                }
-            )
+    # Each metric row holds its latest value
+    latest_values = [
+        {
+            'metric_id': metric.id,
+            'name': metric.name,
+            'unit': metric.unit,
+            'value': metric.value,
+            'timestamp': metric.timestamp,
+            'device_id': metric.device_id,
+            'device_name': metric.device.name,
+            'site_id': metric.device.site_id,
+            'site_name': metric.device.site.name,
+        }
+        for metric in sub.metrics
+    ]
 
     return {
         'subscription_id': sub.id,
@@ -133,42 +164,90 @@ def get_subscription_latest_values(subscription_id: int) -> dict:
     }
 
 
-@with_db_session
-def get_subscription_history(
+def _generate_values(
+    metric: Metric,
+    timestamps: list[datetime],
+    interval_minutes: int,
+    offset: timedelta = timedelta(0),
+) -> list[float]:
+    """
+    Generate reproducible values within +/-10% of the metric's stored value
+    at the given timestamps, shifted back by `offset`.
+    Served through the chunked history cache.
+    """
+    metric_id, base_value = metric.id, metric.value
+    if offset:
+        timestamps = [ts - offset for ts in timestamps]
+    return history_cache.values(
+        # The stored value is part of the key, so updating it starts new chunks
+        ('subscription_metric', metric_id, base_value),
+        timestamps,
+        interval_minutes,
+        lambda chunk: [
+            base_value * (0.9 + 0.2 * sample_value(metric_id, ts)) for ts in chunk
+        ],
+    )
+
+
+def _series_values(
+    metric: Metric,
+    timestamps: list[datetime],
+    interval_minutes: int,
+    compare: str | None,
+) -> dict:
+    """
+    Values of a metric on the time axis, plus the previous window's values
+    and the deltas, aligned to the same axis, when `compare` is set.
+    """
+    values = _generate_values(metric, timestamps, interval_minutes)
+    if not compare:
+        return {'values': values}
+    previous = _generate_values(
+        metric, timestamps, interval_minutes, COMPARE_OFFSETS[compare]
+    )
+    return {
+        'values': values,
+        'previous_values': previous,
+        'deltas': [current - prev for current, prev in zip(values, previous)],
+    }
+
+
+@with_db_session(readonly=True)
+async def get_subscription_history(
     subscription_id: int,
     start_time: datetime,
     end_time: datetime,
     interval_minutes: int = 5,
+    strict: bool = False,
+    compare: str | None = None,
 ) -> dict:
     """
     Get time series data for all metrics in a subscription.
     Returns a dictionary with metric information and time series data.
+    The point budget covers all metrics of the subscription together.
+    With `compare` ('day', 'week' or 'year') each metric also carries the
+    previous window's values and the deltas, aligned to the same timestamps.
+    Values are generated in a worker thread to keep the event loop free.
     """
-    db: Session = current_session()
-    sub = db.query(Subscription).filter(Subscription.id == subscription_id).first()
+    sub = await _get_subscription_with_metrics(subscription_id)
     if not sub:
         raise ValueError(f'Subscription with id {subscription_id} not found')
 
-    # Get time series for each metric
-    time_series = []
-    for metric in sub.metrics:
-        # Generate time series data
-        timestamps = []
-        values = []
-        current_time = start_time
-
-        # Use fixed random seed to ensure reproducibility
-        random.seed(metric.id)
-
-        while current_time <= end_time:
-            timestamps.append(current_time)
-            # Generate a time-based random value to make it look more realistic
-            base_value = metric.value
-            variation = random.uniform(-0.1, 0.1) * base_value
-            values.append(base_value + variation)
-            current_time += timedelta(minutes=interval_minutes)
-
-        time_series.append(
+    start_time, end_time = to_utc(start_time), to_utc(end_time)
+    if start_time >= end_time:
+        raise ValueError('start_time must be before end_time')
+    effective_interval = resolve_interval(
+        start_time,
+        end_time,
+        interval_minutes,
+        series=len(sub.metrics) * (2 if compare else 1),
+        strict=strict,
+    )
+    timestamps = time_axis(start_time, end_time, effective_interval)
+
+    def generate() -> list[dict]:
+        # Get time series for each metric
+        return [
             {
                 'metric_id': metric.id,
                 'name': metric.name,
@@ -178,15 +257,249 @@ def get_subscription_history(
                 'site_id': metric.device.site_id,
                 'site_name': metric.device.site.name,
                 'timestamps': timestamps,
-                'values': values,
+                **_series_values(metric, timestamps, effective_interval, compare),
             }
-        )
+            for metric in sub.metrics
+        ]
+
+    set_attributes(
+        subscription_id=subscription_id,
+        metrics=len(sub.metrics),
+        interval_minutes=effective_interval,
+    )
+    with start_span(
+        'timeseries.generate',
+        series=len(sub.metrics),
+        points=len(timestamps) * len(sub.metrics) * (2 if compare else 1),
+    ):
+        time_series = await run_in_threadpool(generate)
 
     return {
         'subscription_id': sub.id,
         'subscription_name': sub.name,
         'start_time': start_time,
         'end_time': end_time,
-        'interval_minutes': interval_minutes,
+        'interval_minutes': effective_interval,
+        'requested_interval_minutes': interval_minutes,
+        'compare': compare,
         'metrics': time_series,
     }
+
+
+def _sync_metadata(sub: Subscription) -> dict[str, dict]:
+    """
+    Metadata of a subscription payload by sync key: the subscription
+    ('subscription'), its metrics ('metric:<id>') and their devices and
+    sites ('device:<id>', 'site:<id>'), each referring to the next by ID.
+    """
+    entries = {'subscription': {'name': sub.name}}
+    for metric in sub.metrics:
+        device = metric.device
+        entries[f'metric:{metric.id}'] = {
+            'id': metric.id,
+            'name': metric.name,
+            'unit': metric.unit,
+            'device_id': metric.device_id,
+        }
+        entries[f'device:{device.id}'] = {
+            'id': device.id,
+            'name': device.name,
+            'site_id': device.site_id,
+        }
+        entries[f'site:{device.site_id}'] = {
+            'id': device.site_id,
+            'name': device.site.name,
+        }
+    return entries
+
+
+def _sync_delta(
+    sub: Subscription, entries: dict[str, dict], state: dict | None
+) -> tuple[dict, dict[str, str]]:
+    """
+    The part of a delta sync payload telling what changed since `state`:
+    the subscription name and the sites, devices and metrics whose metadata
+    is new or changed, and the IDs of metrics no longer subscribed.
+    Returns it with the digests of every entry, for the next state.
+    """
+    known = state['digests'] if state else {}
+    digests = {key: digest(entry) for key, entry in entries.items()}
+    delta = {
+        'subscription_id': sub.id,
+        'full': state is None,
+        'sites': [],
+        'devices': [],
+        'metrics': [],
+    }
+    for key, entry in entries.items():
+        if known.get(key) == digests[key]:
+            continue
+        if key == 'subscription':
+            delta['subscription_name'] = entry['name']
+        else:
+            delta[key.split(':')[0] + 's'].append(entry)
+    delta['removed'] = [
+        int(key.split(':')[1])
+        for key in known
+        if key.startswith('metric:') and key not in entries
+    ]
+    return delta, digests
+
+
+async def _load_sync_state(
+    since: str | None, kind: str, subscription_id: int
+) -> dict | None:
+    """The sync state of a cursor, if it is one of this kind of sync"""
+    state = await sync_cursors.load(since)
+    if state is None or state['kind'] != kind:
+        return None
+    return state if state['subscription_id'] == subscription_id else None
+
+
+@with_db_session(readonly=True)
+async def get_subscription_latest_delta(subscription_id: int, since: str) -> dict:
+    """
+    Latest values of a subscription's metrics changed since the sync the
+    `since` cursor was returned by, and metadata (sites, devices, metrics)
+    the client has not been sent yet, with a cursor for the next sync.
+    An empty or unknown cursor gets everything, with `full` set.
+    """
+    sub = await _get_subscription_with_metrics(subscription_id)
+    if not sub:
+        raise ValueError(f'Subscription with id {subscription_id} not found')
+
+    state = await _load_sync_state(since, 'latest', subscription_id)
+    entries = _sync_metadata(sub)
+    readings = {
+        f'reading:{metric.id}': [metric.id, metric.value, metric.timestamp]
+        for metric in sub.metrics
+    }
+    delta, digests = _sync_delta(sub, entries, state)
+    known = state['digests'] if state else {}
+    delta['readings'] = []
+    for key, reading in readings.items():
+        digests[key] = digest(reading)
+        if known.get(key) != digests[key]:
+            metric_id, value, timestamp = reading
+            delta['readings'].append(
+                {'metric_id': metric_id, 'value': value, 'timestamp': timestamp}
+            )
+
+    delta['cursor'] = await sync_cursors.save(
+        {'kind': 'latest', 'subscription_id': sub.id, 'digests': digests}
+    )
+    return delta
+
+
+@with_db_session(readonly=True)
+async def get_subscription_history_delta(
+    subscription_id: int,
+    since: str,
+    start_time: datetime,
+    end_time: datetime,
+    interval_minutes: int = 5,
+    strict: bool = False,
+    compare: str | None = None,
+) -> dict:
+    """
+    Time series of a subscription's metrics since the sync the `since`
+    cursor was returned by, with a cursor for the next sync.
+
+    When the client's series can be continued (same interval and
+    comparison, no gap before the window, and no metric whose values were
+    regenerated or that is new) only the points after the last one sent
+    are returned, to be appended, plus metadata the client has not been
+    sent yet. Otherwise, and for an empty or unknown cursor, the whole
+    window and all metadata are returned with `full` set.
+    """
+    sub = await _get_subscription_with_metrics(subscription_id)
+    if not sub:
+        raise ValueError(f'Subscription with id {subscription_id} not found')
+
+    start_time, end_time = to_utc(start_time), to_utc(end_time)
+    if start_time >= end_time:
+        raise ValueError('start_time must be before end_time')
+    effective_interval = resolve_interval(
+        start_time,
+        end_time,
+        interval_minutes,
+        series=len(sub.metrics) * (2 if compare else 1),
+        strict=strict,
+    )
+    timestamps = time_axis(start_time, end_time, effective_interval)
+
+    state = await _load_sync_state(since, 'history', subscription_id)
+    # Generated values depend on the stored value of the metric
+    series_digests = {
+        f'series:{metric.id}': digest(metric.value) for metric in sub.metrics
+    }
+    if state is not None:
+        last = state['last']
+        continued = (
+            state['interval_minutes'] == effective_interval
+            and state['compare'] == compare
+            and all(
+                state['digests'].get(key) == value
+                for key, value in series_digests.items()
+            )
+            and (
+                not timestamps
+                or last is not None
+                and timestamps[0].timestamp() <= last + effective_interval * 60
+                and timestamps[-1].timestamp() >= last
+            )
+        )
+        if continued:
+            timestamps = [ts for ts in timestamps if ts.timestamp() > last]
+        else:
+            state = None
+
+    delta, digests = _sync_delta(sub, _sync_metadata(sub), state)
+    digests.update(series_digests)
+
+    def generate() -> list[dict]:
+        return [
+            {
+                'metric_id': metric.id,
+                **_series_values(metric, timestamps, effective_interval, compare),
+            }
+            for metric in sub.metrics
+        ]
+
+    set_attributes(
+        subscription_id=subscription_id,
+        metrics=len(sub.metrics),
+        interval_minutes=effective_interval,
+        full=state is None,
+    )
+    with start_span(
+        'timeseries.generate',
+        series=len(sub.metrics),
+        points=len(timestamps) * len(sub.metrics) * (2 if compare else 1),
+    ):
+        series = await run_in_threadpool(generate)
+
+    if timestamps:
+        last = timestamps[-1].timestamp()
+    else:
+        last = state['last'] if state else None
+    delta.update(
+        start_time=start_time,
+        end_time=end_time,
+        interval_minutes=effective_interval,
+        requested_interval_minutes=interval_minutes,
+        compare=compare,
+        timestamps=timestamps,
+        series=series,
+        cursor=await sync_cursors.save(
+            {
+                'kind': 'history',
+                'subscription_id': sub.id,
+                'digests': digests,
+                'interval_minutes': effective_interval,
+                'compare': compare,
+                'last': last,
+            }
+        ),
+    )
+    return delta
@@ -0,0 +1,252 @@
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import (
+    Connection,
+    Date,
+    Select,
+    delete,
+    event,
+    func,
+    inspect,
+    or_,
+    select,
+    tuple_,
+)
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from app.core.db_session import with_db_session, current_session
+from app.models.device import Device
+from app.models.metric import Metric
+from app.models.site_daily_summary import SiteDailySummary, SummaryDirtyDay
+from app.schemas.site_daily_summary import (
+    SiteDailySummary as SiteDailySummarySchema,
+)
+
+from settings import SUMMARY_REFRESH_BATCH_DAYS
+
+# Units used to classify readings into summary columns
+ENERGY_UNIT = 'kWh'
+POWER_UNIT = 'kW'
+SOC_UNIT = '%'
+
+# A site counts as "up" for a slot if it reported at least one reading in it
+UPTIME_SLOT_SECONDS = 300
+UPTIME_SLOTS_PER_DAY = 24 * 60 * 60 // UPTIME_SLOT_SECONDS
+
+# Dialect-specific INSERT constructs supporting ON CONFLICT
+_INSERTS = {'postgresql': postgresql.insert, 'sqlite': sqlite.insert}
+
+
+def _mark_dirty(connection: Connection, query: Select) -> None:
+    """Record the (site_id, day) rows selected by `query` as dirty"""
+    stmt = _INSERTS[connection.dialect.name](SummaryDirtyDay).from_select(
+        ['site_id', 'day'], query
+    )
+    connection.execute(stmt.on_conflict_do_nothing())
+
+
+def _reading_days(*criteria) -> Select:
+    """(site_id, day) of the stored readings matching `criteria`"""
+    return (
+        select(Device.site_id, func.date(Metric.timestamp, type_=Date))
+        .join(Device, Device.id == Metric.device_id)
+        .where(Metric.timestamp.isnot(None), Device.site_id.isnot(None), *criteria)
+        .distinct()
+    )
+
+
+def _moved(target, *attributes: str) -> bool:
+    state = inspect(target)
+    return any(state.attrs[name].history.has_changes() for name in attributes)
+
+
+def _mark_readings_dirty(
+    session: Session, metric_ids: list[int], device_ids: list[int]
+) -> None:
+    """Mark the days of the given readings and of all readings of the devices"""
+    criteria = []
+    if metric_ids:
+        criteria.append(Metric.id.in_(metric_ids))
+    if device_ids:
+        criteria.append(Metric.device_id.in_(device_ids))
+    if criteria:
+        _mark_dirty(session.connection(), _reading_days(or_(*criteria)))
+
+
+def _moved_devices(session: Session) -> list[int]:
+    # Moving a device moves all its readings to another site
+    return [
+        device.id
+        for device in session.dirty
+        if isinstance(device, Device) and _moved(device, 'site_id')
+    ]
+
+
+# Days are marked once per flush, with SQL against the stored rows: before
+# the flush for the days readings leave, after it for the days they land in.
+# ORM writes thus cost at most two extra statements per flush, whatever the
+# number of rows; Core bulk writes bypass the ORM and are not tracked.
+@event.listens_for(Session, 'before_flush')
+def _mark_days_left(session: Session, flush_context, instances) -> None:
+    metric_ids = [
+        metric.id
+        for metric in session.deleted
+        if isinstance(metric, Metric) and metric.id is not None
+    ] + [
+        metric.id
+        for metric in session.dirty
+        if isinstance(metric, Metric)
+        and metric.id is not None
+        and _moved(metric, 'device_id', 'timestamp')
+    ]
+    _mark_readings_dirty(session, metric_ids, _moved_devices(session))
+
+
+@event.listens_for(Session, 'after_flush')
+def _mark_days_entered(session: Session, flush_context) -> None:
+    # The session still shows its pre-flush state here
+    metric_ids = [metric.id for metric in session.new if isinstance(metric, Metric)] + [
+        metric.id
+        for metric in session.dirty
+        if isinstance(metric, Metric)
+        and session.is_modified(metric, include_collections=False)
+    ]
+    _mark_readings_dirty(session, metric_ids, _moved_devices(session))
+
+
+def _refresh_batch(db: Session, limit: int) -> int:
+    """Claim up to `limit` dirty (site, day) marks and recompute their rows"""
+    # Claiming the marks in this transaction makes concurrent writers wait on
+    # the deleted rows, so their marks survive for the next refresh; other
+    # refreshers skip the rows locked here
+    batch = (
+        select(SummaryDirtyDay.site_id, SummaryDirtyDay.day)
+        .order_by(SummaryDirtyDay.day, SummaryDirtyDay.site_id)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+    )
+    dirty = set(
+        db.execute(
+            delete(SummaryDirtyDay)
+            .where(tuple_(SummaryDirtyDay.site_id, SummaryDirtyDay.day).in_(batch))
+            .returning(SummaryDirtyDay.site_id, SummaryDirtyDay.day)
+        ).all()
+    )
+    if not dirty:
+        return 0
+    day = func.date(Metric.timestamp, type_=Date)
+
+    slot = func.floor(func.extract('epoch', Metric.timestamp) / UPTIME_SLOT_SECONDS)
+    rows = (
+        db.query(
+            Device.site_id,
+            day,
+            func.coalesce(
+                func.sum(Metric.value).filter(Metric.unit == ENERGY_UNIT), 0.0
+            ),
+            func.max(Metric.value).filter(Metric.unit == POWER_UNIT),
+            func.min(Metric.value).filter(Metric.unit == SOC_UNIT),
+            func.max(Metric.value).filter(Metric.unit == SOC_UNIT),
+            func.count(func.distinct(slot)),
+            func.count(Metric.id),
+        )
+        .join(Metric, Metric.device_id == Device.id)
+        .filter(tuple_(Device.site_id, day).in_(list(dirty)))
+        .group_by(Device.site_id, day)
+        .all()
+    )
+
+    # Days left without any reading have no summary row any more
+    emptied = dirty - {(site_id, row_day) for site_id, row_day, *_ in rows}
+    if emptied:
+        db.execute(
+            delete(SiteDailySummary).where(
+                tuple_(SiteDailySummary.site_id, SiteDailySummary.day).in_(
+                    list(emptied)
+                )
+            )
+        )
+    if not rows:
+        return len(dirty)
+
+    now = datetime.utcnow()
+    values = [
+        {
+            'site_id': site_id,
+            'day': row_day,
+            'energy_kwh': energy,
+            'peak_kw': peak,
+            'min_soc': min_soc,
+            'max_soc': max_soc,
+            'uptime_ratio': min(slots / UPTIME_SLOTS_PER_DAY, 1.0),
+            'reading_count': count,
+            'refreshed_at': now,
+        }
+        for (
+            site_id,
+            row_day,
+            energy,
+            peak,
+            min_soc,
+            max_soc,
+            slots,
+            count,
+        ) in rows
+    ]
+    stmt = _INSERTS[db.get_bind().dialect.name](SiteDailySummary).values(values)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[SiteDailySummary.site_id, SiteDailySummary.day],
+        set_={
+            column: stmt.excluded[column]
+            for column in values[0]
+            if column not in ('site_id', 'day')
+        },
+    )
+    db.execute(stmt)
+    return len(dirty)
+
+
+@with_db_session
+def refresh_site_daily_summary(batch_days: int = SUMMARY_REFRESH_BATCH_DAYS) -> int:
+    """
+    Recompute summary rows for every (site, day) whose readings were
+    inserted, updated or deleted through the ORM since the last refresh.
+    Works through the marks `batch_days` at a time, committing each batch,
+    so a large backfill never turns into one huge statement or transaction.
+    Returns the number of (site, day) rows recomputed.
+    Runs as a background job on the sync engine.
+    """
+    db: Session = current_session()
+    refreshed = 0
+    while True:
+        claimed = _refresh_batch(db, batch_days)
+        db.commit()
+        refreshed += claimed
+        if claimed < batch_days:
+            return refreshed
+
+
+@with_db_session(readonly=True)
+async def get_site_daily_summary(
+    site_id: int, days: int = 90, until: date | None = None
+) -> list[SiteDailySummarySchema]:
+    """
+    Return the materialized daily summary of a site for the last `days` days,
+    oldest first.
+    """
+    db: AsyncSession = current_session()
+    if until is None:
+        until = datetime.utcnow().date()
+    since = until - timedelta(days=days - 1)
+    rows = await db.scalars(
+        select(SiteDailySummary)
+        .where(
+            SiteDailySummary.site_id == site_id,
+            SiteDailySummary.day >= since,
+            SiteDailySummary.day <= until,
+        )
+        .order_by(SiteDailySummary.day)
+    )
+    return [SiteDailySummarySchema.model_validate(row) for row in rows]
@@ -1,70 +1,85 @@
-from app.core.auth import get_password_hash, verify_password
-from app.core.db_session import with_db_session, current_session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.auth import (
+    get_password_hash,
+    get_password_hash_async,
+    invalidate_principal,
+    verify_password_async,
+)
+from app.core.db_session import with_db_session, current_session, run_after_commit
 from app.models.user import User
 from app.schemas.user import User as UserSchema, UserCreate, UserUpdate
 
 
 @with_db_session
-def get_user_by_username(username: str) -> UserSchema | None:
+async def get_user_by_username(username: str) -> UserSchema | None:
     """Get user by username"""
-    user = current_session().query(User).filter(User.username == username).first()
-    return UserSchema.model_validate(user)
+    db: AsyncSession = current_session()
+    user = await db.scalar(select(User).where(User.username == username))
+    return UserSchema.model_validate(user) if user else None
 
 
 @with_db_session
-def get_user_by_email(email: str) -> UserSchema | None:
+async def get_user_by_email(email: str) -> UserSchema | None:
     """Get user by email"""
-    user = current_session().query(User).filter(User.email == email).first()
-    return UserSchema.model_validate(user)
+    db: AsyncSession = current_session()
+    user = await db.scalar(select(User).where(User.email == email))
+    return UserSchema.model_validate(user) if user else None
+
+
+async def create_user(user_in: UserCreate) -> UserSchema:
+    """Create new user, hashing the password on the password worker pool"""
+    hashed_password = await get_password_hash_async(user_in.password)
+    return await _insert_user(user_in, hashed_password)
 
 
 @with_db_session
-def create_user(user_in: UserCreate) -> UserSchema:
-    """Create new user"""
-    db = current_session()
+async def _insert_user(user_in: UserCreate, hashed_password: str) -> UserSchema:
+    db: AsyncSession = current_session()
     # Check if username exists
-    if get_user_by_username(user_in.username):
+    if await get_user_by_username(user_in.username):
         raise ValueError('Username already registered')
     # Check if email exists
-    if get_user_by_email(user_in.email):
+    if await get_user_by_email(user_in.email):
         raise ValueError('Email already registered')
 
     # Create new user
     user = User(
         username=user_in.username,
         email=user_in.email,
-        hashed_password=get_password_hash(user_in.password),
+        hashed_password=hashed_password,
         role=user_in.role,
     )
     db.add(user)
-    db.commit()
-    db.refresh(user)
+    await db.flush()
+    await db.refresh(user)
     return UserSchema.model_validate(user)
 
 
 @with_db_session
-def update_user(user_id: int, user_in: UserUpdate) -> UserSchema:
+async def update_user(user_id: int, user_in: UserUpdate) -> UserSchema:
     """Update user information"""
-    db = current_session()
-    user = db.query(User).filter(User.id == user_id).first()
+    db: AsyncSession = current_session()
+    user = await db.get(User, user_id)
     if not user:
         raise ValueError('User not found')
 
     # Update fields if provided
     if user_in.username is not None:
-        existing_user = get_user_by_username(user_in.username)
+        existing_user = await get_user_by_username(user_in.username)
         if existing_user and existing_user.id != user_id:
             raise ValueError('Username already taken')
         user.username = user_in.username
 
     if user_in.email is not None:
-        existing_user = get_user_by_email(user_in.email)
+        existing_user = await get_user_by_email(user_in.email)
         if existing_user and existing_user.id != user_id:
             raise ValueError('Email already taken')
         user.email = user_in.email
 
     if user_in.password is not None:
-        user.hashed_password = get_password_hash(user_in.password)
+        user.hashed_password = await get_password_hash_async(user_in.password)
 
     if user_in.role is not None:
         user.role = user_in.role
@@ -72,17 +87,33 @@ def update_user(user_id: int, user_in: UserUpdate) -> UserSchema:
     if user_in.is_active is not None:
         user.is_active = user_in.is_active
 
-    db.commit()
-    db.refresh(user)
+    # Cached principals of this user are stale once the change is committed
+    run_after_commit(lambda: invalidate_principal(user_id))
+    await db.flush()
+    await db.refresh(user)
     return UserSchema.model_validate(user)
 
 
 @with_db_session
-def authenticate_user(username: str, password: str) -> UserSchema | None:
-    """Authenticate user with username and password"""
-    user = get_user_by_username(username)
+async def _get_credentials(username: str) -> tuple[UserSchema, str] | None:
+    """User and its password hash, or None if the username is unknown"""
+    db: AsyncSession = current_session()
+    user = await db.scalar(select(User).where(User.username == username))
     if not user:
         return None
-    if not verify_password(password, user.hashed_password):
+    return UserSchema.model_validate(user), user.hashed_password
+
+
+async def authenticate_user(username: str, password: str) -> UserSchema | None:
+    """
+    Authenticate user with username and password.
+    bcrypt verification runs on the password worker pool, so it does not
+    block the event loop.
+    """
+    credentials = await _get_credentials(username)
+    if not credentials:
         return None
-    return UserSchema.model_validate(user)
+    user, hashed_password = credentials
+    if not await verify_password_async(password, hashed_password):
+        return None
+    return user
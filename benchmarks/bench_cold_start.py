@@ -0,0 +1,62 @@
+"""
+Worker cold start benchmark.
+
+Starts fresh interpreters that import the application and run its startup
+(lifespan) the way a uvicorn worker does, and reports how long each phase
+takes. Exits non-zero when the slowest start exceeds the target:
+
+    python -m benchmarks.bench_cold_start --runs 5 --target 2.0
+"""
+
+import argparse
+import json
+import subprocess
+import sys
+
+# Runs in each fresh interpreter; prints the phase timings as JSON
+_WORKER = '''
+import asyncio, json, time
+started = time.perf_counter()
+from app.main import app
+imported = time.perf_counter()
+
+async def startup():
+    async with app.router.lifespan_context(app):
+        ready = time.perf_counter()
+    return ready
+
+ready = asyncio.run(startup())
+print(json.dumps({'import': imported - started, 'startup': ready - imported}))
+'''
+
+
+def cold_start() -> dict:
+    output = subprocess.run(
+        [sys.executable, '-c', _WORKER], capture_output=True, text=True, check=True
+    ).stdout
+    timings = json.loads(output.splitlines()[-1])
+    timings['total'] = timings['import'] + timings['startup']
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--target', type=float, default=2.0, help='seconds')
+    args = parser.parse_args()
+
+    runs = [cold_start() for _ in range(args.runs)]
+    for phase in ('import', 'startup', 'total'):
+        times = sorted(run[phase] for run in runs)
+        print(
+            f'{phase:<8} p50={times[len(times) // 2] * 1000:.0f}ms '
+            f'max={times[-1] * 1000:.0f}ms'
+        )
+    slowest = max(run['total'] for run in runs)
+    if slowest > args.target:
+        print(f'Cold start {slowest:.2f}s exceeds the {args.target:.2f}s target')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+"""
+Time-series response encoding benchmark.
+
+Encodes a metric history of N points the way the endpoint used to (a
+validated MetricTimeSeries, validated again against the response_model
+and rendered by JSONResponse) and in each negotiated encoding, and reports
+the encode time and payload size of each:
+
+    python -m benchmarks.bench_encodings --points 10000 100000 --runs 5
+"""
+
+import argparse
+import asyncio
+import time
+from datetime import datetime, timedelta, timezone
+
+from fastapi.responses import JSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_response_field
+
+from app.core.encodings import ENCODERS
+from app.core.timeseries import time_axis
+from app.schemas.metric import MetricTimeSeries
+from app.services.metric_service import sample_metric_values
+
+START = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+def history_fields(points: int) -> dict:
+    timestamps = time_axis(START, START + timedelta(minutes=points - 1), 1)
+    return {
+        'metric_id': 1,
+        'timestamps': timestamps,
+        'values': sample_metric_values(1, timestamps),
+        'unit': 'kW',
+        'interval_minutes': 1,
+        'requested_interval_minutes': 1,
+    }
+
+
+def validated_json(fields: dict) -> bytes:
+    """The response_model path: validate, validate again, render"""
+    field = create_response_field(name='response', type_=MetricTimeSeries)
+    content = asyncio.run(
+        serialize_response(field=field, response_content=MetricTimeSeries(**fields))
+    )
+    return JSONResponse(content).body
+
+
+def best_of(runs: int, encode) -> tuple[float, int]:
+    """(fastest time in seconds, payload size) of encoding `runs` times"""
+    times = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        body = encode()
+        times.append(time.perf_counter() - started)
+    return min(times), len(body)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--points', type=int, nargs='+', default=[10000, 100000])
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    for points in args.points:
+        fields = history_fields(points)
+        print(f'{points} points')
+        encodings = {'validated json': lambda: validated_json(fields)}
+        for media_type, encode in ENCODERS.items():
+            encodings[media_type] = lambda encode=encode: encode(
+                MetricTimeSeries.model_construct(**fields)
+            )
+        for name, encode in encodings.items():
+            seconds, size = best_of(args.runs, encode)
+            print(f'  {name:<38} {seconds * 1000:8.1f}ms {size / 1024:9.1f}KiB')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+"""
+Login throughput benchmark.
+
+In-process mode (default) runs N concurrent password verifications through
+the password worker pool while a heartbeat task measures how long the event
+loop stalls, for each bcrypt cost given:
+
+    python -m benchmarks.bench_login --logins 200 --rounds 10 12
+
+HTTP mode posts to /auth/token of a running server instead:
+
+    python -m benchmarks.bench_login --url http://localhost:8000 \\
+        --username standard_user --password standardpass --logins 200
+"""
+
+import argparse
+import asyncio
+import time
+
+from passlib.context import CryptContext
+
+from app.core.password_pool import PasswordWorkerPool
+
+from settings import PASSWORD_HASH_MAX_QUEUE, PASSWORD_HASH_WORKERS
+
+
+async def _heartbeat(stop: asyncio.Event, interval: float = 0.005) -> float:
+    """Largest delay of the event loop beyond `interval` until stopped"""
+    worst = 0.0
+    while not stop.is_set():
+        before = time.perf_counter()
+        await asyncio.sleep(interval)
+        worst = max(worst, time.perf_counter() - before - interval)
+    return worst
+
+
+async def bench_pool(logins: int, rounds: int, concurrency: int) -> None:
+    context = CryptContext(schemes=['bcrypt'], bcrypt__rounds=rounds)
+    hashed = context.hash('benchmark')
+    pool = PasswordWorkerPool(PASSWORD_HASH_WORKERS, PASSWORD_HASH_MAX_QUEUE)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def login():
+        async with semaphore:
+            assert await pool.run(context.verify, 'benchmark', hashed)
+
+    stop = asyncio.Event()
+    heartbeat = asyncio.create_task(_heartbeat(stop))
+    started = time.perf_counter()
+    await asyncio.gather(*(login() for _ in range(logins)))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    stall = await heartbeat
+
+    stats = pool.stats()
+    print(
+        f'rounds={rounds:<3} logins={logins} time={elapsed:.2f}s '
+        f'throughput={logins / elapsed:.1f}/s '
+        f'avg_wait={stats["wait_seconds_total"] / logins * 1000:.1f}ms '
+        f'avg_hash={stats["run_seconds_total"] / logins * 1000:.1f}ms '
+        f'max_loop_stall={stall * 1000:.1f}ms'
+    )
+
+
+async def bench_http(
+    url: str, username: str, password: str, logins: int, concurrency: int
+) -> None:
+    import httpx
+
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async with httpx.AsyncClient(base_url=url, timeout=60) as client:
+
+        async def login():
+            async with semaphore:
+                before = time.perf_counter()
+                response = await client.post(
+                    '/auth/token', data={'username': username, 'password': password}
+                )
+                latencies.append(time.perf_counter() - before)
+                response.raise_for_status()
+
+        started = time.perf_counter()
+        await asyncio.gather(*(login() for _ in range(logins)))
+        elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    print(
+        f'logins={logins} time={elapsed:.2f}s throughput={logins / elapsed:.1f}/s '
+        f'p50={latencies[len(latencies) // 2] * 1000:.0f}ms '
+        f'p99={latencies[int(len(latencies) * 0.99) - 1] * 1000:.0f}ms'
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--logins', type=int, default=100)
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--rounds', type=int, nargs='+', default=[10, 12])
+    parser.add_argument('--url')
+    parser.add_argument('--username')
+    parser.add_argument('--password')
+    args = parser.parse_args()
+
+    if args.url:
+        asyncio.run(
+            bench_http(
+                args.url, args.username, args.password, args.logins, args.concurrency
+            )
+        )
+        return
+    for rounds in args.rounds:
+        asyncio.run(bench_pool(args.logins, rounds, args.concurrency))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+"""
+Metric list read benchmark.
+
+Seeds a device with N readings in DATABASE_URL, then lists them the way
+the endpoint used to (ORM objects, model_validate per row, validated
+again against the response_model and rendered by JSONResponse) and the
+way it does now (column tuples, encoded once), reporting rows/s of each.
+The readings are deleted afterwards:
+
+    python -m benchmarks.bench_metric_reads --rows 10000 100000 --runs 3
+"""
+
+import argparse
+import asyncio
+import time
+from datetime import datetime, timedelta
+
+from fastapi.responses import JSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_response_field
+from sqlalchemy import delete, insert, select
+from sqlalchemy.orm import Session
+
+import app.models  # noqa: F401 (registers every table)
+from app.core.database import Base, engine
+from app.core.db_session import get_async_db_session
+from app.core.encodings import encode_json
+from app.models.device import Device
+from app.models.metric import Metric
+from app.models.site import Site
+from app.schemas.metric import Metric as MetricSchema
+from app.services import metric_service
+
+START = datetime(2024, 1, 1)
+
+
+def seed(rows: int) -> tuple[int, int]:
+    """(site ID, device ID) of a new device with `rows` readings"""
+    Base.metadata.create_all(bind=engine)
+    with Session(engine) as session:
+        device = Device(name='Benchmark', type='sensor', site=Site(name='Benchmark'))
+        session.add(device)
+        session.commit()
+        session.execute(
+            insert(Metric),
+            [
+                {
+                    'device_id': device.id,
+                    'name': f'Metric {i % 100}',
+                    'unit': 'kW',
+                    'timestamp': START + timedelta(minutes=i),
+                    'value': float(i),
+                }
+                for i in range(rows)
+            ],
+        )
+        session.commit()
+        return device.site_id, device.id
+
+
+def cleanup(site_id: int, device_id: int) -> None:
+    with Session(engine) as session:
+        session.execute(delete(Metric).where(Metric.device_id == device_id))
+        session.execute(delete(Device).where(Device.id == device_id))
+        session.execute(delete(Site).where(Site.id == site_id))
+        session.commit()
+
+
+async def orm_list(device_id: int) -> bytes:
+    """The previous list path, from query to response body"""
+    async with get_async_db_session(readonly=True) as db:
+        metrics = await db.scalars(
+            select(Metric)
+            .where(Metric.device_id == device_id)
+            .order_by(Metric.timestamp.desc())
+        )
+        content = [MetricSchema.model_validate(metric) for metric in metrics]
+    field = create_response_field(name='response', type_=list[MetricSchema])
+    return JSONResponse(
+        await serialize_response(field=field, response_content=content)
+    ).body
+
+
+async def lean_list(device_id: int) -> bytes:
+    """The current list path, from query to response body"""
+    return encode_json(await metric_service.list_metrics(device_id))
+
+
+async def rows_per_second(runs: int, read, device_id: int, rows: int) -> float:
+    best = float('inf')
+    for _ in range(runs):
+        started = time.perf_counter()
+        await read(device_id)
+        best = min(best, time.perf_counter() - started)
+    return rows / best
+
+
+async def bench(rows_counts: list[int], runs: int) -> None:
+    # One event loop throughout: pooled connections belong to the loop
+    for rows in rows_counts:
+        site_id, device_id = seed(rows)
+        try:
+            for name, read in (('orm', orm_list), ('lean', lean_list)):
+                rate = await rows_per_second(runs, read, device_id, rows)
+                print(f'{rows:>7} rows  {name:<5} {rate:>10,.0f} rows/s')
+        finally:
+            cleanup(site_id, device_id)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--rows', type=int, nargs='+', default=[10000, 100000])
+    parser.add_argument('--runs', type=int, default=3)
+    args = parser.parse_args()
+    asyncio.run(bench(args.rows, args.runs))
+
+
+if __name__ == '__main__':
+    main()
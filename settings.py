@@ -4,10 +4,136 @@ from dotenv import load_dotenv
 
 load_dotenv()
 
-if os.getenv("ENV") == "testing":
+TESTING = os.getenv("ENV") == "testing"
+
+if TESTING:
     DATABASE_URL = os.getenv("TEST_DATABASE_URL") or os.getenv("DATABASE_URL")
 else:
     DATABASE_URL = os.getenv("DATABASE_URL")
 
+# Read replicas of DATABASE_URL (comma-separated), used by read-only service
+# functions. A replica more than REPLICA_MAX_LAG_SECONDS behind the primary
+# is skipped; lag is re-checked every REPLICA_LAG_CHECK_SECONDS. With
+# REPLICA_READ_YOUR_WRITES, reads after a write in the same unit of work
+# (e.g. request) go to the primary.
+DATABASE_REPLICA_URLS = [
+    url.strip()
+    for url in os.getenv('DATABASE_REPLICA_URLS', '').split(',')
+    if url.strip()
+]
+REPLICA_MAX_LAG_SECONDS = float(os.getenv('REPLICA_MAX_LAG_SECONDS', '5'))
+REPLICA_LAG_CHECK_SECONDS = float(os.getenv('REPLICA_LAG_CHECK_SECONDS', '1'))
+REPLICA_READ_YOUR_WRITES = os.getenv('REPLICA_READ_YOUR_WRITES', 'true') == 'true'
+
+# Connection pool of each request-serving engine (the primary, and each
+# replica): a worker holds up to DB_POOL_SIZE + DB_MAX_OVERFLOW connections,
+# which bounds workers per server against Postgres max_connections. A
+# checkout waits up to DB_POOL_TIMEOUT seconds for a free connection.
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '10'))
+DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', '20'))
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', '30'))
+DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', '1800'))
+# Test each connection on checkout, replacing connections the server dropped
+DB_POOL_PRE_PING = os.getenv('DB_POOL_PRE_PING', 'true') == 'true'
+# Connection pool of the sync engine used by background jobs and scripts
+DB_JOB_POOL_SIZE = int(os.getenv('DB_JOB_POOL_SIZE', '2'))
+DB_JOB_MAX_OVERFLOW = int(os.getenv('DB_JOB_MAX_OVERFLOW', '3'))
+
+# Postgres statement_timeout per engine role, in milliseconds (0 disables):
+# requests fail fast, replica reads likewise, background jobs may run long
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv('DB_STATEMENT_TIMEOUT_MS', '30000'))
+DB_REPLICA_STATEMENT_TIMEOUT_MS = int(
+    os.getenv('DB_REPLICA_STATEMENT_TIMEOUT_MS', str(DB_STATEMENT_TIMEOUT_MS))
+)
+DB_JOB_STATEMENT_TIMEOUT_MS = int(os.getenv('DB_JOB_STATEMENT_TIMEOUT_MS', '0'))
+
 AUTH_ALGORITHM = os.getenv('AUTH_ALGORITHM')
 AUTH_SECRET_KEY = os.getenv('AUTH_SECRET_KEY')
+
+# Site daily summary refresh job. Every worker runs it unless disabled, but
+# only one at a time does the work (the others skip that run).
+SUMMARY_REFRESH_ENABLED = os.getenv('SUMMARY_REFRESH_ENABLED', 'true') == 'true'
+SUMMARY_REFRESH_INTERVAL_SECONDS = int(
+    os.getenv('SUMMARY_REFRESH_INTERVAL_SECONDS', '300')
+)
+SUMMARY_DEFAULT_DAYS = int(os.getenv('SUMMARY_DEFAULT_DAYS', '90'))
+# Dirty (site, day) rows recomputed per refresh transaction
+SUMMARY_REFRESH_BATCH_DAYS = int(os.getenv('SUMMARY_REFRESH_BATCH_DAYS', '500'))
+
+# Maximum number of points a single history request may return, summed over
+# all series. Larger requests are coarsened (or rejected with strict=true).
+HISTORY_MAX_POINTS = int(os.getenv('HISTORY_MAX_POINTS', '10000'))
+
+# Rows fetched per round trip (and encoded per chunk) by streaming exports
+EXPORT_BATCH_ROWS = int(os.getenv('EXPORT_BATCH_ROWS', '5000'))
+
+# Maximum number of metrics a single batch history request may ask for
+HISTORY_BATCH_MAX_SERIES = int(os.getenv('HISTORY_BATCH_MAX_SERIES', '50'))
+
+# SQL statement checks of each HTTP request. A request may run at most its
+# endpoint's budget of statements (QUERY_BUDGET_DEFAULT unless the endpoint
+# sets one), and no statement shape QUERY_REPEAT_LIMIT times or more (the
+# N+1 pattern). QUERY_GUARD 'raise' fails the request, 'warn' logs it and
+# 'off' skips the checks; it defaults to 'raise' in tests and 'warn' in
+# development.
+QUERY_GUARD = os.getenv(
+    'QUERY_GUARD',
+    'raise' if TESTING else 'warn' if os.getenv('ENV') == 'development' else 'off',
+)
+QUERY_BUDGET_DEFAULT = int(os.getenv('QUERY_BUDGET_DEFAULT', '20'))
+QUERY_REPEAT_LIMIT = int(os.getenv('QUERY_REPEAT_LIMIT', '3'))
+
+# Request tracing: a span per request, service function and SQL statement,
+# exported as OTLP/JSON to TRACE_EXPORT: 'otlp' POSTs each trace to
+# TRACE_OTLP_ENDPOINT (e.g. a local OpenTelemetry collector), 'file' appends
+# it as a line to TRACE_FILE, '' (the default) disables tracing. Only
+# TRACE_SAMPLE_RATIO of requests are traced, besides those whose W3C
+# traceparent header says sampled. Traces beyond TRACE_EXPORT_MAX_QUEUE
+# waiting for export are dropped.
+TRACE_EXPORT = os.getenv('TRACE_EXPORT', '')
+TRACE_OTLP_ENDPOINT = os.getenv(
+    'TRACE_OTLP_ENDPOINT', 'http://localhost:4318/v1/traces'
+)
+TRACE_FILE = os.getenv('TRACE_FILE', 'traces.jsonl')
+TRACE_SAMPLE_RATIO = float(os.getenv('TRACE_SAMPLE_RATIO', '0.01'))
+TRACE_EXPORT_MAX_QUEUE = int(os.getenv('TRACE_EXPORT_MAX_QUEUE', '1000'))
+TRACE_SERVICE_NAME = os.getenv('TRACE_SERVICE_NAME', 'energy-management-api')
+
+# Maximum number of authenticated principals cached by access token
+PRINCIPAL_CACHE_MAX_ENTRIES = int(os.getenv('PRINCIPAL_CACHE_MAX_ENTRIES', '10000'))
+
+# History result cache: values are cached in chunks of this many minutes
+# (per series and interval), keeping at most HISTORY_CACHE_MAX_CHUNKS chunks
+HISTORY_CACHE_CHUNK_MINUTES = int(os.getenv('HISTORY_CACHE_CHUNK_MINUTES', '60'))
+HISTORY_CACHE_MAX_CHUNKS = int(os.getenv('HISTORY_CACHE_MAX_CHUNKS', '10000'))
+
+# Cache backend shared by the service layer: 'memory' (per process) or
+# 'redis' (any server speaking the Redis protocol, at CACHE_URL)
+CACHE_BACKEND = os.getenv('CACHE_BACKEND', 'memory')
+CACHE_URL = os.getenv('CACHE_URL', 'redis://localhost:6379/0')
+CACHE_MAX_ENTRIES = int(os.getenv('CACHE_MAX_ENTRIES', '50000'))
+CACHE_DEFAULT_TTL_SECONDS = int(os.getenv('CACHE_DEFAULT_TTL_SECONDS', '3600'))
+
+# Live subscription streams: change batches buffered per client before it
+# is dropped as too slow, seconds between keepalives on an idle stream, and
+# seconds after which a stream ends (the client reconnects)
+STREAM_CLIENT_BUFFER = int(os.getenv('STREAM_CLIENT_BUFFER', '100'))
+STREAM_HEARTBEAT_SECONDS = float(os.getenv('STREAM_HEARTBEAT_SECONDS', '15'))
+STREAM_MAX_SECONDS = float(os.getenv('STREAM_MAX_SECONDS', '3600'))
+
+# Seconds a delta sync cursor stays valid after it was issued; older
+# cursors get a full sync
+SYNC_CURSOR_TTL_SECONDS = int(os.getenv('SYNC_CURSOR_TTL_SECONDS', '86400'))
+
+# Cross-worker change feed over Postgres LISTEN/NOTIFY: each worker keeps
+# one listening connection, pinged every CHANGE_FEED_PING_SECONDS and
+# re-established CHANGE_FEED_RECONNECT_SECONDS after a failure
+CHANGE_FEED_ENABLED = os.getenv('CHANGE_FEED_ENABLED', 'true') == 'true'
+CHANGE_FEED_PING_SECONDS = float(os.getenv('CHANGE_FEED_PING_SECONDS', '30'))
+CHANGE_FEED_RECONNECT_SECONDS = float(os.getenv('CHANGE_FEED_RECONNECT_SECONDS', '1'))
+
+# Password hashing: bcrypt cost factor, and the worker pool hashing and
+# verification run on (PASSWORD_HASH_MAX_QUEUE callers may wait for a worker)
+BCRYPT_ROUNDS = int(os.getenv('BCRYPT_ROUNDS', '12'))
+PASSWORD_HASH_WORKERS = int(os.getenv('PASSWORD_HASH_WORKERS', '4'))
+PASSWORD_HASH_MAX_QUEUE = int(os.getenv('PASSWORD_HASH_MAX_QUEUE', '64'))
@@ -2,6 +2,9 @@ import os
 import sys
 import pytest
 
+# Selects TEST_DATABASE_URL and test engine settings; must precede app imports
+os.environ.setdefault('ENV', 'testing')
+
 from fastapi.testclient import TestClient
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
@@ -118,3 +118,4 @@ def test_standard_user_register_attempt(client, test_user):
     response = client.post('/auth/register', json=new_user, headers=headers)
     assert response.status_code == 403
     assert 'Not enough permissions' in response.json()['detail']
+
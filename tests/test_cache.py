@@ -0,0 +1,201 @@
+import asyncio
+import threading
+import time
+
+import fakeredis
+import fakeredis.aioredis
+import pytest
+
+from app.core.cache import CacheBackend, MemoryCacheBackend, RedisCacheBackend
+from app.core.response_cache import ResponseCache
+
+
+@pytest.fixture(scope='function')
+def redis_server():
+    """In-memory stand-in for a Redis-compatible server"""
+    return fakeredis.FakeServer()
+
+
+def _redis_backend(server) -> RedisCacheBackend:
+    return RedisCacheBackend(
+        client=fakeredis.FakeRedis(server=server),
+        async_client=fakeredis.aioredis.FakeRedis(server=server),
+    )
+
+
+def _stampede(backend, callers: int = 200) -> list:
+    """Run get_or_set for one cold key from many threads at once"""
+    calls = []
+    results = []
+    start = threading.Barrier(callers)
+
+    def loader():
+        calls.append(1)
+        time.sleep(0.05)
+        return 'value'
+
+    def caller():
+        start.wait()
+        results.append(backend.get_or_set('cold', loader))
+
+    threads = [threading.Thread(target=caller) for _ in range(callers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == ['value'] * callers
+    return calls
+
+
+def test_memory_backend_lru_and_ttl():
+    """Test the in-process backend is bounded and honours TTLs"""
+    backend = MemoryCacheBackend(max_entries=2)
+    backend.set('a', 1)
+    backend.set('b', 2)
+    backend.get('a')
+    backend.set('c', 3)
+    assert backend.get_many(['a', 'b', 'c']) == {'a': 1, 'c': 3}
+
+    backend.set('short', 1, ttl=0.01)
+    time.sleep(0.02)
+    assert backend.get('short') is None
+
+
+def test_memory_backend_single_flight():
+    """Test a cold key hit by many callers is loaded once"""
+    assert len(_stampede(MemoryCacheBackend(max_entries=10))) == 1
+
+
+def test_redis_backend_batched_get_set(redis_server):
+    """Test batched operations and counters against the fake server"""
+    backend = _redis_backend(redis_server)
+    backend.set_many({'a': [1.0, 2.0], 'b': ('etag', b'body')})
+
+    assert backend.get_many(['a', 'b', 'missing']) == {
+        'a': [1.0, 2.0],
+        'b': ('etag', b'body'),
+    }
+    assert backend.incr('generation') == 1
+    assert backend.incr('generation') == 2
+    assert backend.counter('generation') == 2
+
+    backend.delete('a')
+    assert backend.get('a') is None
+
+
+def test_redis_backend_single_flight_across_workers(redis_server):
+    """Test workers sharing the server load a cold key once"""
+    workers = [_redis_backend(redis_server) for _ in range(4)]
+    calls = []
+    results = []
+
+    def loader():
+        calls.append(1)
+        time.sleep(0.1)
+        return 'value'
+
+    def caller(backend):
+        results.append(backend.get_or_set('cold', loader))
+
+    threads = [
+        threading.Thread(target=caller, args=(worker,))
+        for worker in workers
+        for _ in range(10)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results == ['value'] * 40
+    assert len(calls) == 1
+
+
+def test_redis_backend_keeps_foreign_lock(redis_server):
+    """Test a worker never releases a load lock it does not hold"""
+    backend = _redis_backend(redis_server)
+    client = fakeredis.FakeRedis(server=redis_server)
+    token = backend._lock('cold')
+    # The lock expired and another worker took it
+    client.set('wattstor:lock:cold', b'other')
+
+    backend._unlock('cold', token)
+    assert client.get('wattstor:lock:cold') == b'other'
+
+    backend._unlock('cold', b'other')
+    assert client.get('wattstor:lock:cold') is None
+
+
+def test_redis_backend_async_waiters_do_not_block_loop(redis_server):
+    """Test async callers wait for another worker's load on the event loop"""
+    loading = _redis_backend(redis_server)
+    waiting = _redis_backend(redis_server)
+    calls = []
+
+    async def loader():
+        calls.append(1)
+        await asyncio.sleep(0.1)
+        return 'value'
+
+    async def main():
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        tick = asyncio.create_task(ticker())
+        results = await asyncio.gather(
+            loading.get_or_set_async('cold', loader),
+            waiting.get_or_set_async('cold', loader),
+        )
+        tick.cancel()
+        return results, ticks
+
+    results, ticks = asyncio.run(main())
+    assert results == ['value', 'value']
+    assert len(calls) == 1
+    # The loop kept running while the second worker waited
+    assert ticks >= 5
+
+
+class _NoSyncClient:
+    """Sync client stand-in failing on use, as the event loop must not block"""
+
+    def __getattr__(self, name):
+        raise AssertionError(f'Blocking Redis call {name}() on the event loop')
+
+
+def test_redis_backend_async_path_uses_async_client(redis_server):
+    """Test async lookups, loads and generations never use the sync client"""
+    backend = RedisCacheBackend(
+        client=_NoSyncClient(),
+        async_client=fakeredis.aioredis.FakeRedis(server=redis_server),
+    )
+    responses = ResponseCache(backend)
+
+    async def build() -> bytes:
+        return b'[]'
+
+    async def main():
+        first = await responses.get_or_build('sites', 'key', build)
+        second = await responses.get_or_build('sites', 'key', build)
+        return first, second
+
+    first, second = asyncio.run(main())
+    assert first == second
+    assert first[1] == b'[]'
+    assert backend.stats() == {'hits': 1, 'misses': 1}
+
+
+def test_incomplete_backend_fails_on_creation():
+    """Test a backend missing abstract methods cannot be instantiated"""
+
+    class GetOnly(CacheBackend):
+        def _get(self, key):
+            return None
+
+    with pytest.raises(TypeError):
+        GetOnly()
@@ -0,0 +1,153 @@
+import asyncio
+import json
+
+import pytest
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from app.core import live
+from app.core.change_feed import METRICS_CHANNEL, WORKER_ID, ChangeFeed
+from app.core.database import Base, engine
+from app.core.db_session import current_session, with_db_session
+from app.core.live import metric_hub
+from app.models.device import Device
+from app.models.metric import Metric
+from app.models.site import Site
+
+from settings import DATABASE_URL
+
+pytestmark = pytest.mark.skipif(
+    engine.dialect.name != 'postgresql', reason='LISTEN/NOTIFY is a Postgres feature'
+)
+
+
+@pytest.fixture(scope='function')
+def metrics():
+    """Two metrics of one device"""
+    Base.metadata.create_all(bind=engine)
+    with Session(engine, expire_on_commit=False) as session:
+        device = Device(name='Meter', type='sensor', site=Site(name='Site'))
+        metrics = [
+            Metric(name='Power', unit='kW', value=1.0, device=device),
+            Metric(name='Energy', unit='kWh', value=2.0, device=device),
+        ]
+        session.add_all(metrics)
+        session.commit()
+    yield metrics
+    Base.metadata.drop_all(bind=engine)
+
+
+async def _listening(feed: ChangeFeed) -> asyncio.Task:
+    task = asyncio.create_task(feed.run())
+    await asyncio.wait_for(feed.connected.wait(), 5)
+    return task
+
+
+async def _stop(task: asyncio.Task) -> None:
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+
+
+@with_db_session
+async def _set_values(values: dict[int, float]) -> None:
+    db = current_session()
+    for metric_id, value in values.items():
+        (await db.get(Metric, metric_id)).value = value
+        await db.flush()
+
+
+def test_one_notification_per_transaction(metrics: list[Metric]):
+    """Test the metric writes of a transaction are notified together"""
+    feed = ChangeFeed(DATABASE_URL)
+    received = asyncio.Queue()
+    feed.subscribe(METRICS_CHANNEL, received.put_nowait, own=True)
+
+    async def write() -> list[dict]:
+        task = await _listening(feed)
+        try:
+            await _set_values({metrics[0].id: 5.0, metrics[1].id: 6.0})
+            first = await asyncio.wait_for(received.get(), 5)
+            await asyncio.sleep(0.1)
+            return [first] + [received.get_nowait() for _ in range(received.qsize())]
+        finally:
+            await _stop(task)
+
+    notifications = asyncio.run(write())
+    assert len(notifications) == 1
+    assert notifications[0]['w'] == WORKER_ID
+    assert sorted(entry[:2] for entry in notifications[0]['m']) == [
+        [metrics[0].id, metrics[0].device_id],
+        [metrics[1].id, metrics[1].device_id],
+    ]
+
+
+def test_other_workers_changes_reach_local_clients(metrics: list[Metric]):
+    """Test a notification from another worker updates local stream clients"""
+    feed = ChangeFeed(DATABASE_URL)
+    feed.subscribe(METRICS_CHANNEL, live._publish_remote_metric_changes)
+    # Another worker's write: stored, then notified
+    with engine.begin() as connection:
+        connection.execute(
+            text('UPDATE metrics SET value = 9.5 WHERE id = :id'),
+            {'id': metrics[0].id},
+        )
+
+    async def follow() -> list[dict]:
+        task = await _listening(feed)
+        stream = metric_hub.connect([metrics[0].id])
+        try:
+            payload = {'w': 'other-worker', 'm': [[metrics[0].id, 1, None]]}
+            with engine.begin() as connection:
+                connection.execute(
+                    text('SELECT pg_notify(:channel, :payload)'),
+                    {'channel': METRICS_CHANNEL, 'payload': json.dumps(payload)},
+                )
+            return await asyncio.wait_for(stream.next_changes(), 5)
+        finally:
+            metric_hub.disconnect(stream)
+            await _stop(task)
+
+    changes = asyncio.run(follow())
+    assert [(c['metric_id'], c['value']) for c in changes] == [(metrics[0].id, 9.5)]
+
+
+def test_own_notifications_skipped():
+    """Test handlers only get this worker's notifications when asked to"""
+    feed = ChangeFeed(DATABASE_URL)
+    remote, everything = [], []
+    feed.subscribe(METRICS_CHANNEL, remote.append)
+    feed.subscribe(METRICS_CHANNEL, everything.append, own=True)
+
+    asyncio.run(feed.dispatch(METRICS_CHANNEL, {'w': WORKER_ID, 'm': []}))
+    asyncio.run(feed.dispatch(METRICS_CHANNEL, {'w': 'other-worker', 'm': []}))
+    assert [payload['w'] for payload in remote] == ['other-worker']
+    assert len(everything) == 2
+
+
+def test_reconnects_after_connection_loss():
+    """Test the feed reconnects and runs its hooks when its connection dies"""
+    feed = ChangeFeed(DATABASE_URL, reconnect_seconds=0.05)
+    feed.subscribe(METRICS_CHANNEL, lambda payload: None)
+    hooks = []
+    feed.on_reconnect(lambda: hooks.append('reconnected'))
+
+    async def lose_connection():
+        task = await _listening(feed)
+        try:
+            with engine.begin() as connection:
+                connection.execute(
+                    text(
+                        'SELECT pg_terminate_backend(pid) FROM pg_stat_activity '
+                        "WHERE query LIKE 'LISTEN%'"
+                    )
+                )
+            for _ in range(100):
+                if feed.reconnects:
+                    break
+                await asyncio.sleep(0.05)
+        finally:
+            await _stop(task)
+
+    asyncio.run(lose_connection())
+    assert feed.reconnects == 1
+    assert hooks == ['reconnected']
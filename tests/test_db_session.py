@@ -0,0 +1,127 @@
+import asyncio
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session
+
+from app.main import app
+from app.core import auth
+from app.core.auth import get_password_hash
+from app.core.database import Base, async_engine, engine
+from app.core.db_session import current_session, with_db_session
+from app.models.device import Device
+from app.models.metric import Metric
+from app.models.site import Site
+from app.models.subscription import Subscription
+from app.models.user import User, UserRole
+
+# Create test client
+client = TestClient(app)
+
+
+@pytest.fixture(scope='function')
+def db_session():
+    Base.metadata.create_all(bind=engine)
+    session = Session(engine)
+    try:
+        yield session
+    finally:
+        session.close()
+        auth._principal_cache.clear()
+        Base.metadata.drop_all(bind=engine)
+
+
+@pytest.fixture(scope='function')
+def test_subscription(db_session: Session):
+    """A user subscribed to one metric of a device at an authorized site"""
+    site = Site(name='Site', location='Test Location')
+    device = Device(name='Meter', type='sensor', site=site)
+    metric = Metric(name='Power', unit='kW', value=1.0, device=device)
+    user = User(
+        username='subscriber',
+        email='subscriber@example.com',
+        hashed_password=get_password_hash('testpass'),
+        role=UserRole.STANDARD,
+    )
+    user.authorized_sites = [site]
+    subscription = Subscription(name='Dashboard', user=user, metrics=[metric])
+    db_session.add(subscription)
+    db_session.commit()
+    return subscription
+
+
+@pytest.fixture(scope='function')
+def db_events():
+    """Connection checkouts and commits of the request-serving engine"""
+    events = []
+
+    def on_checkout(*args):
+        events.append('checkout')
+
+    def on_commit(conn):
+        events.append('commit')
+
+    event.listen(async_engine.sync_engine, 'checkout', on_checkout)
+    event.listen(async_engine.sync_engine, 'commit', on_commit)
+    yield events
+    event.remove(async_engine.sync_engine, 'checkout', on_checkout)
+    event.remove(async_engine.sync_engine, 'commit', on_commit)
+
+
+@with_db_session
+async def _site_names() -> set[str]:
+    return set(await current_session().scalars(select(Site.name)))
+
+
+@with_db_session
+async def _add_site(name: str, fail: bool = False):
+    db = current_session()
+    db.add(Site(name=name))
+    await db.flush()
+    if fail:
+        raise ValueError(name)
+    return db
+
+
+def test_nested_calls_join_active_session(db_session: Session, db_events: list):
+    """Test nested service calls share one connection and one commit"""
+
+    @with_db_session
+    async def outer():
+        first = await _add_site('first')
+        second = await _add_site('second')
+        return first is second is current_session()
+
+    assert asyncio.run(outer())
+    assert db_events == ['checkout', 'commit']
+    assert asyncio.run(_site_names()) == {'first', 'second'}
+
+
+def test_failed_nested_call_rolls_back_to_savepoint(db_session: Session):
+    """Test a failing nested call keeps the writes made before it"""
+
+    @with_db_session
+    async def outer():
+        await _add_site('kept')
+        with pytest.raises(ValueError):
+            await _add_site('dropped', fail=True)
+
+    asyncio.run(outer())
+    assert asyncio.run(_site_names()) == {'kept'}
+
+
+def test_request_uses_one_session(test_subscription: Subscription, db_events: list):
+    """Test auth, ownership check and service call share one transaction"""
+    response = client.post(
+        '/auth/token', data={'username': 'subscriber', 'password': 'testpass'}
+    )
+    headers = {'Authorization': f"Bearer {response.json()['access_token']}"}
+    db_events.clear()
+
+    response = client.get(
+        f'/subscriptions/{test_subscription.id}/latest', headers=headers
+    )
+    assert response.status_code == 200
+    assert response.json()['metrics'][0]['site_name'] == 'Site'
+    assert db_events == ['checkout', 'commit']
@@ -1,13 +1,20 @@
 import pytest
+from datetime import datetime, timedelta
 
+from fastapi.testclient import TestClient
 from sqlalchemy.orm import Session
 
+from app.main import app
 from app.models.device import Device
+from app.models.metric import Metric
 from app.models.user import User, UserRole
 from app.models.site import Site
 from app.core.database import Base, engine
 from app.core.auth import get_password_hash
 
+# Create test client
+client = TestClient(app)
+
 TEST_USER = {
     'username': 'testuser',
     'email': 'test@example.com',
@@ -22,6 +29,13 @@ TEST_TECHNICIAN = {
     'role': UserRole.TECHNICIAN,
 }
 
+TEST_ADMIN = {
+    'username': 'admin',
+    'email': 'admin@example.com',
+    'hashed_password': get_password_hash('adminpass'),
+    'role': UserRole.ADMIN,
+}
+
 TEST_SITE = {'name': 'Test Site', 'location': 'Test Location'}
 
 TEST_DEVICE = {'name': 'Test Device', 'type': 'sensor', 'site_id': 1}
@@ -203,3 +217,109 @@ def test_device_metrics(test_device: Device, test_user: User):
     data = response.json()
     assert isinstance(data, list)
     assert len(data) > 0  # Each device has at least one metric
+
+
+@pytest.fixture(scope='function')
+def fleet(db_session: Session):
+    """
+    Two sites with Power readings: batteries at both sites and an inverter
+    at the first one. Only the latest reading of each device counts.
+    """
+    north = Site(name='North', location='Test Location')
+    south = Site(name='South', location='Test Location')
+    db_session.add_all([north, south])
+    db_session.commit()
+    now = datetime.utcnow()
+    readings = {
+        Device(name='Battery N', type='battery', site_id=north.id): [1.0, 4.0],
+        Device(name='Inverter N', type='inverter', site_id=north.id): [10.0],
+        Device(name='Battery S', type='battery', site_id=south.id): [100.0, 2.0],
+    }
+    db_session.add_all(readings)
+    db_session.commit()
+    for device, values in readings.items():
+        for age, value in enumerate(reversed(values), start=1):
+            db_session.add(
+                Metric(
+                    name='Power',
+                    unit='kW',
+                    device_id=device.id,
+                    value=value,
+                    timestamp=now - timedelta(hours=age),
+                )
+            )
+    db_session.commit()
+    return north, south
+
+
+def _login(username: str, password: str) -> dict:
+    response = client.post(
+        '/auth/token', data={'username': username, 'password': password}
+    )
+    return {'Authorization': f'Bearer {response.json()["access_token"]}'}
+
+
+def _group(group: dict) -> tuple:
+    return (
+        group['site_id'],
+        group['type'],
+        group['device_count'],
+        group['avg'],
+        group['min'],
+        group['max'],
+    )
+
+
+@pytest.mark.device
+@pytest.mark.integration
+def test_fleet_statistics(db_session: Session, fleet: tuple[Site, Site]):
+    north, south = fleet
+    admin = User(**TEST_ADMIN)
+    db_session.add(admin)
+    db_session.commit()
+
+    response = client.get(
+        '/devices/stats',
+        params={'metric_name': 'Power'},
+        headers=_login('admin', 'adminpass'),
+    )
+    assert response.status_code == 200
+    data = response.json()
+    assert data['metric_name'] == 'Power'
+    assert [_group(group) for group in data['by_type']] == [
+        (None, 'battery', 2, 3.0, 2.0, 4.0),
+        (None, 'inverter', 1, 10.0, 10.0, 10.0),
+    ]
+    assert [_group(group) for group in data['by_site']] == [
+        (north.id, None, 2, 7.0, 4.0, 10.0),
+        (south.id, None, 1, 2.0, 2.0, 2.0),
+    ]
+    assert [_group(group) for group in data['by_site_and_type']] == [
+        (north.id, 'battery', 1, 4.0, 4.0, 4.0),
+        (north.id, 'inverter', 1, 10.0, 10.0, 10.0),
+        (south.id, 'battery', 1, 2.0, 2.0, 2.0),
+    ]
+
+
+@pytest.mark.device
+@pytest.mark.integration
+def test_fleet_statistics_authorized_sites_only(
+    db_session: Session, fleet: tuple[Site, Site], test_user: User
+):
+    north, _ = fleet
+    test_user.authorized_sites.append(north)
+    db_session.commit()
+
+    response = client.get(
+        '/devices/stats',
+        params={'metric_name': 'Power'},
+        headers=_login(test_user.username, 'testpass'),
+    )
+    assert response.status_code == 200
+    data = response.json()
+    assert [_group(group) for group in data['by_type']] == [
+        (None, 'battery', 1, 4.0, 4.0, 4.0),
+        (None, 'inverter', 1, 10.0, 10.0, 10.0),
+    ]
+    assert [group['site_id'] for group in data['by_site']] == [north.id]
+    assert {group['site_id'] for group in data['by_site_and_type']} == {north.id}
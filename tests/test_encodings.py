@@ -0,0 +1,126 @@
+import json
+import struct
+from array import array
+from datetime import datetime, timezone
+
+import msgpack
+import pytest
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+from sqlalchemy.orm import Session
+
+from app.main import app
+from app.core.database import Base, engine
+from app.core.encodings import COLUMNAR, JSON, MSGPACK, negotiate
+from app.models.device import Device
+from app.models.metric import Metric
+from app.models.site import Site
+
+# Create test client
+client = TestClient(app)
+
+HISTORY_PARAMS = {
+    'start_time': '2024-01-01T00:00:00Z',
+    'end_time': '2024-01-01T01:00:00Z',
+    'interval_minutes': 5,
+}
+
+
+@pytest.fixture(scope='function')
+def db_session():
+    Base.metadata.create_all(bind=engine)
+    session = Session(engine)
+    try:
+        yield session
+    finally:
+        session.close()
+        Base.metadata.drop_all(bind=engine)
+
+
+@pytest.fixture(scope='function')
+def metric(db_session: Session) -> Metric:
+    device = Device(name='Meter', type='sensor', site=Site(name='Site A'))
+    metric = Metric(
+        name='Power',
+        unit='kW',
+        value=5.0,
+        timestamp=datetime(2024, 1, 1),
+        device=device,
+    )
+    db_session.add(metric)
+    db_session.commit()
+    return metric
+
+
+def _decode_columnar(body: bytes) -> tuple[dict, list[list]]:
+    """(document, arrays) of a columnar body"""
+    assert body[:4] == b'TSC1'
+    (length,) = struct.unpack('<I', body[4:8])
+    header = json.loads(body[8 : 8 + length])
+    data = body[8 + length :]
+    assert (8 + length) % 8 == 0
+    arrays = []
+    for spec in header['arrays']:
+        values = array('q' if spec['type'] == 'int64' else 'd')
+        values.frombytes(data[spec['offset'] : spec['offset'] + spec['length'] * 8])
+        arrays.append(list(values))
+    return header['document'], arrays
+
+
+def test_negotiate():
+    """Test Accept headers pick the preferred offered encoding"""
+    assert negotiate(None) == JSON
+    assert negotiate('*/*') == JSON
+    assert negotiate('application/msgpack') == MSGPACK
+    assert negotiate('application/x-msgpack, */*;q=0.1') == MSGPACK
+    assert negotiate(f'{COLUMNAR}, application/json;q=0.5') == COLUMNAR
+    assert negotiate('application/*;q=0.2, application/json;q=0') == MSGPACK
+    with pytest.raises(HTTPException) as error:
+        negotiate('text/html')
+    assert error.value.status_code == 406
+
+
+def test_history_encodings_agree(metric: Metric):
+    """Test MessagePack and columnar history carry the JSON values"""
+    url = f'/metrics/{metric.id}/history'
+    data = client.get(url, params=HISTORY_PARAMS).json()
+    expected_ms = [
+        int(datetime.fromisoformat(ts).timestamp() * 1000) for ts in data['timestamps']
+    ]
+    assert len(expected_ms) == 13
+
+    response = client.get(url, params=HISTORY_PARAMS, headers={'Accept': MSGPACK})
+    assert response.headers['content-type'] == MSGPACK
+    assert response.headers['vary'] == 'Accept'
+    packed = msgpack.unpackb(response.content)
+    assert packed['timestamps'] == expected_ms
+    assert packed['values'] == data['values']
+
+    response = client.get(url, params=HISTORY_PARAMS, headers={'Accept': COLUMNAR})
+    assert response.headers['content-type'] == COLUMNAR
+    document, arrays = _decode_columnar(response.content)
+    assert document['unit'] == 'kW'
+    assert arrays[document['timestamps']['$array']] == expected_ms
+    assert arrays[document['values']['$array']] == data['values']
+
+
+def test_latest_columnar(metric: Metric):
+    """Test latest values come as columns, timestamps as epoch milliseconds"""
+    response = client.get(
+        f'/metrics/device/{metric.device_id}/latest', headers={'Accept': COLUMNAR}
+    )
+    assert response.status_code == 200
+    document, arrays = _decode_columnar(response.content)
+    columns = document['$columns']
+    assert columns['name'] == ['Power']
+    assert arrays[columns['value']['$array']] == [5.0]
+    epoch = datetime(2024, 1, 1, tzinfo=timezone.utc).timestamp() * 1000
+    assert arrays[columns['timestamp']['$array']] == [epoch]
+
+
+def test_unacceptable_encoding(metric: Metric):
+    """Test an Accept header offering no supported encoding gets a 406"""
+    response = client.get(
+        f'/metrics/{metric.id}/history', headers={'Accept': 'text/html'}
+    )
+    assert response.status_code == 406
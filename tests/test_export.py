@@ -0,0 +1,199 @@
+import asyncio
+import csv
+import io
+import json
+from datetime import datetime, timedelta
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy.orm import Session
+
+from app.main import app
+from app.core import auth
+from app.core.auth import get_password_hash
+from app.core.database import Base, engine
+from app.models.device import Device
+from app.models.metric import Metric
+from app.models.site import Site
+from app.models.subscription import Subscription
+from app.models.user import User, UserRole
+from app.services import export_service
+
+# Create test client
+client = TestClient(app)
+
+START = datetime(2024, 1, 1)
+
+
+@pytest.fixture(scope='function')
+def db_session():
+    Base.metadata.create_all(bind=engine)
+    session = Session(engine)
+    try:
+        yield session
+    finally:
+        session.close()
+        auth._principal_cache.clear()
+        Base.metadata.drop_all(bind=engine)
+
+
+@pytest.fixture(scope='function')
+def readings(db_session: Session) -> dict:
+    """An hour of minutely power and energy readings at an authorized site"""
+    site = Site(name='Site A')
+    device = Device(name='Meter', type='sensor', site=site)
+    other_device = Device(name='Other', type='sensor', site=Site(name='Site B'))
+    power = [
+        Metric(
+            name='Power',
+            unit='kW',
+            value=float(minute),
+            timestamp=START + timedelta(minutes=minute),
+            device=device,
+        )
+        for minute in range(60)
+    ]
+    energy = Metric(
+        name='Energy', unit='kWh', value=7.0, timestamp=START, device=device
+    )
+    hidden = Metric(
+        name='Power', unit='kW', value=1.0, timestamp=START, device=other_device
+    )
+    user = User(
+        username='analyst',
+        email='analyst@example.com',
+        hashed_password=get_password_hash('testpass'),
+        role=UserRole.STANDARD,
+    )
+    user.authorized_sites = [site]
+    subscription = Subscription(name='Dashboard', user=user, metrics=[energy])
+    db_session.add_all(power + [energy, hidden, subscription])
+    db_session.commit()
+    return {
+        'site': site,
+        'other_site': other_device.site,
+        'power': power,
+        'subscription': subscription,
+    }
+
+
+def _login() -> dict:
+    response = client.post(
+        '/auth/token', data={'username': 'analyst', 'password': 'testpass'}
+    )
+    return {'Authorization': f"Bearer {response.json()['access_token']}"}
+
+
+def test_export_site_ndjson(readings: dict):
+    """Test a site export streams every reading of the site, oldest first"""
+    response = client.get(
+        '/export/readings', params={'site_id': readings['site'].id}, headers=_login()
+    )
+    assert response.status_code == 200
+    assert response.headers['content-type'] == 'application/x-ndjson'
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    assert len(rows) == 61
+    assert rows[0]['timestamp'] == START.isoformat()
+    assert rows[-1]['value'] == 59.0
+    assert {row['site_name'] for row in rows} == {'Site A'}
+
+
+def test_export_metric_csv_in_range(readings: dict):
+    """Test a metric export holds only its series, within the time range"""
+    response = client.get(
+        '/export/readings',
+        params={
+            'format': 'csv',
+            'metric_id': readings['power'][0].id,
+            'start_time': (START + timedelta(minutes=10)).isoformat(),
+            'end_time': (START + timedelta(minutes=20)).isoformat(),
+        },
+        headers=_login(),
+    )
+    assert response.status_code == 200
+    assert 'metric-' in response.headers['content-disposition']
+    rows = list(csv.DictReader(io.StringIO(response.text)))
+    assert [float(row['value']) for row in rows] == [float(m) for m in range(10, 20)]
+    assert {row['metric_name'] for row in rows} == {'Power'}
+
+
+def test_export_subscription(readings: dict):
+    """Test a subscription export holds the series of its metrics"""
+    response = client.get(
+        '/export/readings',
+        params={'subscription_id': readings['subscription'].id},
+        headers=_login(),
+    )
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    assert [(row['metric_name'], row['value']) for row in rows] == [('Energy', 7.0)]
+
+
+def test_export_checks_scope(readings: dict):
+    """Test exports need exactly one scope, which the user may read"""
+    headers = _login()
+    response = client.get('/export/readings', headers=headers)
+    assert response.status_code == 400
+
+    response = client.get(
+        '/export/readings',
+        params={'site_id': readings['other_site'].id},
+        headers=headers,
+    )
+    assert response.status_code == 403
+
+
+def test_rows_streamed_in_batches(readings: dict):
+    """Test rows arrive in bounded batches rather than all at once"""
+
+    async def batch_sizes() -> list[int]:
+        query = export_service.readings_query(site_id=readings['site'].id)
+        return [len(batch) async for batch in export_service.stream_rows(query, 25)]
+
+    assert asyncio.run(batch_sizes()) == [25, 25, 11]
+
+
+def test_export_readings_arrow(readings: dict):
+    """Test an Arrow export carries typed, dictionary-encoded columns"""
+    response = client.get(
+        '/export/readings',
+        params={'format': 'arrow', 'site_id': readings['site'].id},
+        headers=_login(),
+    )
+    assert response.status_code == 200
+    assert response.headers['content-type'] == 'application/vnd.apache.arrow.stream'
+    table = pa.ipc.open_stream(response.content).read_all()
+    assert table.num_rows == 61
+    assert table.schema.field('timestamp').type == pa.timestamp('ms', tz='UTC')
+    assert table.schema.field('value').type == pa.float64()
+    assert pa.types.is_dictionary(table.schema.field('metric_name').type)
+    assert table.column('timestamp')[0].as_py().replace(tzinfo=None) == START
+    assert set(table.column('metric_name').to_pylist()) == {'Power', 'Energy'}
+
+
+def test_export_history_parquet(readings: dict):
+    """Test a history export holds every point of every metric in scope"""
+    response = client.get(
+        '/export/history',
+        params={
+            'format': 'parquet',
+            'subscription_id': readings['subscription'].id,
+            'start_time': '2024-01-01T00:00:00Z',
+            'end_time': '2024-01-01T01:00:00Z',
+            'interval_minutes': 5,
+        },
+        headers=_login(),
+    )
+    assert response.status_code == 200
+    table = pq.read_table(io.BytesIO(response.content))
+    assert table.num_rows == 13
+    assert table.column('metric_name').to_pylist() == ['Energy'] * 13
+    assert table.schema.field('value').type == pa.float64()
+
+    response = client.get(
+        '/export/history',
+        params={'site_id': readings['other_site'].id},
+        headers=_login(),
+    )
+    assert response.status_code == 403
@@ -0,0 +1,73 @@
+from datetime import datetime, timedelta, timezone
+
+from app.core.cache import MemoryCacheBackend
+from app.core.history_cache import HistoryCache
+from app.core.timeseries import sample_value, time_axis
+
+NOW = datetime(2024, 6, 2, 12, 30, tzinfo=timezone.utc)
+
+
+def _generate(chunk):
+    return [sample_value(1, ts) for ts in chunk]
+
+
+def test_history_cache_matches_direct_generation():
+    """Test values assembled from chunks equal freshly generated ones"""
+    cache = HistoryCache(MemoryCacheBackend(100), chunk_minutes=60)
+    timestamps = time_axis(NOW - timedelta(hours=24), NOW, 5)
+
+    values = cache.values('series', timestamps, 5, _generate, now=NOW.timestamp())
+
+    assert values == _generate(timestamps)
+
+
+def test_history_cache_reuses_closed_chunks():
+    """Test a sliding window only regenerates the open trailing chunk"""
+    cache = HistoryCache(MemoryCacheBackend(100), chunk_minutes=60)
+    calls = []
+
+    def generate(chunk):
+        calls.append(len(chunk))
+        return _generate(chunk)
+
+    first = time_axis(NOW - timedelta(hours=24), NOW, 5)
+    cache.values('series', first, 5, generate, now=NOW.timestamp())
+    misses = cache.stats()['misses']
+
+    later = NOW + timedelta(minutes=1)
+    calls.clear()
+    second = time_axis(later - timedelta(hours=24), later, 5)
+    values = cache.values('series', second, 5, generate, now=later.timestamp())
+
+    assert values == _generate(second)
+    assert cache.stats()['misses'] == misses
+    assert cache.stats()['hits'] >= 24
+    # Only the open 12:00-13:00 chunk was generated again
+    assert calls == [7]
+
+
+def test_history_cache_is_bounded():
+    """Test least recently used chunks are evicted"""
+    cache = HistoryCache(MemoryCacheBackend(3), chunk_minutes=60)
+    timestamps = time_axis(NOW - timedelta(hours=24), NOW, 5)
+
+    cache.values('series', timestamps, 5, _generate, now=NOW.timestamp())
+
+    assert cache.stats()['entries'] == 3
+
+
+def test_history_cache_counts_each_chunk_once():
+    """Test a cold chunk counts as one miss and a cached one as one hit"""
+    cache = HistoryCache(MemoryCacheBackend(100), chunk_minutes=60)
+    # Two closed chunks, well before now
+    timestamps = time_axis(
+        NOW - timedelta(hours=4, minutes=30), NOW - timedelta(hours=2, minutes=35), 5
+    )
+
+    cache.values('series', timestamps, 5, _generate, now=NOW.timestamp())
+    assert cache.stats()['misses'] == 2
+    assert cache.stats()['hits'] == 0
+
+    cache.values('series', timestamps, 5, _generate, now=NOW.timestamp())
+    assert cache.stats()['misses'] == 2
+    assert cache.stats()['hits'] == 2
@@ -0,0 +1,107 @@
+import math
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy.orm import Session
+
+from app.main import app
+from app.core import auth
+from app.core.auth import get_password_hash
+from app.core.database import Base, engine
+from app.core.instrumentation import Exposition, Histogram
+from app.models.site import Site
+from app.models.user import User, UserRole
+
+# Create test client
+client = TestClient(app)
+
+
+@pytest.fixture(scope='function')
+def db_session():
+    Base.metadata.create_all(bind=engine)
+    session = Session(engine)
+    try:
+        yield session
+    finally:
+        session.close()
+        auth._principal_cache.clear()
+        Base.metadata.drop_all(bind=engine)
+
+
+@pytest.fixture(scope='function')
+def users(db_session: Session) -> None:
+    """An admin and a standard user, both with password testpass"""
+    db_session.add_all(
+        User(
+            username=role.value,
+            email=f'{role.value}@example.com',
+            hashed_password=get_password_hash('testpass'),
+            role=role,
+        )
+        for role in (UserRole.ADMIN, UserRole.STANDARD)
+    )
+    db_session.add(Site(name='Site A'))
+    db_session.commit()
+
+
+def _login(username: str) -> dict:
+    response = client.post(
+        '/auth/token', data={'username': username, 'password': 'testpass'}
+    )
+    return {'Authorization': f"Bearer {response.json()['access_token']}"}
+
+
+def test_scrape_metrics(users):
+    """Test an admin scrapes route latency, statement counts and caches"""
+    headers = _login(UserRole.ADMIN.value)
+    client.get('/sites/', headers=headers)
+    client.get('/sites/', headers=headers)
+
+    response = client.get('/internal/metrics', headers=headers)
+    assert response.status_code == 200
+    assert response.headers['content-type'] == Exposition.CONTENT_TYPE
+    lines = response.text.splitlines()
+    assert (
+        'http_request_duration_seconds_bucket'
+        '{method="GET",route="/sites/",status="200",le="+Inf"}'
+    ) in {line.rsplit(' ', 1)[0] for line in lines}
+    assert any(line.startswith('http_request_db_queries_count{') for line in lines)
+    assert any(line.startswith('db_queries_total{role="primary"}') for line in lines)
+    assert any(line.startswith('cache_hit_ratio{cache="principal"}') for line in lines)
+    assert '# TYPE password_pool_jobs_total counter' in lines
+    # The scrape itself is in flight while rendering
+    assert (
+        'http_requests_in_flight{method="GET",route="/internal/metrics"} 1'
+    ) in lines
+
+
+def test_scrape_requires_admin(users):
+    """Test standard users and anonymous requests cannot scrape"""
+    response = client.get('/internal/metrics', headers=_login(UserRole.STANDARD.value))
+    assert response.status_code == 403
+    assert client.get('/internal/metrics').status_code == 401
+
+
+def test_histogram_exposition():
+    """Test histogram buckets are cumulative and rendered with +Inf"""
+    histogram = Histogram((0.1, 1.0))
+    for value in (0.05, 0.5, 0.7, 3.0):
+        histogram.observe(('GET',), value)
+    [(labels, buckets, total)] = histogram.samples()
+    assert buckets == [(0.1, 1), (1.0, 3), (math.inf, 4)]
+
+    out = Exposition()
+    out.histogram('latency', 'Latency.', [({'method': labels[0]}, buckets, total)])
+    out.add('up', 'gauge', 'Up.', [({}, True), ({'x': 'a"b'}, None)])
+    assert out.render().splitlines() == [
+        '# HELP latency Latency.',
+        '# TYPE latency histogram',
+        'latency_bucket{method="GET",le="0.1"} 1',
+        'latency_bucket{method="GET",le="1.0"} 3',
+        'latency_bucket{method="GET",le="+Inf"} 4',
+        'latency_sum{method="GET"} 4.25',
+        'latency_count{method="GET"} 4',
+        '# HELP up Up.',
+        '# TYPE up gauge',
+        'up 1',
+    ]
@@ -6,7 +6,14 @@ from sqlalchemy.orm import Session
 from app.main import app
 from app.models.metric import Metric
 from app.models.device import Device
+from app.models.site import Site
 from app.core.database import Base, engine
+from app.core.timeseries import (
+    PointBudgetExceeded,
+    count_points,
+    resolve_interval,
+)
+from settings import HISTORY_MAX_POINTS
 
 # Create test client
 client = TestClient(app)
@@ -32,7 +39,10 @@ def db_session():
 @pytest.fixture(scope='function')
 def test_device(db_session: Session):
     """Create a test device"""
-    device = Device(**TEST_DEVICE)
+    site = Site(name='Test Site', location='Test Location')
+    db_session.add(site)
+    db_session.commit()
+    device = Device(**{**TEST_DEVICE, 'site_id': site.id})
     db_session.add(device)
     db_session.commit()
     return device
@@ -41,7 +51,7 @@ def test_device(db_session: Session):
 @pytest.fixture(scope='function')
 def test_metric(db_session: Session, test_device: Device):
     """Create a test metric"""
-    metric = Metric(**TEST_METRIC)
+    metric = Metric(**{**TEST_METRIC, 'device_id': test_device.id})
     db_session.add(metric)
     db_session.commit()
     return metric
@@ -103,7 +113,7 @@ def test_get_metric_history_invalid_time_range(test_metric: Metric):
     assert 'start_time must be before end_time' in response.json()['detail']
 
 
-def test_get_metric_history_nonexistent_metric():
+def test_get_metric_history_nonexistent_metric(db_session: Session):
     """Test non-existent metric"""
     response = client.get('/metrics/999/history')
     assert response.status_code == 400
@@ -157,3 +167,161 @@ def test_get_metric_history_different_intervals(test_metric: Metric):
         for i in range(1, len(timestamps)):
             diff = timestamps[i] - timestamps[i - 1]
             assert diff.total_seconds() == interval * 60
+
+
+def test_get_metric_history_coarsened_to_point_budget(test_metric: Metric):
+    """Test a request over the point budget is coarsened"""
+    end_time = datetime.now(timezone.utc)
+    start_time = end_time - timedelta(days=365)
+
+    response = client.get(
+        f'/metrics/{test_metric.id}/history',
+        params={
+            'start_time': start_time.isoformat(),
+            'end_time': end_time.isoformat(),
+            'interval_minutes': 1,
+        },
+    )
+
+    assert response.status_code == 200
+    data = response.json()
+    assert data['requested_interval_minutes'] == 1
+    assert data['interval_minutes'] > 1
+    assert len(data['timestamps']) <= HISTORY_MAX_POINTS
+
+
+def test_get_metric_history_strict_point_budget(test_metric: Metric):
+    """Test strict mode rejects a request over the point budget"""
+    end_time = datetime.now(timezone.utc)
+    start_time = end_time - timedelta(days=365)
+
+    response = client.get(
+        f'/metrics/{test_metric.id}/history',
+        params={
+            'start_time': start_time.isoformat(),
+            'end_time': end_time.isoformat(),
+            'interval_minutes': 1,
+            'strict': True,
+        },
+    )
+
+    assert response.status_code == 400
+    assert 'budget' in response.json()['detail']
+
+
+def test_resolve_interval_within_budget():
+    """Test the requested interval is kept when it fits the budget"""
+    end_time = datetime(2024, 1, 2, tzinfo=timezone.utc)
+    start_time = end_time - timedelta(hours=24)
+    assert resolve_interval(start_time, end_time, 5, max_points=1000) == 5
+
+
+def test_resolve_interval_coarsens_per_series():
+    """Test the budget is shared between all series of a request"""
+    end_time = datetime(2024, 1, 2, tzinfo=timezone.utc)
+    start_time = end_time - timedelta(hours=24)
+
+    interval = resolve_interval(start_time, end_time, 1, series=10, max_points=1000)
+    assert interval == 15
+    assert count_points(start_time, end_time, interval) * 10 <= 1000
+
+    with pytest.raises(PointBudgetExceeded):
+        resolve_interval(start_time, end_time, 1, max_points=1000, strict=True)
+
+
+def test_get_metrics_history_batch(db_session: Session, test_metric: Metric):
+    """Test several series are returned on one shared time axis"""
+    other = Metric(name='Power', unit='kW', device_id=test_metric.device_id, value=3)
+    db_session.add(other)
+    db_session.commit()
+    params = {
+        'start_time': '2024-01-01T00:00:00Z',
+        'end_time': '2024-01-02T00:00:00Z',
+    }
+    singles = [
+        client.get(f'/metrics/{metric_id}/history', params=params).json()
+        for metric_id in (test_metric.id, other.id)
+    ]
+
+    response = client.get(
+        '/metrics/history',
+        params={**params, 'metric_ids': f'{test_metric.id},{other.id}'},
+    )
+    assert response.status_code == 200
+    data = response.json()
+
+    assert [series['metric_id'] for series in data['series']] == [
+        test_metric.id,
+        other.id,
+    ]
+    assert [series['unit'] for series in data['series']] == ['°C', 'kW']
+    for series, single in zip(data['series'], singles):
+        assert data['timestamps'] == single['timestamps']
+        assert len(series['values']) == len(data['timestamps'])
+        assert series['values'] == pytest.approx(single['values'])
+
+
+def test_get_metrics_history_batch_shares_point_budget(
+    db_session: Session, test_metric: Metric
+):
+    """Test the point budget covers all series of a batch together"""
+    other = Metric(name='Power', unit='kW', device_id=test_metric.device_id, value=3)
+    db_session.add(other)
+    db_session.commit()
+    # One series at 5 minutes fits the budget, two do not
+    end_time = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    start_time = end_time - timedelta(minutes=5 * (HISTORY_MAX_POINTS * 3 // 4))
+    params = {'start_time': start_time.isoformat(), 'end_time': end_time.isoformat()}
+
+    single = client.get(f'/metrics/{test_metric.id}/history', params=params).json()
+    assert single['interval_minutes'] == 5
+
+    response = client.get(
+        '/metrics/history',
+        params={**params, 'metric_ids': f'{test_metric.id},{other.id}'},
+    )
+    data = response.json()
+    assert data['interval_minutes'] > 5
+    assert data['requested_interval_minutes'] == 5
+    assert 2 * len(data['timestamps']) <= HISTORY_MAX_POINTS
+    for series in data['series']:
+        assert len(series['values']) == len(data['timestamps'])
+
+
+def test_get_metrics_history_batch_unknown_metric(test_metric: Metric):
+    """Test unknown metric IDs are reported"""
+    response = client.get(
+        '/metrics/history', params={'metric_ids': f'{test_metric.id},999'}
+    )
+    assert response.status_code == 400
+    assert 'Metrics not found: 999' in response.json()['detail']
+
+
+def test_get_metric_history_compare_previous_day(test_metric: Metric):
+    """Test the previous window is aligned to the current one"""
+    end_time = datetime(2024, 6, 2, tzinfo=timezone.utc)
+    start_time = end_time - timedelta(hours=2)
+    params = {
+        'start_time': start_time.isoformat(),
+        'end_time': end_time.isoformat(),
+        'interval_minutes': 15,
+    }
+
+    current = client.get(
+        f'/metrics/{test_metric.id}/history', params={**params, 'compare': 'day'}
+    ).json()
+    previous = client.get(
+        f'/metrics/{test_metric.id}/history',
+        params={
+            **params,
+            'start_time': (start_time - timedelta(days=1)).isoformat(),
+            'end_time': (end_time - timedelta(days=1)).isoformat(),
+        },
+    ).json()
+
+    assert current['compare'] == 'day'
+    assert current['previous_values'] == pytest.approx(previous['values'])
+    for value, prev, delta in zip(
+        current['values'], current['previous_values'], current['deltas']
+    ):
+        assert delta == pytest.approx(value - prev)
@@ -0,0 +1,81 @@
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy.orm import Session
+
+from app.main import app
+from app.core.database import Base, engine
+from app.models.device import Device
+from app.models.metric import Metric
+from app.models.site import Site
+
+# Create test client
+client = TestClient(app)
+
+START = datetime(2024, 1, 1)
+
+
+@pytest.fixture(scope='function')
+def db_session():
+    Base.metadata.create_all(bind=engine)
+    session = Session(engine)
+    try:
+        yield session
+    finally:
+        session.close()
+        Base.metadata.drop_all(bind=engine)
+
+
+@pytest.fixture(scope='function')
+def device(db_session: Session) -> Device:
+    """A device with three power and two energy readings, and another device"""
+    site = Site(name='Site A')
+    device = Device(name='Meter', type='sensor', site=site)
+    readings = [
+        Metric(
+            name=name,
+            unit=unit,
+            value=float(minute),
+            timestamp=START + timedelta(minutes=minute),
+            device=device,
+        )
+        for name, unit, minutes in (
+            ('Power', 'kW', (0, 1, 2)),
+            ('Energy', 'kWh', (0, 3)),
+        )
+        for minute in minutes
+    ]
+    other = Metric(
+        name='Power',
+        unit='kW',
+        value=9.0,
+        timestamp=START,
+        device=Device(name='Other', type='sensor', site=site),
+    )
+    db_session.add_all(readings + [other])
+    db_session.commit()
+    return device
+
+
+def test_list_metrics(device: Device):
+    """Test listing a device's metrics, newest first, with schema fields"""
+    response = client.get('/metrics/', params={'device_id': device.id})
+    assert response.status_code == 200
+    data = response.json()
+    assert [metric['value'] for metric in data] == [3.0, 2.0, 1.0, 0.0, 0.0]
+    assert set(data[0]) == {'id', 'name', 'unit', 'timestamp', 'value'}
+    assert data[0]['timestamp'] == (START + timedelta(minutes=3)).isoformat()
+
+    assert len(client.get('/metrics/').json()) == 6
+
+
+def test_latest_metric_values(device: Device):
+    """Test the latest reading of each metric name of a device, once each"""
+    response = client.get(f'/metrics/device/{device.id}/latest')
+    assert response.status_code == 200
+    latest = [(metric['name'], metric['value']) for metric in response.json()]
+    assert latest == [('Power', 2.0), ('Energy', 3.0)]
+
+    response = client.get('/metrics/device/0/latest')
+    assert response.status_code == 404
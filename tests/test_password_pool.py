@@ -0,0 +1,92 @@
+import asyncio
+import threading
+
+import pytest
+
+from app.core.password_pool import PasswordPoolBusy, PasswordWorkerPool
+
+
+def test_password_pool_runs_off_event_loop():
+    """Test work runs on a pool thread and stats are recorded"""
+    pool = PasswordWorkerPool(workers=2, max_queue=2)
+
+    async def main():
+        return await asyncio.gather(
+            *(pool.run(lambda: threading.current_thread().name) for _ in range(4))
+        )
+
+    names = asyncio.run(main())
+    assert all(name.startswith('password-hash') for name in names)
+    stats = pool.stats()
+    assert stats['completed'] == 4
+    assert stats['running'] == 0
+    assert stats['queued'] == 0
+
+
+def test_password_pool_rejects_when_full():
+    """Test calls beyond workers + max_queue fail fast"""
+    pool = PasswordWorkerPool(workers=1, max_queue=1)
+    release = threading.Event()
+
+    async def main():
+        blocked = [asyncio.ensure_future(pool.run(release.wait, 5)) for _ in range(2)]
+        await asyncio.sleep(0.05)
+        with pytest.raises(PasswordPoolBusy):
+            await pool.run(lambda: None)
+        release.set()
+        await asyncio.gather(*blocked)
+
+    asyncio.run(main())
+    assert pool.stats()['rejected'] == 1
+    assert pool.stats()['completed'] == 2
+
+
+def test_password_pool_cancelled_caller_keeps_slot():
+    """Test a running job counts against the limit after its caller is gone"""
+    pool = PasswordWorkerPool(workers=1, max_queue=0)
+    release = threading.Event()
+
+    async def main():
+        first = asyncio.ensure_future(pool.run(release.wait, 5))
+        await asyncio.sleep(0.05)
+        first.cancel()
+        await asyncio.sleep(0.05)
+        # The job still runs on the only worker, so there is no room
+        with pytest.raises(PasswordPoolBusy):
+            await pool.run(lambda: None)
+        assert pool.stats()['running'] == 1
+        assert pool.stats()['queued'] == 0
+        assert pool.stats()['completed'] == 0
+
+        release.set()
+        while pool.stats()['running']:
+            await asyncio.sleep(0.01)
+        await pool.run(lambda: None)
+
+    asyncio.run(main())
+    assert pool.stats()['completed'] == 2
+
+
+def test_password_pool_counts_failures_and_cancellations():
+    """Test failed jobs and jobs cancelled while queued are counted apart"""
+    pool = PasswordWorkerPool(workers=1, max_queue=1)
+    release = threading.Event()
+
+    def fail():
+        raise RuntimeError('bad hash')
+
+    async def main():
+        with pytest.raises(RuntimeError):
+            await pool.run(fail)
+        running = asyncio.ensure_future(pool.run(release.wait, 5))
+        queued = asyncio.ensure_future(pool.run(lambda: None))
+        await asyncio.sleep(0.05)
+        queued.cancel()
+        await asyncio.sleep(0.05)
+        release.set()
+        await running
+
+    asyncio.run(main())
+    stats = pool.stats()
+    assert (stats['completed'], stats['failed'], stats['cancelled']) == (1, 1, 1)
+    assert stats['queued'] == 0
@@ -0,0 +1,73 @@
+import pytest
+from sqlalchemy import exc, text
+from sqlalchemy.engine import make_url
+
+from app.core.database import create_job_engine, engine, statement_timeout_args
+from app.core.pool_stats import pool_stats
+
+from settings import DATABASE_URL
+
+
+@pytest.fixture(scope='function')
+def small_engine():
+    """A one-connection engine that gives up waiting almost at once"""
+    small_engine = create_job_engine(
+        DATABASE_URL,
+        role='small',
+        pool_options={'pool_size': 1, 'max_overflow': 0, 'pool_timeout': 0.05},
+        statement_timeout_ms=1234,
+    )
+    yield small_engine
+    small_engine.dispose()
+    pool_stats.pop('small')
+
+
+def test_pool_stats_count_checkouts_and_timeouts(small_engine):
+    """Test the stats follow checkouts, checkins and timed out checkouts"""
+    stats = pool_stats['small']
+    with small_engine.connect():
+        assert stats.snapshot()['checked_out'] == 1
+        with pytest.raises(exc.TimeoutError):
+            small_engine.connect()
+
+    snapshot = stats.snapshot()
+    assert snapshot['checked_out'] == 0
+    assert snapshot['size'] == 1
+    assert snapshot['overflow'] == 0
+    assert snapshot['connections_opened'] == 1
+    assert snapshot['timeouts'] == 1
+    assert snapshot['wait_seconds']['count'] == 2
+    # The timed out checkout waited for the pool timeout
+    assert snapshot['wait_seconds']['sum'] >= 0.05
+    assert snapshot['wait_seconds']['buckets'][-1] == (float('inf'), 2)
+
+
+def test_pool_stats_survive_dispose(small_engine):
+    """Test the pool an engine recreates on dispose keeps its stats"""
+    with small_engine.connect():
+        pass
+    small_engine.dispose()
+    with small_engine.connect():
+        pass
+    assert pool_stats['small'].snapshot()['wait_seconds']['count'] == 2
+    assert 'jobs' in pool_stats and pool_stats['jobs'].engine is engine
+
+
+def test_statement_timeout_per_role(small_engine):
+    """Test the engine's role statement_timeout is set on its connections"""
+    if make_url(DATABASE_URL).get_backend_name() != 'postgresql':
+        pytest.skip('statement_timeout is a Postgres setting')
+    with small_engine.connect() as connection:
+        assert connection.scalar(text('SHOW statement_timeout')) == '1234ms'
+
+
+def test_statement_timeout_args():
+    """Test the timeout is passed the way each Postgres driver expects"""
+    assert statement_timeout_args('postgresql+asyncpg://db/app', 500) == {
+        'server_settings': {'statement_timeout': '500'}
+    }
+    assert statement_timeout_args('postgresql://db/app', 500) == {
+        'options': '-c statement_timeout=500'
+    }
+    assert statement_timeout_args('postgresql://db/app', 0) == {}
+    assert statement_timeout_args('sqlite:///app.db', 500) == {}
@@ -0,0 +1,112 @@
+import asyncio
+import contextvars
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy.orm import Session
+
+from app.main import app
+from app.core import auth
+from app.core.auth import get_password_hash
+from app.core.database import Base, engine
+from app.models.user import User, UserRole
+from app.schemas.user import UserUpdate
+from app.services import user_service
+
+# Create test client
+client = TestClient(app)
+
+TEST_USER = {
+    'username': 'cacheduser',
+    'email': 'cached@example.com',
+    'hashed_password': get_password_hash('testpass'),
+    'role': UserRole.STANDARD,
+}
+
+
+@pytest.fixture(scope='function')
+def db_session():
+    Base.metadata.create_all(bind=engine)
+    session = Session(engine)
+    try:
+        yield session
+    finally:
+        session.close()
+        auth._principal_cache.clear()
+        Base.metadata.drop_all(bind=engine)
+
+
+@pytest.fixture(scope='function')
+def test_user(db_session: Session):
+    user = User(**TEST_USER)
+    db_session.add(user)
+    db_session.commit()
+    return user
+
+
+@pytest.fixture(scope='function')
+def loads(monkeypatch):
+    """Usernames passed to every principal load"""
+    loads = []
+    load_principal = auth._load_principal
+
+    async def counting_load(username):
+        loads.append(username)
+        return await load_principal(username)
+
+    monkeypatch.setattr(auth, '_load_principal', counting_load)
+    return loads
+
+
+def _login(user: User) -> dict:
+    response = client.post(
+        '/auth/token', data={'username': user.username, 'password': 'testpass'}
+    )
+    return {'Authorization': f"Bearer {response.json()['access_token']}"}
+
+
+def test_principal_cached_per_token(test_user: User, loads: list):
+    """Test repeated requests with one token load the principal once"""
+    headers = _login(test_user)
+
+    assert client.get('/auth/me', headers=headers).status_code == 200
+    assert client.get('/auth/me', headers=headers).status_code == 200
+    assert loads == [test_user.username]
+
+
+def test_cached_principal_invalidated_by_update(test_user: User, loads: list):
+    """Test updating a user drops its cached principal"""
+    headers = _login(test_user)
+    assert client.get('/auth/me', headers=headers).status_code == 200
+
+    asyncio.run(user_service.update_user(test_user.id, UserUpdate(is_active=False)))
+
+    response = client.get('/auth/me', headers=headers)
+    assert response.status_code == 400
+    assert 'Inactive user' in response.json()['detail']
+    assert len(loads) == 2
+
+
+def test_principal_updated_while_loading_not_cached(test_user: User, monkeypatch):
+    """Test a principal loaded before a concurrent update is not cached"""
+    load_principal = auth._load_principal
+
+    async def load_then_update(username):
+        principal = await load_principal(username)
+        # Another request deactivates the user between the load and the
+        # cache store, in its own session
+        await asyncio.create_task(
+            user_service.update_user(test_user.id, UserUpdate(is_active=False)),
+            context=contextvars.Context(),
+        )
+        return principal
+
+    monkeypatch.setattr(auth, '_load_principal', load_then_update)
+    headers = _login(test_user)
+    # This request still saw the user as it was when it started
+    assert client.get('/auth/me', headers=headers).status_code == 200
+
+    monkeypatch.setattr(auth, '_load_principal', load_principal)
+    response = client.get('/auth/me', headers=headers)
+    assert response.status_code == 400
+    assert 'Inactive user' in response.json()['detail']
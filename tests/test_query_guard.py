@@ -0,0 +1,120 @@
+import asyncio
+import logging
+from collections import Counter
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy.orm import Session
+
+from app.main import app
+from app.core import auth, query_guard
+from app.core.auth import get_password_hash
+from app.core.database import Base, engine
+from app.core.instrumentation import record_queries
+from app.core.query_guard import QueryGuardError, check_queries, statement_shape
+from app.models.device import Device
+from app.models.metric import Metric
+from app.models.site import Site
+from app.models.subscription import Subscription
+from app.models.user import User, UserRole
+from app.routers.metric_router import get_device_latest_metrics
+from app.services import metric_service
+
+# Create test client
+client = TestClient(app)
+
+
+@pytest.fixture(scope='function')
+def db_session():
+    Base.metadata.create_all(bind=engine)
+    session = Session(engine)
+    try:
+        yield session
+    finally:
+        session.close()
+        auth._principal_cache.clear()
+        Base.metadata.drop_all(bind=engine)
+
+
+@pytest.fixture(scope='function')
+def subscription(db_session: Session) -> Subscription:
+    """A subscription to 40 of 80 metrics, named 10 ways, of 8 devices at 4 sites"""
+    sites = [Site(name=f'Site {i}') for i in range(4)]
+    devices = [
+        Device(name=f'Meter {i}', type='sensor', site=sites[i % 4]) for i in range(8)
+    ]
+    metrics = [
+        Metric(name=f'Metric {i % 10}', unit='kW', value=1.0, device=devices[i % 8])
+        for i in range(80)
+    ]
+    user = User(
+        username='subscriber',
+        email='subscriber@example.com',
+        hashed_password=get_password_hash('testpass'),
+        role=UserRole.STANDARD,
+    )
+    user.authorized_sites = sites
+    subscription = Subscription(name='Dashboard', user=user, metrics=metrics[:40])
+    db_session.add_all(metrics + [subscription])
+    db_session.commit()
+    return subscription
+
+
+def test_statement_shape():
+    """Test statements differing only in parameters have the same shape"""
+    assert statement_shape(
+        'SELECT a FROM t\n  WHERE id IN ($1::INTEGER, $2::INTEGER) AND b = $3'
+    ) == statement_shape('SELECT a FROM t WHERE id IN ($4::INTEGER) AND b = $5')
+    assert statement_shape('SELECT a FROM t WHERE id IN (?, ?, ?)') == (
+        'SELECT a FROM t WHERE id IN (?)'
+    )
+    assert statement_shape('UPDATE t SET a=%(a)s WHERE id = %s') == (
+        'UPDATE t SET a=? WHERE id = ?'
+    )
+
+
+def test_latest_metric_values_in_one_statement(subscription: Subscription):
+    """Test a device's latest values take one statement whatever its names"""
+    device_id = subscription.metrics[0].device_id
+    with record_queries() as queries:
+        latest = asyncio.run(metric_service.get_latest_metric_value(device_id))
+    assert len(latest) == 5
+    assert queries.count == 1
+
+
+def test_endpoints_within_query_budgets(subscription: Subscription):
+    """Test reads whose statements used to grow with their rows stay in budget"""
+    token = client.post(
+        '/auth/token', data={'username': 'subscriber', 'password': 'testpass'}
+    ).json()['access_token']
+    headers = {'Authorization': f'Bearer {token}'}
+    device_id = subscription.metrics[0].device_id
+    for url in (
+        '/sites/',
+        f'/metrics/device/{device_id}/latest',
+        f'/subscriptions/{subscription.id}/latest',
+        f'/subscriptions/{subscription.id}/history',
+    ):
+        # QUERY_GUARD is 'raise' in tests: a request over budget fails here
+        auth._principal_cache.clear()
+        assert client.get(url, headers=headers).status_code == 200
+
+
+def test_request_over_budget_fails(subscription: Subscription, monkeypatch):
+    """Test a request running more statements than its budget raises"""
+    monkeypatch.setattr(get_device_latest_metrics, 'query_budget', 0)
+    device_id = subscription.metrics[0].device_id
+    with pytest.raises(QueryGuardError, match='over its budget of 0'):
+        client.get(f'/metrics/device/{device_id}/latest')
+
+
+def test_repeated_statements_flagged(monkeypatch, caplog):
+    """Test the N+1 pattern raises in tests, and is logged in development"""
+    shapes = Counter({'SELECT a FROM t WHERE id = ?': 3, 'SELECT b FROM u': 1})
+    with pytest.raises(QueryGuardError, match='3 statements shaped like'):
+        check_queries('GET /things', 20, 4, shapes)
+
+    monkeypatch.setattr(query_guard, 'QUERY_GUARD', 'warn')
+    with caplog.at_level(logging.WARNING, logger=query_guard.__name__):
+        check_queries('GET /things', 20, 4, shapes)
+    assert 'GET /things ran 3 statements shaped like' in caplog.text
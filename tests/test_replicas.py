@@ -0,0 +1,124 @@
+import asyncio
+
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import Session
+
+from app.core import db_session as db_session_module
+from app.core.database import Base, create_request_engine, engine
+from app.core.db_session import get_async_db_session
+from app.core.replicas import ReplicaSet
+from app.models.site import Site
+from app.services import site_service
+
+from settings import DATABASE_URL
+
+REPLICAS = ('replica_a', 'replica_b')
+
+
+def _database_url(name: str) -> str:
+    """URL of a sibling database of DATABASE_URL on the same server"""
+    url = make_url(DATABASE_URL)
+    if url.get_backend_name() == 'sqlite':
+        return url.set(database=f'{url.database}.{name}').render_as_string(False)
+    return url.set(database=name).render_as_string(hide_password=False)
+
+
+def _create_database(name: str) -> None:
+    if make_url(DATABASE_URL).get_backend_name() != 'postgresql':
+        return
+    admin = create_engine(DATABASE_URL, isolation_level='AUTOCOMMIT')
+    with admin.connect() as connection:
+        exists = connection.scalar(
+            text('SELECT 1 FROM pg_database WHERE datname = :name'), {'name': name}
+        )
+        if not exists:
+            connection.execute(text(f'CREATE DATABASE {name}'))
+    admin.dispose()
+
+
+@pytest.fixture(scope='function')
+def db_session():
+    Base.metadata.create_all(bind=engine)
+    session = Session(engine)
+    session.add(Site(name='primary'))
+    session.commit()
+    try:
+        yield session
+    finally:
+        session.close()
+        Base.metadata.drop_all(bind=engine)
+
+
+@pytest.fixture(scope='function')
+def replicas(db_session: Session, monkeypatch):
+    """Two stand-in replicas, each holding one site named after it"""
+    sync_engines = []
+    for name in REPLICAS:
+        _create_database(name)
+        replica_engine = create_engine(_database_url(name))
+        Base.metadata.create_all(bind=replica_engine)
+        with Session(replica_engine) as session:
+            session.add(Site(name=name))
+            session.commit()
+        sync_engines.append(replica_engine)
+
+    replica_set = ReplicaSet(
+        [create_request_engine(_database_url(name), role=name) for name in REPLICAS],
+        max_lag_seconds=5,
+        lag_check_seconds=60,
+    )
+    monkeypatch.setattr(db_session_module, 'replicas', replica_set)
+    yield replica_set
+
+    asyncio.run(replica_set.dispose())
+    for replica_engine in sync_engines:
+        Base.metadata.drop_all(bind=replica_engine)
+        replica_engine.dispose()
+
+
+def _site_names() -> list[str]:
+    return [site.name for site in asyncio.run(site_service.list_sites())]
+
+
+def test_reads_balanced_round_robin(replicas: ReplicaSet):
+    """Test read-only service calls alternate between the replicas"""
+    assert [_site_names() for _ in range(3)] == [
+        ['replica_a'],
+        ['replica_b'],
+        ['replica_a'],
+    ]
+    assert replicas.stats()['reads'] == [2, 1]
+
+
+def test_lagging_replica_skipped(replicas: ReplicaSet, monkeypatch):
+    """Test reads avoid lagging replicas and fall back to the primary"""
+    lags = {'replica_a': 30.0, 'replica_b': 0.0}
+
+    async def measure_lag(engine):
+        return lags[engine.url.database.rsplit('.', 1)[-1]]
+
+    monkeypatch.setattr(replicas, '_measure_lag', measure_lag)
+    assert [_site_names() for _ in range(2)] == [['replica_b'], ['replica_b']]
+
+    lags['replica_b'] = 30.0
+    replicas._lags.clear()
+    assert _site_names() == ['primary']
+    assert replicas.stats()['fallbacks'] == 1
+
+
+def test_read_your_writes(replicas: ReplicaSet):
+    """Test reads after a write in the same unit of work use the primary"""
+
+    async def write_then_read() -> tuple[list[str], list[str]]:
+        async with get_async_db_session() as db:
+            before = [site.name for site in await site_service.list_sites()]
+            db.add(Site(name='written'))
+            await db.flush()
+            after = [site.name for site in await site_service.list_sites()]
+            return before, after
+
+    before, after = asyncio.run(write_then_read())
+    assert before == ['replica_a']
+    assert sorted(after) == ['primary', 'written']
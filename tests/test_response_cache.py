@@ -0,0 +1,151 @@
+import asyncio
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy.orm import Session
+
+from app.main import app
+from app.models.device import Device
+from app.models.site import Site
+from app.models.user import User, UserRole
+from app.core import auth
+from app.core.auth import get_password_hash
+from app.core.database import Base, engine
+from app.core.response_cache import response_cache, DEVICES, SITES
+from app.schemas.device import DeviceCreate
+from app.schemas.site import SiteCreate
+from app.services import device_service, site_service
+
+# Create test client
+client = TestClient(app)
+
+
+@pytest.fixture(scope='function')
+def db_session():
+    """Create a test database session"""
+    Base.metadata.create_all(bind=engine)
+    # IDs restart in every test, so entries of earlier tests must not match
+    response_cache.invalidate(SITES, DEVICES)
+    auth._principal_cache.clear()
+    session = Session(engine)
+    try:
+        yield session
+    finally:
+        session.close()
+        Base.metadata.drop_all(bind=engine)
+
+
+@pytest.fixture(scope='function')
+def test_site(db_session: Session):
+    """Create a test site"""
+    site = Site(name='Cached Site', location='Test Location')
+    db_session.add(site)
+    db_session.commit()
+    return site
+
+
+def test_list_sites_etag(test_site: Site):
+    """Test an unchanged site list is answered with 304"""
+    response = client.get('/sites/')
+    assert response.status_code == 200
+    etag = response.headers['etag']
+    assert etag.startswith('"')
+
+    response = client.get('/sites/', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.headers['etag'] == etag
+
+
+def test_list_sites_invalidated_by_create(test_site: Site):
+    """Test creating a site invalidates the cached list"""
+    etag = client.get('/sites/').headers['etag']
+
+    asyncio.run(site_service.create_site(SiteCreate(name='New Site')))
+
+    response = client.get('/sites/', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['etag'] != etag
+    assert {site['name'] for site in response.json()} == {'Cached Site', 'New Site'}
+
+
+@pytest.fixture(scope='function')
+def two_sites(db_session: Session):
+    """Two sites with a device each, and a standard user authorized per site"""
+    users = []
+    for name in ('North', 'South'):
+        site = Site(name=name, location='Test Location')
+        site.devices = [Device(name=f'{name} Meter', type='sensor')]
+        user = User(
+            username=name.lower(),
+            email=f'{name.lower()}@example.com',
+            hashed_password=get_password_hash('testpass'),
+            role=UserRole.STANDARD,
+        )
+        user.authorized_sites = [site]
+        db_session.add(user)
+        users.append(user)
+    db_session.commit()
+    return users
+
+
+def _login(user: User) -> dict:
+    response = client.post(
+        '/auth/token', data={'username': user.username, 'password': 'testpass'}
+    )
+    return {'Authorization': f"Bearer {response.json()['access_token']}"}
+
+
+def _device_names(headers: dict) -> set[str]:
+    response = client.get('/devices/', headers=headers)
+    assert response.status_code == 200
+    return {device['name'] for device in response.json()}
+
+
+def test_list_devices_etag(two_sites: list[User]):
+    """Test an unchanged device list is answered with 304"""
+    headers = _login(two_sites[0])
+    response = client.get('/devices/', headers=headers)
+    assert response.status_code == 200
+    etag = response.headers['etag']
+
+    response = client.get('/devices/', headers={**headers, 'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.headers['etag'] == etag
+
+
+def test_list_devices_cached_per_scope(two_sites: list[User]):
+    """Test users authorized for different sites never share an entry"""
+    north, south = (_login(user) for user in two_sites)
+
+    assert _device_names(north) == {'North Meter'}
+    assert _device_names(south) == {'South Meter'}
+    # Served from the cache, still per scope
+    assert _device_names(north) == {'North Meter'}
+
+    north_etag = client.get('/devices/', headers=north).headers['etag']
+    response = client.get('/devices/', headers={**south, 'If-None-Match': north_etag})
+    assert response.status_code == 200
+
+
+def test_list_devices_invalidated_by_mutators(two_sites: list[User]):
+    """Test creating, updating and deleting devices invalidates the list"""
+    headers = _login(two_sites[0])
+    site_id = two_sites[0].authorized_sites[0].id
+    assert _device_names(headers) == {'North Meter'}
+
+    device = asyncio.run(
+        device_service.create_device(
+            DeviceCreate(name='Inverter', type='controller', site_id=site_id)
+        )
+    )
+    assert _device_names(headers) == {'North Meter', 'Inverter'}
+
+    asyncio.run(
+        device_service.update_device(
+            device.id, DeviceCreate(name='Battery', type='controller', site_id=site_id)
+        )
+    )
+    assert _device_names(headers) == {'North Meter', 'Battery'}
+
+    asyncio.run(device_service.delete_device(device.id))
+    assert _device_names(headers) == {'North Meter'}
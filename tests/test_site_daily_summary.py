@@ -0,0 +1,194 @@
+import pytest
+from datetime import datetime, timedelta
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from app.main import app
+from app.models.device import Device
+from app.models.metric import Metric
+from app.models.site import Site
+from app.models.site_daily_summary import SummaryDirtyDay
+from app.core.database import Base, engine
+from app.services.summary_service import refresh_site_daily_summary
+
+# Create test client
+client = TestClient(app)
+
+TEST_SITE = {'name': 'Summary Site', 'location': 'Test Location'}
+
+
+@pytest.fixture(scope='function')
+def db_session():
+    """Create a test database session"""
+    Base.metadata.create_all(bind=engine)
+    session = Session(engine)
+    try:
+        yield session
+    finally:
+        session.close()
+        Base.metadata.drop_all(bind=engine)
+
+
+@pytest.fixture(scope='function')
+def test_device(db_session: Session):
+    """Create a test site with one device"""
+    site = Site(**TEST_SITE)
+    db_session.add(site)
+    db_session.commit()
+    device = Device(name='Battery', type='controller', site_id=site.id)
+    db_session.add(device)
+    db_session.commit()
+    return device
+
+
+def _add_readings(db_session: Session, device: Device, day: datetime):
+    db_session.add_all(
+        [
+            Metric(
+                name='Power', unit='kW', device_id=device.id, value=4.0, timestamp=day
+            ),
+            Metric(
+                name='Power',
+                unit='kW',
+                device_id=device.id,
+                value=9.5,
+                timestamp=day + timedelta(minutes=10),
+            ),
+            Metric(
+                name='Energy', unit='kWh', device_id=device.id, value=1.5, timestamp=day
+            ),
+            Metric(
+                name='SoC', unit='%', device_id=device.id, value=40.0, timestamp=day
+            ),
+            Metric(
+                name='SoC',
+                unit='%',
+                device_id=device.id,
+                value=80.0,
+                timestamp=day + timedelta(minutes=10),
+            ),
+        ]
+    )
+    db_session.commit()
+
+
+def test_site_daily_summary(db_session: Session, test_device: Device):
+    """Test the refreshed summary is served by the daily endpoint"""
+    today = datetime.utcnow().replace(hour=1, minute=0, second=0, microsecond=0)
+    _add_readings(db_session, test_device, today)
+
+    assert refresh_site_daily_summary() == 1
+
+    response = client.get(f'/sites/{test_device.site_id}/daily', params={'days': 7})
+    assert response.status_code == 200
+    data = response.json()
+    assert len(data) == 1
+    assert data[0]['day'] == today.date().isoformat()
+    assert data[0]['energy_kwh'] == 1.5
+    assert data[0]['peak_kw'] == 9.5
+    assert data[0]['min_soc'] == 40.0
+    assert data[0]['max_soc'] == 80.0
+    assert data[0]['reading_count'] == 5
+
+
+def test_site_daily_summary_late_data(db_session: Session, test_device: Device):
+    """Test late readings only recompute the day they belong to"""
+    today = datetime.utcnow().replace(hour=1, minute=0, second=0, microsecond=0)
+    _add_readings(db_session, test_device, today)
+    refresh_site_daily_summary()
+
+    late = today - timedelta(days=3)
+    db_session.add(
+        Metric(
+            name='Power', unit='kW', device_id=test_device.id, value=2.0, timestamp=late
+        )
+    )
+    db_session.commit()
+
+    response = client.get(f'/sites/{test_device.site_id}/daily', params={'days': 7})
+    assert len(response.json()) == 1
+
+    refresh_site_daily_summary()
+    response = client.get(f'/sites/{test_device.site_id}/daily', params={'days': 7})
+    data = response.json()
+    assert [row['day'] for row in data] == [
+        late.date().isoformat(),
+        today.date().isoformat(),
+    ]
+    assert data[0]['peak_kw'] == 2.0
+
+
+def test_metric_writes_mark_days_dirty(db_session: Session, test_device: Device):
+    """Test inserts, updates and deletes of readings mark their days dirty"""
+    today = datetime.utcnow().replace(hour=1, minute=0, second=0, microsecond=0)
+    metric = Metric(
+        name='Power', unit='kW', device_id=test_device.id, value=1.0, timestamp=today
+    )
+    db_session.add(metric)
+    db_session.commit()
+    site_id = test_device.site_id
+    assert db_session.query(SummaryDirtyDay.site_id, SummaryDirtyDay.day).all() == [
+        (site_id, today.date())
+    ]
+
+    db_session.query(SummaryDirtyDay).delete()
+    metric.timestamp = today - timedelta(days=2)
+    db_session.commit()
+    assert set(db_session.query(SummaryDirtyDay.site_id, SummaryDirtyDay.day)) == {
+        (site_id, today.date()),
+        (site_id, (today - timedelta(days=2)).date()),
+    }
+
+    db_session.query(SummaryDirtyDay).delete()
+    db_session.delete(metric)
+    db_session.commit()
+    assert db_session.query(SummaryDirtyDay.site_id, SummaryDirtyDay.day).all() == [
+        (site_id, (today - timedelta(days=2)).date())
+    ]
+
+
+def test_site_daily_summary_metric_deleted(db_session: Session, test_device: Device):
+    """Test deleting a day's only reading drops its summary row"""
+    today = datetime.utcnow().replace(hour=1, minute=0, second=0, microsecond=0)
+    _add_readings(db_session, test_device, today)
+    refresh_site_daily_summary()
+
+    for metric in db_session.query(Metric).all():
+        db_session.delete(metric)
+    db_session.commit()
+    assert refresh_site_daily_summary() == 1
+
+    response = client.get(f'/sites/{test_device.site_id}/daily', params={'days': 7})
+    assert response.json() == []
+
+
+def test_site_daily_summary_refreshed_in_batches(
+    db_session: Session, test_device: Device
+):
+    """Test a backfill of many days is refreshed a batch at a time"""
+    today = datetime.utcnow().replace(hour=1, minute=0, second=0, microsecond=0)
+    for days_ago in range(5):
+        _add_readings(db_session, test_device, today - timedelta(days=days_ago))
+
+    assert refresh_site_daily_summary(batch_days=2) == 5
+    assert db_session.query(SummaryDirtyDay).count() == 0
+    response = client.get(f'/sites/{test_device.site_id}/daily', params={'days': 7})
+    assert len(response.json()) == 5
+
+
+def test_metric_writes_marked_once_per_flush(db_session: Session, test_device: Device):
+    """Test a flush of many readings marks their days with one statement"""
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if 'summary_dirty_days' in statement:
+            statements.append(statement)
+
+    event.listen(engine, 'before_cursor_execute', record)
+    try:
+        today = datetime.utcnow().replace(hour=1, minute=0, second=0, microsecond=0)
+        _add_readings(db_session, test_device, today)
+    finally:
+        event.remove(engine, 'before_cursor_execute', record)
+    assert len(statements) == 1
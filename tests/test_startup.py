@@ -0,0 +1,80 @@
+import threading
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import event, func, inspect, select
+from sqlalchemy.orm import Session
+
+from app.main import app
+from app.core.database import Base, async_engine, engine
+from app.core.init_db import init_db
+from app.core.locks import SCHEMA_LOCK_KEY, advisory_lock
+from app.models.site import Site
+from app.models.user import User
+
+
+@pytest.fixture(scope='function')
+def empty_database():
+    Base.metadata.drop_all(bind=engine)
+    yield
+    Base.metadata.drop_all(bind=engine)
+
+
+def test_worker_startup_skips_database(empty_database):
+    """Test a worker starts and stops without touching the database"""
+    checkouts = []
+
+    def on_checkout(*args):
+        checkouts.append(args)
+
+    for pool_owner in (engine, async_engine.sync_engine):
+        event.listen(pool_owner, 'checkout', on_checkout)
+    try:
+        with TestClient(app):
+            pass
+    finally:
+        for pool_owner in (engine, async_engine.sync_engine):
+            event.remove(pool_owner, 'checkout', on_checkout)
+
+    assert checkouts == []
+    assert inspect(engine).get_table_names() == []
+
+
+def test_init_db_seeds_once(empty_database):
+    """Test setup creates the tables and seeds, and can be run again"""
+    init_db(seed=True)
+    init_db(seed=True)
+
+    with Session(engine) as session:
+        assert session.scalar(select(func.count()).select_from(User)) == 2
+        assert session.scalar(select(func.count()).select_from(Site)) == 2
+
+
+def test_init_db_waits_for_lock(empty_database):
+    """Test concurrent setup steps run one after the other"""
+    if engine.dialect.name != 'postgresql':
+        pytest.skip('advisory locks are a Postgres feature')
+
+    with advisory_lock(engine, SCHEMA_LOCK_KEY):
+        setup = threading.Thread(target=init_db)
+        setup.start()
+        setup.join(timeout=0.5)
+        # Blocked on the lock held here
+        assert setup.is_alive()
+        assert inspect(engine).get_table_names() == []
+    setup.join(timeout=10)
+    assert not setup.is_alive()
+    assert 'sites' in inspect(engine).get_table_names()
+
+
+def test_try_lock_skips_when_held():
+    """Test a non-waiting advisory lock reports a lock held elsewhere"""
+    if engine.dialect.name != 'postgresql':
+        pytest.skip('advisory locks are a Postgres feature')
+
+    with advisory_lock(engine, SCHEMA_LOCK_KEY) as held:
+        assert held
+        with advisory_lock(engine, SCHEMA_LOCK_KEY, wait=False) as acquired:
+            assert not acquired
+    with advisory_lock(engine, SCHEMA_LOCK_KEY, wait=False) as acquired:
+        assert acquired
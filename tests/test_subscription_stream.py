@@ -0,0 +1,166 @@
+import asyncio
+import importlib
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy.orm import Session
+
+from app.main import app
+from app.core import auth
+from app.core.auth import get_password_hash
+from app.core.database import Base, engine
+from app.core.db_session import current_session, with_db_session
+from app.core.live import FanOutHub, metric_hub
+from app.models.device import Device
+from app.models.metric import Metric
+from app.models.site import Site
+from app.models.subscription import Subscription
+from app.models.user import User, UserRole
+from app.schemas.metric import MetricCreate
+from app.services import metric_service
+
+# The package exports the router under the module's name
+subscription_router = importlib.import_module('app.routers.subscription_router')
+
+# Create test client
+client = TestClient(app)
+
+
+@pytest.fixture(scope='function')
+def db_session():
+    Base.metadata.create_all(bind=engine)
+    session = Session(engine)
+    try:
+        yield session
+    finally:
+        session.close()
+        auth._principal_cache.clear()
+        Base.metadata.drop_all(bind=engine)
+
+
+@pytest.fixture(scope='function')
+def test_subscription(db_session: Session):
+    """A user subscribed to one of the two metrics of a device"""
+    site = Site(name='Site', location='Test Location')
+    device = Device(name='Meter', type='sensor', site=site)
+    followed = Metric(name='Power', unit='kW', value=1.0, device=device)
+    other = Metric(name='Energy', unit='kWh', value=2.0, device=device)
+    user = User(
+        username='subscriber',
+        email='subscriber@example.com',
+        hashed_password=get_password_hash('testpass'),
+        role=UserRole.STANDARD,
+    )
+    user.authorized_sites = [site]
+    subscription = Subscription(name='Dashboard', user=user, metrics=[followed])
+    db_session.add_all([subscription, other])
+    db_session.commit()
+    return subscription
+
+
+def _login(username: str) -> dict:
+    response = client.post(
+        '/auth/token', data={'username': username, 'password': 'testpass'}
+    )
+    return {'Authorization': f"Bearer {response.json()['access_token']}"}
+
+
+def _update(metric: Metric, value: float) -> MetricCreate:
+    return MetricCreate(
+        name=metric.name, unit=metric.unit, value=value, device_id=metric.device_id
+    )
+
+
+def test_committed_changes_reach_followers(test_subscription: Subscription):
+    """Test a client gets the committed changes of the metrics it follows"""
+    followed = test_subscription.metrics[0]
+    other = next(m for m in followed.device.metrics if m.id != followed.id)
+
+    async def follow() -> list[dict]:
+        stream = metric_hub.connect([followed.id])
+        try:
+            await metric_service.update_metric(other.id, _update(other, 5.0))
+            await metric_service.update_metric(followed.id, _update(followed, 7.5))
+            return await asyncio.wait_for(stream.next_changes(), 5)
+        finally:
+            metric_hub.disconnect(stream)
+
+    changes = asyncio.run(follow())
+    assert [(c['metric_id'], c['value']) for c in changes] == [(followed.id, 7.5)]
+    assert metric_hub.stats()['clients'] == 0
+
+
+def test_rolled_back_changes_not_published(test_subscription: Subscription):
+    """Test writes of a rolled back transaction never reach clients"""
+    followed = test_subscription.metrics[0]
+
+    @with_db_session
+    async def failed_write():
+        metric = await current_session().get(Metric, followed.id)
+        metric.value = 99.0
+        await current_session().flush()
+        raise ValueError('rolled back')
+
+    async def follow():
+        stream = metric_hub.connect([followed.id])
+        try:
+            with pytest.raises(ValueError):
+                await failed_write()
+            await metric_service.delete_metric(followed.id)
+            return await asyncio.wait_for(stream.next_changes(), 5)
+        finally:
+            metric_hub.disconnect(stream)
+
+    assert asyncio.run(follow()) == [{'metric_id': followed.id, 'deleted': True}]
+
+
+def test_slow_client_dropped():
+    """Test a client with a full buffer is dropped, others keep receiving"""
+    hub = FanOutHub(buffer_size=2)
+
+    async def publish() -> tuple[list, list]:
+        slow, fast = hub.connect([1]), hub.connect([1])
+        received = []
+        for value in range(3):
+            hub.publish([{'metric_id': 1, 'value': value}])
+            await asyncio.sleep(0)
+            received.append(await fast.next_changes())
+        return [await slow.next_changes()], received
+
+    slow_batches, fast_batches = asyncio.run(publish())
+    assert slow_batches == [None]
+    assert [batch[0]['value'] for batch in fast_batches] == [0, 1, 2]
+    assert hub.stats()['dropped'] == 1
+
+
+def test_stream_starts_with_snapshot(test_subscription: Subscription, monkeypatch):
+    """Test the stream opens with the latest values of the subscription"""
+    monkeypatch.setattr(subscription_router, 'STREAM_MAX_SECONDS', 0.1)
+    headers = _login('subscriber')
+
+    response = client.get(
+        f'/subscriptions/{test_subscription.id}/stream', headers=headers
+    )
+    assert response.status_code == 200
+    assert response.headers['content-type'].startswith('text/event-stream')
+    first_event = response.text.split('\n\n')[0].split('\n')
+    assert first_event[0] == 'event: snapshot'
+    assert '"value":1.0' in first_event[1]
+
+
+def test_stream_owner_only(test_subscription: Subscription, db_session: Session):
+    """Test other users cannot stream a subscription"""
+    db_session.add(
+        User(
+            username='other',
+            email='other@example.com',
+            hashed_password=get_password_hash('testpass'),
+            role=UserRole.STANDARD,
+        )
+    )
+    db_session.commit()
+
+    response = client.get(
+        f'/subscriptions/{test_subscription.id}/stream', headers=_login('other')
+    )
+    assert response.status_code == 403
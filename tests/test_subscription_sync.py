@@ -0,0 +1,147 @@
+import asyncio
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy.orm import Session
+
+from app.main import app
+from app.core import auth
+from app.core.auth import get_password_hash
+from app.core.database import Base, engine
+from app.models.device import Device
+from app.models.metric import Metric
+from app.models.site import Site
+from app.models.subscription import Subscription
+from app.models.user import User, UserRole
+from app.schemas.metric import MetricCreate
+from app.services import metric_service
+
+# Create test client
+client = TestClient(app)
+
+
+@pytest.fixture(scope='function')
+def db_session():
+    Base.metadata.create_all(bind=engine)
+    session = Session(engine)
+    try:
+        yield session
+    finally:
+        session.close()
+        auth._principal_cache.clear()
+        Base.metadata.drop_all(bind=engine)
+
+
+@pytest.fixture(scope='function')
+def test_subscription(db_session: Session) -> Subscription:
+    """A user subscribed to 20 metrics of two devices at one site"""
+    site = Site(name='Site', location='Test Location')
+    devices = [Device(name=f'Meter {i}', type='sensor', site=site) for i in range(2)]
+    metrics = [
+        Metric(
+            name=f'Phase {i} power',
+            unit='kW',
+            value=float(i + 1),
+            device=devices[i % 2],
+        )
+        for i in range(20)
+    ]
+    user = User(
+        username='subscriber',
+        email='subscriber@example.com',
+        hashed_password=get_password_hash('testpass'),
+        role=UserRole.STANDARD,
+    )
+    user.authorized_sites = [site]
+    subscription = Subscription(name='Dashboard', user=user, metrics=metrics)
+    db_session.add(subscription)
+    db_session.commit()
+    return subscription
+
+
+def _login() -> dict:
+    response = client.post(
+        '/auth/token', data={'username': 'subscriber', 'password': 'testpass'}
+    )
+    return {'Authorization': f"Bearer {response.json()['access_token']}"}
+
+
+def _update_value(metric: Metric, value: float) -> None:
+    metric_in = MetricCreate(
+        name=metric.name, unit=metric.unit, value=value, device_id=metric.device_id
+    )
+    asyncio.run(metric_service.update_metric(metric.id, metric_in))
+
+
+def test_latest_delta_sync(test_subscription: Subscription):
+    """Test syncs after the first send only changed readings"""
+    url = f'/subscriptions/{test_subscription.id}/latest'
+    headers = _login()
+
+    first = client.get(url, params={'since': ''}, headers=headers)
+    data = first.json()
+    assert data['full'] is True
+    assert data['subscription_name'] == 'Dashboard'
+    assert len(data['sites']) == 1
+    assert len(data['devices']) == 2
+    assert len(data['metrics']) == len(data['readings']) == 20
+
+    unchanged = client.get(url, params={'since': data['cursor']}, headers=headers)
+    assert unchanged.json()['full'] is False
+    assert unchanged.json()['readings'] == unchanged.json()['metrics'] == []
+    assert unchanged.json()['cursor'] == data['cursor']
+
+    metric = test_subscription.metrics[3]
+    _update_value(metric, 42.0)
+    changed = client.get(url, params={'since': data['cursor']}, headers=headers)
+    delta = changed.json()
+    assert [(r['metric_id'], r['value']) for r in delta['readings']] == [
+        (metric.id, 42.0)
+    ]
+    assert delta['sites'] == delta['devices'] == delta['metrics'] == []
+    # Steady state refreshes are an order of magnitude smaller
+    assert len(changed.content) * 10 <= len(first.content)
+
+
+def test_latest_unknown_cursor_gets_full_sync(test_subscription: Subscription):
+    """Test an expired or foreign cursor falls back to a full sync"""
+    response = client.get(
+        f'/subscriptions/{test_subscription.id}/latest',
+        params={'since': 'expired'},
+        headers=_login(),
+    )
+    assert response.json()['full'] is True
+    assert len(response.json()['readings']) == 20
+
+
+def test_history_delta_appends_new_points(test_subscription: Subscription):
+    """Test a later history sync only sends the points after the last one"""
+    url = f'/subscriptions/{test_subscription.id}/history'
+    headers = _login()
+    params = {
+        'since': '',
+        'start_time': '2024-01-01T00:00:00Z',
+        'end_time': '2024-01-01T06:00:00Z',
+    }
+    first = client.get(url, params=params, headers=headers).json()
+    assert first['full'] is True
+    assert len(first['timestamps']) == 73
+
+    params.update(
+        since=first['cursor'],
+        start_time='2024-01-01T01:00:00Z',
+        end_time='2024-01-01T07:00:00Z',
+    )
+    later = client.get(url, params=params, headers=headers).json()
+    assert later['full'] is False
+    assert later['metrics'] == []
+    assert later['timestamps'][0] == '2024-01-01T06:05:00Z'
+    assert len(later['timestamps']) == 12
+    assert all(len(series['values']) == 12 for series in later['series'])
+
+    # Regenerated values need the whole window again
+    _update_value(test_subscription.metrics[0], 99.0)
+    params['since'] = later['cursor']
+    changed = client.get(url, params=params, headers=headers).json()
+    assert changed['full'] is True
+    assert len(changed['timestamps']) == 73
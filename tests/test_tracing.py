@@ -0,0 +1,138 @@
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.orm import Session
+
+from app.main import app
+from app.core.database import Base, engine
+from app.core.tracing import SpanExporter, tracer
+from app.models.device import Device
+from app.models.metric import Metric
+from app.models.site import Site
+
+# Create test client
+client = TestClient(app)
+
+TRACE_ID = '4bf92f3577b34da6a3ce929d0e0e4736'
+PARENT_ID = '00f067aa0ba902b7'
+
+
+@pytest.fixture(scope='function')
+def metric():
+    Base.metadata.create_all(bind=engine)
+    session = Session(engine)
+    metric = Metric(
+        name='Power',
+        unit='kW',
+        value=1.0,
+        device=Device(name='Meter', type='sensor', site=Site(name='Site A')),
+    )
+    session.add(metric)
+    session.commit()
+    try:
+        yield metric
+    finally:
+        session.close()
+        Base.metadata.drop_all(bind=engine)
+
+
+@pytest.fixture(scope='function')
+def exporter(tmp_path, monkeypatch) -> SpanExporter:
+    """Traces of sampled requests, exported to a file"""
+    exporter = SpanExporter('file', str(tmp_path / 'traces.jsonl'), 100)
+    monkeypatch.setattr(tracer, 'exporter', exporter)
+    monkeypatch.setattr(tracer, 'sample_ratio', 1.0)
+    return exporter
+
+
+def _exported(exporter: SpanExporter) -> list[dict]:
+    """Spans by name of each exported trace"""
+    assert exporter.flush(5)
+    try:
+        with open(exporter.destination) as file:
+            lines = file.readlines()
+    except FileNotFoundError:
+        return []
+    traces = []
+    for line in lines:
+        [resource] = json.loads(line)['resourceSpans']
+        [scope] = resource['scopeSpans']
+        traces.append({span['name']: span for span in scope['spans']})
+    return traces
+
+
+def _attributes(span: dict) -> dict:
+    return {
+        attribute['key']: next(iter(attribute['value'].values()))
+        for attribute in span['attributes']
+    }
+
+
+def test_history_request_trace(metric: Metric, exporter: SpanExporter):
+    """Test a history request's spans, from request to statement"""
+    response = client.get(
+        f'/metrics/{metric.id}/history',
+        params={
+            'start_time': '2024-01-01T00:00:00Z',
+            'end_time': '2024-01-01T01:00:00Z',
+        },
+    )
+    assert response.status_code == 200
+
+    [spans] = _exported(exporter)
+    root = spans['GET /metrics/{metric_id}/history']
+    assert root['kind'] == 2
+    assert 'parentSpanId' not in root
+    assert _attributes(root)['http.response.status_code'] == '200'
+
+    service = spans['metric_service.get_metric_history']
+    assert service['parentSpanId'] == root['spanId']
+    assert _attributes(service)['metric_id'] == str(metric.id)
+
+    statement = spans['SELECT']
+    assert statement['kind'] == 3
+    assert statement['parentSpanId'] == service['spanId']
+    assert 'FROM metrics' in _attributes(statement)['db.statement']
+
+    generate = spans['timeseries.generate']
+    assert generate['parentSpanId'] == service['spanId']
+    assert _attributes(generate)['points'] == '13'
+    assert spans['encode']['parentSpanId'] == root['spanId']
+    assert all(
+        int(span['startTimeUnixNano']) <= int(span['endTimeUnixNano'])
+        for span in spans.values()
+    )
+    assert {span['traceId'] for span in spans.values()} == {root['traceId']}
+
+
+def test_sampling(metric: Metric, exporter: SpanExporter, monkeypatch):
+    """Test unsampled requests export nothing, unless the caller samples them"""
+    monkeypatch.setattr(tracer, 'sample_ratio', 0.0)
+    client.get(f'/metrics/{metric.id}')
+    client.get(
+        f'/metrics/{metric.id}',
+        headers={'traceparent': f'00-{TRACE_ID}-{PARENT_ID}-00'},
+    )
+    assert _exported(exporter) == []
+
+    client.get(
+        f'/metrics/{metric.id}',
+        headers={'traceparent': f'00-{TRACE_ID}-{PARENT_ID}-01'},
+    )
+    [spans] = _exported(exporter)
+    root = spans['GET /metrics/{metric_id}']
+    assert root['traceId'] == TRACE_ID
+    assert root['parentSpanId'] == PARENT_ID
+    assert spans['metric_service.get_metric']['traceId'] == TRACE_ID
+
+
+def test_failed_span_status(exporter: SpanExporter):
+    """Test spans a failure passed through get an error status"""
+    with pytest.raises(DBAPIError):
+        # No tables: the statement fails, and with it the request
+        client.get('/metrics/1')
+    [spans] = _exported(exporter)
+    assert spans['SELECT']['status']['code'] == 2
+    assert spans['GET /metrics/{metric_id}']['status']['code'] == 2